@@ -0,0 +1,128 @@
+import re
+import shutil
+import threading
+from collections import namedtuple
+
+# Values of the 'acceleration' option: off, tuned concurrent fragments, or that plus aria2c
+ACCELERATION_MODES = ('off', 'auto', 'aria2c')
+
+# yt-dlp protocols that download in fragments and so gain from --concurrent-fragments
+FRAGMENTED_PROTOCOLS = ('m3u8', 'm3u8_native', 'http_dash_segments', 'http_dash_segments_generator', 'ism', 'f4m')
+
+# yt-dlp output for a fragment that has to be fetched again
+FRAGMENT_RETRY_PATTERN = re.compile(r'Retrying fragment|fragment \d+ not found|Skipping fragment', re.I)
+
+START_CONCURRENCY = 4
+MAX_CONCURRENCY = 16  # Also aria2c's --max-connection-per-server limit
+RETRY_SPIKE = 5       # Fragment retries in one yt-dlp run that halve the site's concurrency
+IMPROVEMENT = 1.1     # Throughput gain that counts as "more concurrency helped"
+DECAY = 0.9           # Applied to the best throughput when a step does not help, so it is probed again later
+
+
+def aria2c_available():
+    return shutil.which('aria2c') is not None
+
+
+def format_protocols(formats):
+    """Protocols of the formats a job will download, or None if unknown"""
+    if not formats:
+        return None
+    protocols = [f.get('protocol') for f in formats if f.get('protocol')]
+    return protocols or None
+
+
+class Plan(namedtuple('Plan', ['fragments', 'connections'])):
+    """Download acceleration for one yt-dlp run: concurrent fragments and aria2c connections (or None)"""
+
+    __slots__ = ()
+
+    def args(self):
+        """yt-dlp.exe arguments"""
+        args = []
+        if self.fragments > 1:
+            args.extend(['--concurrent-fragments', str(self.fragments)])
+        if self.connections:
+            args.extend(['--downloader', 'aria2c',
+                         '--downloader-args', f'aria2c:-x {self.connections} -s {self.connections} -k 1M'])
+        return args
+
+    def params(self):
+        """The same as YoutubeDL params"""
+        params = {}
+        if self.fragments > 1:
+            params['concurrent_fragment_downloads'] = self.fragments
+        if self.connections:
+            params['external_downloader'] = {'default': 'aria2c'}
+            params['external_downloader_args'] = {
+                'aria2c': ['-x', str(self.connections), '-s', str(self.connections), '-k', '1M']
+            }
+        return params
+
+
+class AccelerationTuner:
+    """Per-site fragment concurrency, tuned from the throughput of finished downloads.
+
+    Each site starts at ``start`` concurrent fragments. While doubling keeps
+    raising throughput by IMPROVEMENT it doubles again, up to ``maximum``;
+    when it stops helping the site settles at the best level seen. A burst
+    of fragment retries (the server pushing back) halves it straight away.
+    """
+
+    def __init__(self, start=START_CONCURRENCY, maximum=MAX_CONCURRENCY):
+        self.start = start
+        self.maximum = maximum
+        self._lock = threading.Lock()
+        self._hosts = {}  # host -> {'concurrency', 'best_speed', 'best_concurrency'}
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = {'concurrency': self.start, 'best_speed': 0, 'best_concurrency': self.start}
+        return state
+
+    def plan(self, host, mode, protocols=None):
+        """The Plan for a download, or None when acceleration is off or cannot help.
+
+        protocols are the selected formats' (see format_protocols); None means
+        unknown, in which case the format is assumed to be fragmented.
+        """
+        if mode not in ('auto', 'aria2c'):
+            return None
+        with self._lock:
+            concurrency = self._state(host)['concurrency']
+        fragmented = protocols is None or any(protocol in FRAGMENTED_PROTOCOLS for protocol in protocols)
+        # aria2c also splits plain HTTP(S) files into ranges
+        connections = concurrency if mode == 'aria2c' and aria2c_available() else None
+        if not fragmented and not connections:
+            return None  # A single file over HTTP gains nothing from concurrent fragments
+        return Plan(concurrency if fragmented else 1, connections)
+
+    def observe(self, host, plan, speed, retries=0):
+        """Feed back a finished run: its average throughput (bytes/s) and fragment retries"""
+        if not plan:
+            return
+        with self._lock:
+            state = self._state(host)
+            level = max(plan.fragments, plan.connections or 0)
+            if retries >= RETRY_SPIKE:
+                state['concurrency'] = max(1, level // 2)
+                state['best_speed'] = 0
+            elif speed and speed >= state['best_speed'] * IMPROVEMENT:
+                state['best_speed'] = speed
+                state['best_concurrency'] = level
+                state['concurrency'] = min(self.maximum, level * 2)
+            elif speed:
+                state['best_speed'] *= DECAY
+                state['concurrency'] = state['best_concurrency']
+
+    def back_off(self, host, plan):
+        """Halve a site's concurrency after a retry spike. Returns the new level."""
+        with self._lock:
+            state = self._state(host)
+            state['concurrency'] = max(1, min(state['concurrency'], max(plan.fragments, plan.connections or 0)) // 2)
+            state['best_speed'] = 0
+            return state['concurrency']
+
+    def stats(self):
+        with self._lock:
+            return {host: state['concurrency'] for host, state in self._hosts.items()}
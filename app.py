@@ -3,148 +3,438 @@ from flask_cors import CORS
 import subprocess
 import json
 import os
-import threading
-import queue
 import time
 import re
+import shlex
 import tempfile
 import random
+import shutil
 import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import engine
+from acceleration import FRAGMENT_RETRY_PATTERN, RETRY_SPIKE, AccelerationTuner, format_protocols
+from archive import DownloadArchive, options_fingerprint
+from asyncserver import AsyncProcess, ProcessSupervisor, asgi_available, create_asgi_app, serve
+from bandwidth import BandwidthController, parse_host_rates, parse_rate
+from cookiejar import CookieJarCache, browser_auth, browser_spec, export_browser_cookies, is_auth_failure
+from events import HEARTBEAT_FRAME, EventBus, batch_frame, parse_event_id
+from infocache import InfoCache, info_key, summarize_info
+from ingest import chunked, normalize_url, parse_options_header, read_upload
+from jobstore import UNFINISHED_STATUSES, JobStore
+from metrics import MetricsRegistry
+from playlist import MAX_DEPTH, PlaylistTracker, flat_entries, is_playlist_url
+from postprocess import AUDIO_CODECS, PostProcessQueue, embed_thumbnail, extract_audio, find_thumbnail, needs_postprocessing
+from progress import PROGRESS_ARGS, ProgressRecord, parse_progress_line
+from retry import PERMANENT, RATE_LIMITED, RETRYABLE, CircuitBreaker, RetryPolicy, classify_failure, is_error_line
+from scheduler import DownloadScheduler, Job, parse_host_limits
+from storage import DiskBudget, dir_size, estimate_size, file_size, move_tree
+from subtitles import embed_subtitles, find_subtitle_files, subtitle_args, wants_subtitles
 
 app = Flask(__name__)
 # Enable CORS for all routes
 CORS(app)
 
-# Global variables for streaming output
-output_queue = queue.Queue()
+PORT = int(os.environ.get('YTDLP_GUI_PORT', '5000'))
 
-def print_simple_progress(process, url_index, url):
-    """Print only progress bar to console in one line"""
+# HTTP server: 'threaded' is Flask's server (a thread per request and per /stream client),
+# 'asgi' runs under uvicorn with /stream and the yt-dlp.exe processes on one asyncio event loop
+SERVER = os.environ.get('YTDLP_GUI_SERVER', 'threaded').lower()
+process_supervisor = None
+if SERVER == 'asgi':
+    if asgi_available():
+        process_supervisor = ProcessSupervisor()
+    else:
+        print("uvicorn package not installed, falling back to the threaded server")
+        SERVER = 'threaded'
+
+# Event bus for streaming output to any number of /stream clients
+EVENT_BUFFER_SIZE = 500          # Events kept per job for Last-Event-ID replay
+SUBSCRIBER_QUEUE_SIZE = 1000     # Undelivered events before a client is resynced and downsampled
+PROGRESS_EVENTS_PER_SECOND = float(os.environ.get('YTDLP_GUI_PROGRESS_RATE', '2'))  # Per job; 0 disables coalescing
+STREAM_BATCH_INTERVAL = 0.1      # Minimum seconds between SSE frames per client
+event_bus = EventBus(
+    buffer_size=EVENT_BUFFER_SIZE,
+    subscriber_queue_size=SUBSCRIBER_QUEUE_SIZE,
+    progress_rate=PROGRESS_EVENTS_PER_SECOND
+)
+
+# Prometheus-style metrics served at /metrics; gauges are registered next to what they read
+metrics = MetricsRegistry(prefix='ytdlp_gui_')
+downloaded_bytes_total = metrics.counter('downloaded_bytes_total', 'Bytes downloaded by all jobs')
+attempt_failures_total = metrics.counter('attempt_failures_total', 'Failed download attempts by failure class', ['failure'])
+retries_total = metrics.counter('retries_total', 'Retries scheduled by failure class', ['failure'])
+jobs_finished_total = metrics.counter('jobs_finished_total', 'Jobs that reached a final status', ['status'])
+extraction_seconds = metrics.histogram(
+    'extraction_seconds', 'Time spent extracting metadata (download: start of an attempt until its first progress record)', ['source'])
+ttfb_seconds = metrics.histogram('time_to_first_byte_seconds', 'Start of a download attempt until the first byte arrived')
+download_seconds = metrics.histogram('download_seconds', 'Duration of successful download attempts')
+cookie_exports_total = metrics.counter('cookie_exports_total', 'Browser cookie exports into the shared jar by result', ['result'])
+postprocess_seconds = metrics.histogram('postprocess_seconds', 'Duration of the post-processing stage per job')
+
+# Download concurrency settings
+MAX_WORKERS = int(os.environ.get('YTDLP_GUI_MAX_WORKERS', '4'))  # Global worker count
+PER_HOST_LIMIT = int(os.environ.get('YTDLP_GUI_PER_HOST_LIMIT', '2'))  # Default slots per host
+HOST_LIMITS = parse_host_limits(os.environ.get('YTDLP_GUI_HOST_LIMITS', ''))  # e.g. "youtube.com=3,vimeo.com=1"
+
+# Bandwidth budgets split across running downloads; unset means unlimited
+BANDWIDTH_LIMIT = parse_rate(os.environ.get('YTDLP_GUI_BANDWIDTH', ''))  # e.g. "10M" for 10 MiB/s in total
+HOST_BANDWIDTH = parse_host_rates(os.environ.get('YTDLP_GUI_HOST_BANDWIDTH', ''))  # e.g. "youtube.com=5M"
+RATE_RESTART_INTERVAL = 15  # Minimum seconds a yt-dlp.exe process runs before it is restarted with a new limit
+
+# Failed attempts are classified (retryable / rate limited / permanent) and retried on a timer
+MAX_RETRIES = int(os.environ.get('YTDLP_GUI_MAX_RETRIES', '3'))
+RATE_LIMIT_COOLDOWN = int(os.environ.get('YTDLP_GUI_RATE_LIMIT_COOLDOWN', '60'))  # First pause of a rate-limiting site
+retry_policy = RetryPolicy(max_retries=MAX_RETRIES)
+circuit_breaker = CircuitBreaker(cooldown=RATE_LIMIT_COOLDOWN)
+
+# Persistent job table
+JOB_DB_PATH = os.environ.get('YTDLP_GUI_DB', os.path.join(os.getcwd(), 'jobs.db'))
+PROGRESS_SAVE_INTERVAL = 1.0  # Seconds between progress writes per job
+job_store = JobStore(JOB_DB_PATH)
+
+# Downloads and their post-processing run in a staging directory per job, and finished files are then
+# moved into the download path in one step. Set YTDLP_GUI_STAGING_DIR empty to download straight into it.
+STAGING_DIR = os.environ.get('YTDLP_GUI_STAGING_DIR', os.path.join(os.getcwd(), 'staging')) or None
+if STAGING_DIR:
+    STAGING_DIR = os.path.abspath(STAGING_DIR)
+    os.makedirs(STAGING_DIR, exist_ok=True)
+# Free space left alone on the staging and download filesystems; a job starts once its estimated size fits
+DISK_RESERVE = parse_rate(os.environ.get('YTDLP_GUI_DISK_RESERVE', '1G')) or 0
+
+# Download archive shared with yt-dlp's --download-archive, indexed in the job database
+ARCHIVE_DIR = os.environ.get('YTDLP_GUI_ARCHIVE_DIR', os.path.join(os.getcwd(), 'archive'))
+download_archive = DownloadArchive(JOB_DB_PATH, ARCHIVE_DIR)
+
+# Download backend: 'subprocess' runs yt-dlp.exe per attempt, 'inprocess' uses the yt_dlp API in warm worker processes
+ENGINE = os.environ.get('YTDLP_GUI_ENGINE', 'subprocess').lower()
+download_engine = None
+if ENGINE == 'inprocess':
+    if engine.yt_dlp_available():
+        # Twice the slots so subtitle side passes run next to the media downloads
+        download_engine = engine.InProcessEngine(max_workers=MAX_WORKERS * 2)
+    else:
+        print("yt_dlp Python package not installed, falling back to the yt-dlp.exe subprocess backend")
+
+# Metadata cache for /probe results, reused by /download via --load-info-json
+PROBE_WORKERS = int(os.environ.get('YTDLP_GUI_PROBE_WORKERS', '8'))
+INFO_CACHE_SIZE = int(os.environ.get('YTDLP_GUI_INFO_CACHE_SIZE', '100'))
+INFO_CACHE_TTL = int(os.environ.get('YTDLP_GUI_INFO_CACHE_TTL', '1800'))  # Stream URLs in an info dict expire
+INFO_CACHE_DIR = os.environ.get('YTDLP_GUI_INFO_CACHE_DIR') or None     # Set to persist the cache across restarts
+info_cache = InfoCache(
+    max_entries=INFO_CACHE_SIZE,
+    ttl=INFO_CACHE_TTL,
+    cache_dir=INFO_CACHE_DIR,
+    spool_dir=os.path.join(tempfile.gettempdir(), 'yt-dlp-gui-info')
+)
+PROBE_TIMEOUT = 120  # Seconds per probed URL
+DEFAULT_FORMAT = 'bestvideo*+bestaudio/best'  # yt-dlp's own default when ffmpeg can merge; sizes jobs without -f
+probe_executor = ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix='probe')
+
+# Playlist and channel URLs are flat-extracted (in probe_executor) into one child job per entry
+PLAYLIST_TIMEOUT = 600  # Seconds per flat extraction; big channels take a while
+playlists = PlaylistTracker()
+probed_playlists = set()  # URLs /probe found to hold several videos
+
+# /download/bulk parses uploads incrementally and queues them this many lines at a time
+BULK_CHUNK_SIZE = 500
+
+# ffmpeg work (audio extraction, embedding) runs after the download slot is released, in its own pool
+POSTPROCESS_WORKERS = int(os.environ.get('YTDLP_GUI_POSTPROCESS_WORKERS', '0')) or None  # Default: CPU count
+postprocess_queue = PostProcessQueue(POSTPROCESS_WORKERS)
+
+# Concurrent fragments (and aria2c connections) for jobs with the 'acceleration' option, tuned per site
+accelerator = AccelerationTuner()
+
+# Browser cookies are exported once per TTL into a shared jar instead of read by every yt-dlp run
+COOKIE_TTL = int(os.environ.get('YTDLP_GUI_COOKIE_TTL', '1800'))
+COOKIE_EXPORT_TIMEOUT = 120  # Seconds; decrypting the cookie database can wait on the OS keyring
+
+def export_cookies(browser, profile, path):
     try:
-        current_progress = 0
-        video_title = "Unknown"
+        if download_engine:
+            engine.export_browser_cookies(browser, profile, path)
+        else:
+            export_browser_cookies(browser, profile, path, COOKIE_EXPORT_TIMEOUT)
+    except Exception:
+        cookie_exports_total.inc(result='failed')
+        raise
+    cookie_exports_total.inc(result='ok')
+
+# One directory per server process, so two servers never share or delete each other's jars
+cookie_jars = CookieJarCache(tempfile.mkdtemp(prefix='yt-dlp-gui-cookies-'), export_cookies, ttl=COOKIE_TTL)
+
+# Subtitles are fetched by a --skip-download side pass next to each media download
+SUBTITLE_TIMEOUT = 300  # Seconds per subtitle pass
+subtitle_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='subtitles')
+
+# Add random user agent to avoid detection
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.107 Safari/537.36'
+]
+
+# yt-dlp lines that reveal where the output file ends up
+OUTPUT_PATH_PREFIXES = ('[download] ', '[Merger] ', '[ExtractAudio] ')
+OUTPUT_PATH_PATTERNS = [
+    re.compile(r'\[download\] Destination: (.+)$'),
+    re.compile(r'\[download\] (.+) has already been downloaded'),
+    re.compile(r'\[Merger\] Merging formats into "(.+)"$'),
+    re.compile(r'\[ExtractAudio\] Destination: (.+)$'),
+]
+TITLE_PATTERN = re.compile(r'\[youtube\] (.+): Downloading webpage')
+
+def format_bytes(num_bytes):
+    """Format a byte count the way yt-dlp prints it (e.g. 10.00MiB)"""
+    if num_bytes is None:
+        return "Unknown"
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.2f}{unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.2f}TiB"
+
+def format_eta(seconds):
+    if seconds is None:
+        return "Unknown"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+def write_progress_line(url_index, video_title, progress, size, speed, eta):
+    """Overwrite the console line with a one-line progress bar"""
+    bar_length = 30
+    filled_length = int(bar_length * progress / 100)
+    bar = '█' * filled_length + '░' * (bar_length - filled_length)
+    
+    # Print progress bar with carriage return to overwrite
+    progress_line = f"[URL {url_index + 1}] {video_title}: {progress:5.1f}% |{bar}| {size} @ {speed} ETA: {eta}"
+    sys.stdout.write(f'\r{progress_line}')
+    sys.stdout.flush()
+
+def observe_progress(job, record):
+    """Per-job timings and the byte counter, from a progress record"""
+    if job.attempt_started_at:
+        elapsed = time.monotonic() - job.attempt_started_at
+        if 'extraction' not in job.timings:
+            job.timings['extraction'] = elapsed
+            extraction_seconds.observe(elapsed, source='download')
+        if 'ttfb' not in job.timings and record.downloaded_bytes:
+            job.timings['ttfb'] = elapsed
+            ttfb_seconds.observe(elapsed)
+    
+    downloaded = record.downloaded_bytes
+    if downloaded is None:
+        return
+    # A new file (video, then audio) or a resumed one starts a new baseline
+    if job.downloaded_bytes is not None and downloaded > job.downloaded_bytes:
+        downloaded_bytes_total.inc(downloaded - job.downloaded_bytes)
+        job.attempt_bytes += downloaded - job.downloaded_bytes
+    job.downloaded_bytes = downloaded
+
+def report_progress(job, record, video_title):
+    """Apply a ProgressRecord to a job: console bar, throttled persistence and a web event"""
+    url_index, url = job.url_index, job.url
+    percent = record.percent
+    if percent is not None:
+        job.progress = percent
+    
+    if record.status == 'finished' and record.filename:
+        job.output_path = record.filename
+        job_store.update(job.id, output_path=job.output_path)
+    
+    job.download_status = record.status
+    if record.status == 'downloading':
+        bandwidth.observe(job.id, record.speed)
+    job.speed = record.speed if record.status == 'downloading' else None
+    observe_progress(job, record)
+    
+    # Persist progress, throttled to keep SQLite writes cheap
+    now = time.time()
+    if now - job.progress_saved_at >= PROGRESS_SAVE_INTERVAL:
+        job_store.update(job.id, progress=job.progress)
+        job.progress_saved_at = now
+    
+    size = format_bytes(record.total_bytes)
+    speed = format_bytes(record.speed) + '/s' if record.speed else "Unknown"
+    eta = format_eta(record.eta)
+    write_progress_line(url_index, video_title, job.progress, size, speed, eta)
+    
+    event_bus.publish({
+        'job_id': job.id,
+        'type': 'log',
+        'message': f"[download] {job.progress:5.1f}% of {size} at {speed} ETA {eta}",
+        'url_index': url_index,
+        'url': url,
+        'progress': job.progress,
+        'status': record.status,
+        'downloaded_bytes': record.downloaded_bytes,
+        'total_bytes': record.total_bytes,
+        'speed': record.speed,
+        'eta': record.eta,
+        'fragment_index': record.fragment_index,
+        'fragment_count': record.fragment_count
+    })
+    playlist_progress(job)
+
+def output_handlers(job):
+    """Build the callbacks for one yt-dlp.exe attempt: on_line(line) for every line of
+    output (bytes) and on_exit(return_code) once the process has exited"""
+    url_index, url = job.url_index, job.url
+    current_progress = 0
+    video_title = "Unknown"
+    
+    def on_line(line):
+        nonlocal current_progress, video_title
+        if not line:
+            return
+        
+        # Progress lines are JSON (see progress.PROGRESS_TEMPLATE): parse once, no regex
+        record = parse_progress_line(line)
+        if record:
+            report_progress(job, record, video_title)
+            current_progress = job.progress
+            return
+        
+        decoded_line = line.decode('utf-8', errors='replace').strip()
+        if not decoded_line:
+            return
+        
+        # Keep errors for classifying a failed attempt
+        if is_error_line(decoded_line):
+            job.error_lines.append(decoded_line)
+        if FRAGMENT_RETRY_PATTERN.search(decoded_line):
+            note_fragment_retry(job)
+        
+        # Remember the output file for the job record
+        if decoded_line.startswith(OUTPUT_PATH_PREFIXES):
+            for pattern in OUTPUT_PATH_PATTERNS:
+                path_match = pattern.search(decoded_line)
+                if path_match:
+                    job.output_path = path_match.group(1)
+                    job_store.update(job.id, output_path=job.output_path)
+                    break
         
-        # Create a thread to read output
-        def read_output():
-            nonlocal current_progress, video_title
+        # Extract video title for display
+        if video_title == "Unknown":
+            title_match = TITLE_PATTERN.search(decoded_line)
+            if title_match:
+                video_title = title_match.group(1)[:50]  # Truncate long titles
+        
+        # Send other output to web interface
+        event_bus.publish({
+            'job_id': job.id,
+            'type': 'log',
+            'message': decoded_line,
+            'url_index': url_index,
+            'url': url,
+            'progress': current_progress
+        })
+    
+    def on_exit(return_code):
+        # Clear the progress line when done
+        sys.stdout.write('\r' + ' ' * 100 + '\r')
+        sys.stdout.flush()
+        
+        # Stopped for a new rate limit; run_subprocess starts it again
+        if job.restarting and not job.cancelled:
+            return
+        
+        # Print final status
+        if return_code == 0:
+            print(f"[URL {url_index + 1}] ✓ {video_title} - Complete!")
+            event_bus.publish({
+                'job_id': job.id,
+                'type': 'complete',
+                'url_index': url_index,
+                'url': url,
+                'return_code': 0,
+                'postprocessing': needs_postprocessing(job.options),
+                'progress': 100
+            })
+        else:
+            print(f"[URL {url_index + 1}] ✗ {video_title} - Failed!")
+            event_bus.publish({
+                'job_id': job.id,
+                'type': 'complete',
+                'url_index': url_index,
+                'url': url,
+                'return_code': return_code,
+                'progress': current_progress
+            })
+    
+    return on_line, on_exit
+
+def print_simple_progress(process, job, handlers=None):
+    """Print only progress bar to console in one line"""
+    on_line, on_exit = handlers or output_handlers(job)
+    try:
+        if isinstance(process, AsyncProcess):
+            # The supervisor's event loop reads the output; only wait for the exit here
+            process.wait()
+        else:
+            # Read on the worker thread itself, no second thread per download
             for line in iter(process.stdout.readline, b''):
-                if line:
-                    decoded_line = line.decode('utf-8', errors='replace').strip()
-                    
-                    # Extract video title for display
-                    title_match = re.search(r'\[youtube\] (.+): Downloading webpage', decoded_line)
-                    if title_match:
-                        video_title = title_match.group(1)[:50]  # Truncate long titles
-                    
-                    # Only process progress lines for console display
-                    if '[download]' in decoded_line and '%' in decoded_line:
-                        # Extract progress information
-                        progress_match = re.search(r'\[download\]\s+(\d+(?:\.\d+)?)%', decoded_line)
-                        if progress_match:
-                            current_progress = float(progress_match.group(1))
-                            
-                            # Extract additional info if available
-                            size_match = re.search(r'of\s+([\d.]+\s+[KMGT]?iB)', decoded_line)
-                            speed_match = re.search(r'at\s+([\d.]+\s+[KMGT]?iB/s)', decoded_line)
-                            eta_match = re.search(r'ETA\s+([\d:]+)', decoded_line)
-                            
-                            size = size_match.group(1) if size_match else "Unknown"
-                            speed = speed_match.group(1) if speed_match else "Unknown"
-                            eta = eta_match.group(1) if eta_match else "Unknown"
-                            
-                            # Create a clean, one-line progress bar
-                            bar_length = 30
-                            filled_length = int(bar_length * current_progress / 100)
-                            bar = '█' * filled_length + '░' * (bar_length - filled_length)
-                            
-                            # Print progress bar with carriage return to overwrite
-                            progress_line = f"[URL {url_index + 1}] {video_title}: {current_progress:5.1f}% |{bar}| {size} @ {speed} ETA: {eta}"
-                            sys.stdout.write(f'\r{progress_line}')
-                            sys.stdout.flush()
-                    
-                    # Send all output to web interface
-                    output_queue.put({
-                        'type': 'log',
-                        'message': decoded_line,
-                        'url_index': url_index,
-                        'url': url,
-                        'progress': current_progress
-                    })
-            
-            # Clear the progress line when done
-            sys.stdout.write('\r' + ' ' * 100 + '\r')
-            sys.stdout.flush()
-            
+                on_line(line)
             process.wait()
-            
-            # Print final status
-            if process.returncode == 0:
-                print(f"[URL {url_index + 1}] ✓ {video_title} - Complete!")
-                output_queue.put({
-                    'type': 'complete',
-                    'url_index': url_index,
-                    'url': url,
-                    'return_code': 0,
-                    'progress': 100
-                })
-            else:
-                print(f"[URL {url_index + 1}] ✗ {video_title} - Failed!")
-                output_queue.put({
-                    'type': 'complete',
-                    'url_index': url_index,
-                    'url': url,
-                    'return_code': process.returncode,
-                    'progress': current_progress
-                })
-        
-        # Start reading output in a separate thread
-        output_thread = threading.Thread(target=read_output)
-        output_thread.daemon = True
-        output_thread.start()
-        output_thread.join()
+        on_exit(process.returncode)
         
     except Exception as e:
-        print(f"[URL {url_index + 1}] ✗ Error: {str(e)}")
-        output_queue.put({
+        print(f"[URL {job.url_index + 1}] ✗ Error: {str(e)}")
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        event_bus.publish({
+            'job_id': job.id,
             'type': 'error',
             'message': str(e),
-            'url_index': url_index,
-            'url': url,
-            'progress': current_progress
+            'url_index': job.url_index,
+            'url': job.url,
+            'progress': job.progress
         })
 
-def run_with_retry(cmd, url_index, url, max_retries=3):
-    """Run a command with retry logic and exponential backoff"""
-    retry_count = 0
-    base_delay = 2  # Base delay in seconds
-    
-    while retry_count < max_retries:
-        try:
-            # Add random delay to avoid detection
-            delay = base_delay * (2 ** retry_count) + random.uniform(0.5, 1.5)
-            if retry_count > 0:
-                print(f"[URL {url_index + 1}] Retrying in {delay:.1f} seconds... (Attempt {retry_count + 1}/{max_retries})")
-                output_queue.put({
-                    'type': 'log',
-                    'message': f"Retrying in {delay:.1f} seconds... (Attempt {retry_count + 1}/{max_retries})",
-                    'url_index': url_index,
-                    'url': url,
-                    'progress': 0
-                })
-                time.sleep(delay)
-            
-            # Add random user agent to avoid detection
-            user_agents = [
-                'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0',
-                'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.107 Safari/537.36'
-            ]
-            
-            # Add user agent to command
-            cmd_with_ua = cmd + ['--user-agent', random.choice(user_agents)]
-            
-            # Run the process
+def run_subprocess(cmd, job, user_agent):
+    """Run one yt-dlp.exe attempt and stream its output. Returns the exit code.
+
+    If the bandwidth controller changes the job's allocation, the process is
+    stopped and started again with the new --rate-limit; --continue resumes
+    the partial file.
+    """
+    while True:
+        # Add user agent, the current bandwidth allocation and fragment concurrency to command
+        cmd_with_ua = cmd + ['--user-agent', user_agent]
+        rate = bandwidth.rate(job.id)
+        if rate:
+            cmd_with_ua.extend(['--rate-limit', str(int(rate))])
+        plan = acceleration_plan(job)
+        if plan:
+            cmd_with_ua.extend(plan.args())
+        
+        if job.restarting:
+            if job.restarting == 'acceleration':
+                message = f"Resuming with {plan.fragments if plan else 1} concurrent fragment(s)"
+            else:
+                limit = f"{format_bytes(rate)}/s" if rate else "unlimited"
+                message = f"Bandwidth rebalanced, resuming at {limit}"
+            job.restarting = False
+            print(f"\n[URL {job.url_index + 1}] Restarting: {message}")
+            event_bus.publish({
+                'job_id': job.id,
+                'type': 'log',
+                'message': message,
+                'url_index': job.url_index,
+                'url': job.url,
+                'progress': job.progress
+            })
+        
+        # Run the process
+        handlers = output_handlers(job)
+        if process_supervisor:
+            process = process_supervisor.start(cmd_with_ua, handlers[0])
+        else:
             process = subprocess.Popen(
                 cmd_with_ua,
                 stdout=subprocess.PIPE,
@@ -153,35 +443,1275 @@ def run_with_retry(cmd, url_index, url, max_retries=3):
                 bufsize=1,
                 universal_newlines=False
             )
-            
-            # Print only progress bar
-            print_simple_progress(process, url_index, url)
-            
+        
+        job.process = process
+        job.process_started_at = time.time()
+        if job.cancelled:
+            process.terminate()
+        
+        # Print only progress bar
+        print_simple_progress(process, job, handlers)
+        
+        if not job.restarting or job.cancelled:
             # Return the process return code
             return process.returncode
+
+def apply_rate(job_id, rate):
+    """Bandwidth controller callback: hand a running job its new allocation.
+
+    Returns False when the change has to wait, so the controller offers it again later.
+    """
+    job = scheduler.get(job_id)
+    if not job or job.cancelled:
+        return True
+    if download_engine:
+        # Engine workers throttle with a token bucket that reads the new rate live
+        download_engine.set_rate(job_id, rate)
+        return True
+    
+    # yt-dlp.exe cannot change --rate-limit while running, so restart it
+    process = job.process
+    if not process or process.poll() is not None:
+        return True  # Picked up when the next attempt starts
+    if job.download_status != 'downloading' or time.time() - job.process_started_at < RATE_RESTART_INTERVAL:
+        # Never interrupt post-processing, and do not thrash short-lived processes
+        return False
+    job.restarting = 'bandwidth'
+    process.terminate()
+    return True
+
+def acceleration_plan(job):
+    """Choose the acceleration.Plan for the next yt-dlp run of a job (None if it has none)"""
+    info = info_cache.get_url(job.url)  # Probed metadata tells which protocol the format uses
+    job.acceleration = accelerator.plan(job.host, job.options.get('acceleration'), format_protocols(job_formats(job, info)))
+    job.fragment_retries = 0
+    return job.acceleration
+
+def note_fragment_retry(job):
+    """Count a fragment retry; a burst of them lowers the site's concurrency mid-download"""
+    job.fragment_retries += 1
+    plan = job.acceleration
+    if not plan or job.fragment_retries != RETRY_SPIKE:
+        return
+    level = accelerator.back_off(job.host, plan)
+    publish_warning(job, f"Fragment downloads keep failing, lowering concurrency for {job.host} to {level}")
+    if download_engine:
+        return  # Applies from the next attempt; YoutubeDL cannot change it while running
+    # yt-dlp.exe cannot either, so restart it (--continue resumes)
+    process = job.process
+    if process and process.poll() is None and job.download_status == 'downloading' and not job.restarting:
+        job.restarting = 'acceleration'
+        process.terminate()
+
+def observe_acceleration(job, return_code):
+    """Feed a finished attempt's throughput back to the tuner"""
+    plan = job.acceleration
+    if not plan:
+        return
+    job.acceleration = None
+    # Average speed from the first byte on, so extraction time does not count against it
+    elapsed = time.monotonic() - job.attempt_started_at - job.timings.get('ttfb', 0)
+    speed = job.attempt_bytes / elapsed if return_code == 0 and elapsed > 0 else None
+    accelerator.observe(job.host, plan, speed, job.fragment_retries)
+
+def engine_event_handler(job):
+    """Build the callback that turns in-process engine events into console and web output"""
+    url_index, url = job.url_index, job.url
+    
+    def on_event(event):
+        if event['type'] == 'log':
+            if event['level'] == 'error' or is_error_line(event['message']):
+                job.error_lines.append(event['message'])
+            if FRAGMENT_RETRY_PATTERN.search(event['message']):
+                note_fragment_retry(job)
+            event_bus.publish({
+                'job_id': job.id,
+                'type': 'warning' if event['level'] == 'warning' else 'log',
+                'message': event['message'],
+                'url_index': url_index,
+                'url': url,
+                'progress': job.progress
+            })
+        
+        elif event['type'] == 'progress':
+            report_progress(job, ProgressRecord.from_dict(event), url[-50:])
+        
+        elif event['type'] == 'postprocess' and event['status'] == 'finished' and event['filename']:
+            job.output_path = event['filename']
+            job_store.update(job.id, output_path=job.output_path)
+    
+    return on_event
+
+def run_in_engine(params, job, user_agent):
+    """Run one attempt through the in-process yt_dlp engine. Returns the yt-dlp return code."""
+    url_index, url = job.url_index, job.url
+    task = engine.EngineTask(download_engine, job.id)
+    job.process = task
+    if job.cancelled:
+        task.terminate()
+    download_engine.set_rate(job.id, bandwidth.rate(job.id))
+    
+    params = dict(params, http_headers={'User-Agent': user_agent})
+    plan = acceleration_plan(job)
+    if plan:
+        params.update(plan.params())
+    info_file = info_cache.info_file_for_url(url)
+    return_code, error = download_engine.run(job.id, url, params, engine_event_handler(job), task, info_file)
+    
+    # Clear the progress line when done
+    sys.stdout.write('\r' + ' ' * 100 + '\r')
+    sys.stdout.flush()
+    
+    if return_code == 0:
+        print(f"[URL {url_index + 1}] ✓ {url} - Complete!")
+    else:
+        print(f"[URL {url_index + 1}] ✗ {url} - Failed!")
+        job.error = error
+        if error:
+            job.error_lines.append(error)
+            event_bus.publish({
+                'job_id': job.id,
+                'type': 'log',
+                'message': error,
+                'url_index': url_index,
+                'url': url,
+                'progress': job.progress
+            })
+    event_bus.publish({
+        'job_id': job.id,
+        'type': 'complete',
+        'url_index': url_index,
+        'url': url,
+        'return_code': return_code,
+        'postprocessing': return_code == 0 and needs_postprocessing(job.options),
+        'progress': 100 if return_code == 0 else job.progress
+    })
+    return return_code
+
+def run_attempt(cmd, job, runner=run_subprocess):
+    """Run one download attempt. Returns the yt-dlp return code.
+
+    runner is run_subprocess for a yt-dlp command line or run_in_engine for
+    YoutubeDL params. Retries are not made here: run_job classifies the
+    failure and reschedules the job, so a waiting job holds no worker.
+    """
+    if job.cancelled:
+        return 1
+    job.error = None
+    job.error_lines.clear()
+    job.attempts += 1
+    job.attempt_started_at = time.monotonic()
+    job.downloaded_bytes = None
+    job.attempt_bytes = 0
+    for stage in ('extraction', 'ttfb', 'download'):
+        job.timings.pop(stage, None)
+    job_store.update(job.id, attempts=job.attempts)
+    try:
+        return runner(cmd, job, random.choice(USER_AGENTS))
+    except Exception as e:
+        print(f"[URL {job.url_index + 1}] Error occurred: {str(e)}")
+        job.error_lines.append(str(e))
+        event_bus.publish({
+            'job_id': job.id,
+            'type': 'warning',
+            'message': f"Error occurred: {str(e)}",
+            'url_index': job.url_index,
+            'url': job.url,
+            'progress': job.progress
+        })
+        return 1
+    finally:
+        discard_cookie_file(cmd)
+
+def cookie_file_for(options):
+    """A private copy of the shared browser cookie jar for one yt-dlp run, or None"""
+    browser = browser_auth(options)
+    return cookie_jars.copy_for(*browser) if browser else None
+
+def discard_cookie_file(run):
+    """Delete the cookie copy of a finished run, given its command line or engine params"""
+    if isinstance(run, dict):
+        path = run.get('cookiefile')
+    else:
+        path = run[run.index('--cookies') + 1] if '--cookies' in run else None
+    if path:
+        cookie_jars.discard(path)
+
+def refresh_cookies(job):
+    """After an authentication failure, make the next attempt export fresh browser cookies.
+
+    Returns True when that attempt will have newer cookies than the failed one.
+    """
+    browser = browser_auth(job.options)
+    if not browser or not is_auth_failure(job.error_lines):
+        return False
+    if not cookie_jars.invalidate(*browser, job.attempt_started_at):
+        return False
+    print(f"[URL {job.url_index + 1}] Authentication failed, retrying with freshly exported cookies")
+    return True
+
+def build_network_args(options):
+    """yt-dlp arguments for authentication and proxy settings, shared by downloads and probes"""
+    cmd = []
+    
+    # Add authentication settings
+    auth = options.get('authentication', {})
+    if auth.get('enabled'):
+        method = auth.get('method')
+        
+        if method == 'browser' and auth.get('browser'):
+            # Browser cookies authentication, from the shared jar when it could be exported
+            cookie_file = cookie_file_for(options)
+            if cookie_file:
+                cmd.extend(['--cookies', cookie_file])
+            else:
+                cmd.extend(['--cookies-from-browser', browser_spec(auth.get('browser'), auth.get('profile'))])
         
+        elif method == 'manual' and auth.get('username') and auth.get('password'):
+            # Manual login authentication
+            cmd.extend(['--username', auth.get('username')])
+            cmd.extend(['--password', auth.get('password')])
+            
+            if auth.get('twoFactor'):
+                cmd.extend(['--twofactor', auth.get('twoFactor')])
+        
+        elif method == 'file' and auth.get('cookieFile'):
+            # Cookie file authentication
+            cookie_file_path = os.path.join(os.getcwd(), auth.get('cookieFile'))
+            if os.path.exists(cookie_file_path):
+                cmd.extend(['--cookies', cookie_file_path])
+    
+    # Add proxy settings
+    proxy = options.get('proxy', {})
+    if proxy.get('enabled'):
+        proxy_url = f"{proxy['type']}://"
+        if proxy.get('username') and proxy.get('password'):
+            proxy_url += f"{proxy['username']}:{proxy['password']}@"
+        proxy_url += f"{proxy['host']}:{proxy['port']}"
+        cmd.extend(['--proxy', proxy_url])
+        
+        if proxy.get('bypass'):
+            cmd.extend(['--proxy-bypass', proxy['bypass']])
+    
+    return cmd
+
+def build_output_args(options, home=None):
+    """yt-dlp arguments for where files go, shared by the media and subtitle passes"""
+    cmd = []
+    
+    # Add output template
+    if options.get('outputTemplate'):
+        cmd.extend(['-o', options['outputTemplate']])
+    
+    # Add download path (home is the job's staging directory, when there is one)
+    if home or options.get('downloadPath'):
+        download_path = home or options['downloadPath']
+        if not os.path.exists(download_path):
+            os.makedirs(download_path, exist_ok=True)
+        cmd.extend(['-P', download_path])
+    
+    return cmd
+
+def build_url_args(url_string):
+    """The URL, or probed metadata for it so the page is not extracted again"""
+    info_file = info_cache.info_file_for_url(url_string)
+    if info_file:
+        return ['--load-info-json', info_file]
+    return [url_string]
+
+def build_command(url_string, options, home=None, archive_file=None):
+    """Build the yt-dlp command line for the media download of one URL.
+
+    Subtitles are not part of it; see build_subtitle_command(). home
+    replaces the download path (see staging_path()) and archive_file the
+    download archive (see archive_file_for()).
+    """
+    # Build the command
+    cmd = ['yt-dlp.exe']
+    cmd.extend(['--ignore-config', '--continue', '--no-overwrites', '--mtime'])
+    cmd.extend(['--download-archive', archive_file or download_archive.file_for(options_fingerprint(options))])
+    
+    # Add retry options (--rate-limit is added per attempt from the bandwidth budget)
+    cmd.extend(['--retries', '10'])     # Increase retry count
+    cmd.extend(['--fragment-retries', '10'])  # Retry failed fragments
+    
+    # Add console output options
+    cmd.extend(['--no-colors'])  # Remove colors for cleaner console output
+    cmd.extend(PROGRESS_ARGS)      # One JSON progress record per line
+    
+    # Add authentication and proxy settings
+    cmd.extend(build_network_args(options))
+    
+    # Add format/quality options
+    format_type = options.get('format')
+    selection = format_selection(options)
+    if selection:
+        cmd.extend(['-f', selection])
+    
+    # Add output format; audio extraction happens in the post-processing stage
+    if format_type and format_type not in AUDIO_CODECS:
+        cmd.extend(['--merge-output-format', format_type])  # Merging is a stream copy
+    
+    # Add additional options (the thumbnail is embedded in the post-processing stage)
+    if options.get('embedThumb') or options.get('writeThumbnail'):
+        cmd.append('--write-thumbnail')
+    if options.get('writeDesc'):
+        cmd.append('--write-description')
+    if options.get('writeMeta'):
+        cmd.append('--write-info-json')
+    if options.get('writeComments'):
+        cmd.append('--write-comments')
+    
+    # Add output location and the URL
+    cmd.extend(build_output_args(options, home))
+    if home:
+        cmd.extend(['--exec', 'before_dl:' + adopt_command(home, options)])
+    cmd.extend(build_url_args(url_string))
+
+    return cmd
+
+def format_selection(options):
+    """The -f of a download, or None for yt-dlp's default"""
+    if options.get('quality'):
+        return options['quality']
+    if options.get('format') in AUDIO_CODECS:
+        return 'bestaudio/best'  # What -x would pick
+    return None
+
+def job_formats(job, info):
+    """The formats a job's own selection picks from probed metadata, or None if that cannot be told.
+
+    The probe may have run with other options, so its requested_formats only
+    stand in without yt_dlp, when the job uses the default selection as the
+    yt-dlp.exe probe does.
+    """
+    if not info:
+        return None
+    spec = format_selection(job.options)
+    formats = engine.select_formats(info, spec or DEFAULT_FORMAT)
+    if formats is None and not spec and not engine.yt_dlp_available():
+        formats = info.get('requested_formats') or [info]
+    return formats
+
+def adopt_command(home, options):
+    """Shell command yt-dlp runs before each download to bring in what the download path
+    already has (see storage.adopt_existing()); yt-dlp appends the file name"""
+    args = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'storage.py'),
+            'adopt', home, os.path.abspath(final_dir(options))]
+    if options.get('format') in AUDIO_CODECS:
+        args.append(AUDIO_CODECS[options['format']][0])  # Also adopt the extracted audio file
+    command = subprocess.list2cmdline(args) if os.name == 'nt' else shlex.join(args)
+    return command.replace('%', '%%')  # yt-dlp expands output template fields in it
+
+def build_subtitle_command(url_string, options, home=None):
+    """Build the lightweight --skip-download command that only fetches subtitles"""
+    cmd = ['yt-dlp.exe', '--ignore-config', '--no-colors', '--no-progress']
+    cmd.extend(['--retries', '10'])
+    cmd.extend(build_network_args(options))
+    cmd.extend(subtitle_args(options))
+    cmd.extend(build_output_args(options, home))
+    cmd.extend(build_url_args(url_string))
+    return cmd
+
+def fetch_subtitles(job):
+    """Subtitle-only side pass for a job, run in subtitle_executor.
+
+    The pass takes a slot of the job's host like a download does. Returns None
+    without fetching anything if the host has no free slot or its circuit is
+    open; finish_subtitles() then runs the pass after the media download.
+    """
+    if not scheduler.acquire_slot(job.host):
+        return None
+    try:
+        return run_subtitle_pass(job)
+    finally:
+        scheduler.release_slot(job.host)
+
+def run_subtitle_pass(job):
+    """Run the subtitle-only yt-dlp pass for a job. Returns True on success."""
+    url_index, url, options = job.url_index, job.url, job.options
+    run = None
+    try:
+        if download_engine:
+            messages = []
+            
+            def on_event(event):
+                if event['type'] == 'log' and event['level'] in ('warning', 'error'):
+                    messages.append(event['message'])
+            
+            params = run = dict(engine.subtitle_params(options, cookie_file_for(options)), http_headers={'User-Agent': random.choice(USER_AGENTS)})
+            if staging_path(job.id):
+                params['paths'] = {'home': staging_path(job.id)}
+            return_code, error = download_engine.run(
+                f'{job.id}-subs', url, params, on_event, info_file=info_cache.info_file_for_url(url)
+            )
+            if error:
+                messages.append(error)
+        else:
+            cmd = run = build_subtitle_command(url, options, staging_path(job.id)) + ['--user-agent', random.choice(USER_AGENTS)]
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=SUBTITLE_TIMEOUT)
+            return_code = result.returncode
+            output = result.stdout.decode('utf-8', errors='replace').splitlines()
+            messages = [line for line in output if line.startswith(('ERROR', 'WARNING'))]
+    except Exception as e:
+        return_code, messages = 1, [str(e)]
+    finally:
+        if run:
+            discard_cookie_file(run)
+    
+    if return_code == 0:
+        print(f"[URL {url_index + 1}] Subtitles fetched")
+        return True
+    
+    reason = messages[-1] if messages else f"yt-dlp exited with code {return_code}"
+    print(f"[URL {url_index + 1}] Subtitle download failed: {reason}")
+    event_bus.publish({
+        'job_id': job.id,
+        'type': 'warning',
+        'message': f"Subtitle download failed, the video is downloaded without them: {reason}",
+        'url_index': url_index,
+        'url': url,
+        'progress': job.progress
+    })
+    return False
+
+def start_subtitles(job):
+    """Start the subtitle side pass unless one is running or already succeeded"""
+    if not wants_subtitles(job.options):
+        return
+    previous = job.subtitles
+    if previous and (not previous.done() or previous.result()):
+        return
+    if circuit_breaker.blocked_for(job.host):
+        # Left to finish_subtitles() rather than adding a request to a host that is rate limiting us
+        job.subtitles = None
+        return
+    job.subtitles = subtitle_executor.submit(fetch_subtitles, job)
+
+def finish_subtitles(job, slot_held=False):
+    """After a successful media download: wait for the subtitle pass and embed its files if requested.
+
+    A pass that was deferred (see fetch_subtitles) runs here, on the job's own
+    slot when the caller still holds it (slot_held). Called from the
+    post-processing stage when subtitles are embedded.
+    """
+    if not wants_subtitles(job.options):
+        return
+    try:
+        fetched = job.subtitles.result(timeout=SUBTITLE_TIMEOUT) if job.subtitles else None
+    except Exception:
+        fetched = False
+    if fetched is None and not job.cancelled:
+        if slot_held:
+            fetched = run_subtitle_pass(job)
+        elif scheduler.acquire_slot(job.host, timeout=SUBTITLE_TIMEOUT):
+            try:
+                fetched = run_subtitle_pass(job)
+            finally:
+                scheduler.release_slot(job.host)
+        else:
+            publish_warning(job, f"Subtitles skipped: no free slot for {job.host}")
+    if not fetched or not job.options.get('embedSubs') or job.cancelled:
+        return
+    
+    media_path = job.output_path
+    subtitle_files = find_subtitle_files(media_path) if media_path else {}
+    if not subtitle_files:
+        return
+    try:
+        embedded = embed_subtitles(media_path, subtitle_files)
+    except Exception as e:
+        message = f"Could not embed subtitles: {str(e)}"
+    else:
+        message = f"Embedded {len(embedded)} subtitle track(s)"
+        if not job.options.get('writeSub'):
+            # Only asked to embed them, so do not leave the files behind
+            for path in embedded:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    print(f"[URL {job.url_index + 1}] {message}")
+    event_bus.publish({
+        'job_id': job.id,
+        'type': 'log',
+        'message': message,
+        'url_index': job.url_index,
+        'url': job.url,
+        'progress': job.progress
+    })
+
+def start_download(job):
+    """Make one attempt at a URL, with subtitles fetched by a side pass next to it.
+
+    Returns the yt-dlp return code of the media download; a subtitle failure
+    only produces a warning. ffmpeg work is left to postprocess_job().
+    """
+    url_index, url_string, options = job.url_index, job.url, job.options
+    try:
+        start_subtitles(job)
+        if download_engine:
+            params = engine.params_from_options(options, cookie_file_for(options))
+            params['download_archive'] = archive_file_for(job)
+            if staging_path(job.id):
+                params['paths'] = {'home': staging_path(job.id)}
+                params['adopt_from'] = os.path.abspath(final_dir(options))  # See storage.adopt_existing()
+            return_code = run_attempt(params, job, runner=run_in_engine)
+        else:
+            return_code = run_attempt(build_command(url_string, options, staging_path(job.id), archive_file_for(job)), job)
+        return return_code
+    
+    except Exception as e:
+        print(f"[URL {url_index + 1}] ✗ Error processing {url_string}: {str(e)}")
+        event_bus.publish({
+            'job_id': job.id,
+            'type': 'warning',
+            'message': f"Error processing {url_string}: {str(e)}",
+            'url_index': url_index,
+            'url': url_string,
+            'progress': job.progress
+        })
+        job.error = str(e)
+        job.error_lines.append(str(e))
+        return 1
+
+def finish_download(job, return_code):
+    """Send the final status of a download to the web interface"""
+    url_index, url_string = job.url_index, job.url
+    if job.cancelled:
+        event_bus.publish({
+            'job_id': job.id,
+            'type': 'error',
+            'message': f"Cancelled: {url_string}",
+            'url_index': url_index,
+            'url': url_string,
+            'progress': job.progress
+        })
+    elif return_code == 0:
+        event_bus.publish({
+            'job_id': job.id,
+            'type': 'log',
+            'message': f"Successfully downloaded: {url_string}",
+            'url_index': url_index,
+            'url': url_string,
+            'progress': 100
+        })
+    else:
+        job.error = job.error or f"yt-dlp exited with code {return_code}"
+        event_bus.publish({
+            'job_id': job.id,
+            'type': 'error',
+            'message': f"Failed to download: {url_string} ({job.error})",
+            'url_index': url_index,
+            'url': url_string,
+            'failure': job.failure,
+            'progress': 0
+        })
+    
+    return return_code
+
+def probe_url(url, options):
+    """Extract metadata for a URL without downloading it.
+
+    Returns (infos, cached): one info dict per video (several for a playlist)
+    and whether they came from the info cache.
+    """
+    cached = info_cache.get_url(url)
+    if cached:
+        return [cached], True
+    
+    started = time.monotonic()
+    if download_engine:
+        params = engine.params_from_options(options, cookie_file_for(options))
+        try:
+            info = download_engine.extract(url, params)
+        finally:
+            discard_cookie_file(params)
+        infos = [entry for entry in info.get('entries') or [info] if entry]
+    else:
+        cmd = ['yt-dlp.exe', '--ignore-config', '--no-colors', '--no-warnings', '--dump-json']
+        cmd.extend(build_network_args(options))
+        cmd.append(url)
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=PROBE_TIMEOUT)
+        finally:
+            discard_cookie_file(cmd)
+        infos = [json.loads(line) for line in result.stdout.splitlines() if line.strip()]
+        if not infos:
+            errors = result.stderr.decode('utf-8', errors='replace').strip().splitlines()
+            raise RuntimeError(errors[-1] if errors else f"yt-dlp exited with code {result.returncode}")
+    
+    extraction_seconds.observe(time.monotonic() - started, source='probe')
+    
+    for info in infos:
+        info_cache.put(info, url if len(infos) == 1 else None)
+    if len(infos) > 1:
+        probed_playlists.add(url)
+    return infos, False
+
+def run_job(job):
+    """Scheduler callback: run one queued job in a worker thread and record its outcome"""
+    if job.cancelled:
+        return
+    refused = disk_budget.refused(job.id)
+    if refused:
+        print(f"[URL {job.url_index + 1}] ✗ {refused}")
+        job.status, job.error, job.failure = 'failed', refused, PERMANENT
+        finish_job(job, 1)
+        return
+    job_store.update(job.id, status='running', started_at=time.time())
+    
+    bandwidth.add(job.id, job.host)
+    try:
+        return_code = start_download(job)
+    finally:
+        bandwidth.remove(job.id)
+    observe_acceleration(job, return_code)
+    job.process = None
+    job.speed = None
+    
+    if job.cancelled:
+        job.status = 'cancelled'
+    elif return_code == 0:
+        circuit_breaker.record_success(job.host)
+        if job.attempt_started_at:
+            job.timings['download'] = time.monotonic() - job.attempt_started_at
+            download_seconds.observe(job.timings['download'])
+        if needs_postprocessing(job.options) and job.output_path:
+            # Frees the download slot; ffmpeg runs in the post-processing pool
+            queue_postprocess(job)
+            return
+        finish_subtitles(job, slot_held=True)
+        if finalize_output(job):
+            job.status = 'completed'
+            job.progress = 100
+            record_archive(job)
+        else:
+            print(f"[URL {job.url_index + 1}] ✗ {job.error}")
+            job.status = 'failed'
+            job.failure = PERMANENT
+            return_code = 1
+    else:
+        job.failure = classify_failure(job.error_lines, return_code)
+        if refresh_cookies(job):
+            job.failure = RETRYABLE
+        job.error = job.error or (job.error_lines[-1] if job.error_lines else None)
+        attempt_failures_total.inc(failure=job.failure)
+        pause = circuit_breaker.record_failure(job.host, job.failure)
+        if pause:
+            print(f"[URL {job.url_index + 1}] {job.host} is rate limiting, pausing its queue for {pause:.0f} seconds")
+            event_bus.publish({
+                'job_id': job.id,
+                'type': 'warning',
+                'message': f"{job.host} is rate limiting downloads, pausing its queue for {pause:.0f} seconds",
+                'url_index': job.url_index,
+                'url': job.url,
+                'progress': job.progress
+            })
+        delay = retry_policy.delay(job.failure, job.retries)
+        if delay is not None:
+            schedule_retry(job, delay)
+            return
+        job.status = 'failed'
+    
+    finish_job(job, return_code)
+
+def finish_job(job, return_code):
+    """Report and store the final status of a job"""
+    jobs_finished_total.inc(status=job.status)
+    disk_budget.release(job.id)
+    if job.status == 'cancelled':
+        discard_staging(job.id)
+    if job.status != 'completed':
+        download_archive.discard_pending(job.id)  # Not finished, so the next try must not skip it
+    finish_download(job, return_code)
+    job_store.update(
+        job.id,
+        status=job.status,
+        progress=job.progress,
+        error=job.error if job.status == 'failed' else None,
+        failure=job.failure if job.status == 'failed' else None,
+        finished_at=time.time()
+    )
+    playlist_progress(job, final=True)
+
+def queue_postprocess(job):
+    """Hand a downloaded job to the post-processing stage"""
+    job.status = 'processing'
+    job_store.update(job.id, status='processing')
+    event_bus.publish({
+        'job_id': job.id,
+        'type': 'processing',
+        'message': f"Queued for post-processing: {os.path.basename(job.output_path)}",
+        'url_index': job.url_index,
+        'url': job.url,
+        'progress': job.progress
+    })
+    postprocess_queue.submit(postprocess_job, job)
+
+def postprocess_job(job):
+    """Post-processing stage: audio extraction and embedding for a downloaded job (runs in postprocess_queue).
+
+    A failed audio extraction fails the job; failed embeds only warn, the
+    downloaded file is still usable.
+    """
+    url_index, url, options = job.url_index, job.url, job.options
+    started = time.monotonic()
+    return_code = 0
+    try:
+        format_type = options.get('format')
+        if format_type in AUDIO_CODECS:
+            print(f"[URL {url_index + 1}] Extracting audio ({format_type})")
+            job.output_path = extract_audio(job.output_path, format_type)
+            job_store.update(job.id, output_path=job.output_path)
+    except Exception as e:
+        return_code = 1
+        job.error = f"Audio extraction failed: {str(e)}"
+    
+    if return_code == 0 and options.get('embedThumb'):
+        thumbnail = find_thumbnail(job.output_path)
+        try:
+            if not thumbnail:
+                raise RuntimeError('no thumbnail was downloaded')
+            created = embed_thumbnail(job.output_path, thumbnail)
         except Exception as e:
-            retry_count += 1
-            if retry_count < max_retries:
-                print(f"[URL {url_index + 1}] Error occurred: {str(e)}. Retrying...")
-                output_queue.put({
-                    'type': 'warning',
-                    'message': f"Error occurred: {str(e)}. Retrying...",
-                    'url_index': url_index,
-                    'url': url,
-                    'progress': 0
-                })
+            publish_warning(job, f"Could not embed thumbnail: {str(e)}")
+        else:
+            if not options.get('writeThumbnail'):
+                # Only asked to embed it, so do not leave the files behind
+                for path in [thumbnail] + created:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+    
+    if return_code == 0:
+        finish_subtitles(job)
+        if not finalize_output(job):
+            return_code = 1
+    job.timings['postprocess'] = time.monotonic() - started
+    postprocess_seconds.observe(job.timings['postprocess'])
+    
+    if job.cancelled:
+        job.status = 'cancelled'
+    elif return_code == 0:
+        job.status = 'completed'
+        job.progress = 100
+        record_archive(job)
+        event_bus.publish({
+            'job_id': job.id,
+            'type': 'complete',
+            'url_index': url_index,
+            'url': url,
+            'return_code': 0,
+            'progress': 100
+        })
+    else:
+        print(f"[URL {url_index + 1}] ✗ {job.error}")
+        job.status = 'failed'
+        job.failure = PERMANENT  # Downloading again would not change the outcome
+    finish_job(job, return_code)
+
+def publish_warning(job, message):
+    print(f"[URL {job.url_index + 1}] {message}")
+    event_bus.publish({
+        'job_id': job.id,
+        'type': 'warning',
+        'message': message,
+        'url_index': job.url_index,
+        'url': job.url,
+        'progress': job.progress
+    })
+
+def schedule_retry(job, delay):
+    """Put a failed job back in the queue after its backoff, without holding a worker"""
+    job.retries += 1
+    job.status = 'retrying'
+    retries_total.inc(failure=job.failure)
+    job_store.update(job.id, status='retrying', error=job.error, failure=job.failure)
+    if job.failure != RATE_LIMITED:
+        # Stream URLs in a cached info file may have expired; extract again on the retry
+        info_cache.discard_url(job.url)
+    download_archive.discard_pending(job.id)  # Post-processing has not run on what it lists
+    
+    reason = 'rate limited' if job.failure == RATE_LIMITED else 'temporary error'
+    print(f"[URL {job.url_index + 1}] Attempt failed ({reason}), retrying in {delay:.1f} seconds (retry {job.retries})")
+    event_bus.publish({
+        'job_id': job.id,
+        'type': 'retrying',
+        'message': f"Attempt failed ({reason}: {job.error}), retrying in {delay:.1f} seconds",
+        'url_index': job.url_index,
+        'url': job.url,
+        'failure': job.failure,
+        'retry': job.retries,
+        'retry_in': delay,
+        'progress': job.progress
+    })
+    scheduler.submit_later(job, delay)
+
+def staging_path(job_id):
+    """Where a job downloads to until it is finished, or None without staging"""
+    return os.path.join(STAGING_DIR, job_id) if STAGING_DIR else None
+
+def final_dir(options):
+    """Where a job's files end up"""
+    return options.get('downloadPath') or os.getcwd()
+
+def job_dirs(job):
+    """(staging dir, final dir) of a job, for the disk budget"""
+    final = final_dir(job.options)
+    return staging_path(job.id) or final, final
+
+def estimate_job_size(job):
+    """Expected download size of the job's formats from probed metadata; None if the URL was not probed"""
+    info = info_cache.get_url(job.url)
+    return estimate_size(job_formats(job, info), info.get('duration') if info else None)
+
+def finalize_output(job):
+    """Move a finished job's files from its staging directory into the download path.
+
+    Each file appears there complete or not at all, and files already there
+    are never replaced. Returns False, with job.error set, if a move failed;
+    the rest stays in staging, and a retry finds the download in the archive
+    and only moves it.
+    """
+    staging = staging_path(job.id)
+    if not staging or not os.path.isdir(staging):
+        return True
+    try:
+        moved, kept = move_tree(staging, final_dir(job.options))
+    except OSError as e:
+        job.error = f"Could not move the download out of {staging}: {str(e)}"
+        return False
+    for path in kept:
+        print(f"[URL {job.url_index + 1}] {path} already exists, keeping it")
+    if job.output_path:
+        job.output_path = moved.get(os.path.abspath(job.output_path), job.output_path)
+        job_store.update(job.id, output_path=job.output_path)
+    shutil.rmtree(staging, ignore_errors=True)
+    return True
+
+def discard_staging(job_id):
+    """Remove a job's partial files"""
+    staging = staging_path(job_id)
+    if staging:
+        shutil.rmtree(staging, ignore_errors=True)
+
+def disk_usage(record, job=None):
+    """A job's estimated size and the bytes it has in staging and at its final path"""
+    staging = staging_path(record['id'])
+    output_path = record['output_path']
+    in_staging = bool(staging and output_path and os.path.abspath(output_path).startswith(staging + os.sep))
+    return {
+        'estimated': job.estimated_size if job else None,
+        'staging': dir_size(staging) if staging else 0,
+        'final': None if in_staging else file_size(output_path),
+    }
+
+def archive_file_for(job):
+    """The --download-archive for a job: its pending file while ffmpeg still has work to do"""
+    if needs_postprocessing(job.options):
+        return download_archive.pending_file_for(job.id)
+    return download_archive.file_for(options_fingerprint(job.options))
+
+def record_archive(job):
+    """Pick up what yt-dlp wrote to the download archive and remember where the file went"""
+    fingerprint = options_fingerprint(job.options)
+    download_archive.commit_pending(job.id, fingerprint, job.output_path)
+    download_archive.sync(fingerprint)
+    key = info_cache.key_for_url(job.url)
+    if key and download_archive.lookup(key, fingerprint):
+        download_archive.record(key, fingerprint, job.output_path)
+
+def skip_job(job, entry, message):
+    """Record a job that needs no download and report it to the web interface"""
+    job.status = 'skipped'
+    job.progress = 100
+    job.output_path = entry.get('output_path') if entry else None
+    job_store.add(job)
+    jobs_finished_total.inc(status='skipped')
+    print(f"[URL {job.url_index + 1}] Skipped: {message}")
+    event_bus.publish({
+        'job_id': job.id,
+        'type': 'skipped',
+        'message': message,
+        'url_index': job.url_index,
+        'url': job.url,
+        'output_path': job.output_path,
+        'progress': 100
+    })
+
+def enqueue_job(job):
+    """Record a job in the job table and hand it to the scheduler"""
+    job_store.add(job)
+    scheduler.submit(job)
+
+def ingest_chunk(chunk, options, batch_id, counts):
+    """Queue one chunk of (line number, url) from a bulk upload, updating the batch counts.
+
+    Invalid lines, URLs seen earlier in the upload or held by another
+    unfinished job and videos already in the download archive are dropped.
+    """
+    fingerprint = options_fingerprint(options)
+    candidates = {}
+    for line_number, url in chunk:
+        if url is None:
+            counts['invalid'] += 1
+            continue
+        playlist = is_playlist_url(url) or url in probed_playlists
+        if playlist:
+            # Expanded into one job per entry, checked against the archive then; like /download,
+            # only the same playlist URL is a duplicate (watch?v=X&list=... is not video X)
+            key, dedupe_key = None, url
+        else:
+            key = info_cache.key_for_url(url)
+            dedupe_key = key or normalize_url(url)
+        if dedupe_key in candidates:
+            counts['duplicates'] += 1
+        else:
+            candidates[dedupe_key] = (line_number, url, key, playlist)
+    
+    # Earlier chunks are already in the job table under this batch
+    active = job_store.active_keys(list(candidates), batch_id)
+    jobs = []
+    for dedupe_key, (line_number, url, key, playlist) in candidates.items():
+        if dedupe_key in active:
+            counts['duplicates'] += 1
+        elif key and download_archive.lookup(key, fingerprint):
+            counts['skipped'] += 1
+        else:
+            job = Job(url, line_number - 1, options, batch_id=batch_id)
+            job.url_key = dedupe_key
+            if playlist:
+                job.status = 'expanding'
+            jobs.append(job)
+    
+    # One transaction per chunk, then the workers can start on it
+    job_store.add_many(jobs)
+    for job in jobs:
+        if job.status == 'expanding':
+            start_playlist(job)
+        else:
+            scheduler.submit(job)
+    counts['accepted'] += len(jobs)
+
+def extract_flat(url, options):
+    """Flat-extract a playlist or channel: its entries, without visiting every video"""
+    if download_engine:
+        params = engine.params_from_options(options, cookie_file_for(options))
+        try:
+            return download_engine.extract(url, dict(params, extract_flat='in_playlist'))
+        finally:
+            discard_cookie_file(params)
+    
+    cmd = ['yt-dlp.exe', '--ignore-config', '--no-colors', '--no-warnings', '--flat-playlist', '--dump-single-json']
+    cmd.extend(build_network_args(options))
+    cmd.append(url)
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=PLAYLIST_TIMEOUT)
+    finally:
+        discard_cookie_file(cmd)
+    if result.returncode != 0 or not result.stdout.strip():
+        errors = result.stderr.decode('utf-8', errors='replace').strip().splitlines()
+        raise RuntimeError(errors[-1] if errors else f"yt-dlp exited with code {result.returncode}")
+    return json.loads(result.stdout)
+
+def playlist_entries(url, options, depth=0):
+    """Video entries of a playlist URL, expanding nested playlists (a channel's tabs)"""
+    info = extract_flat(url, options)
+    if 'entries' not in info:
+        # Not a playlist after all: a single video
+        return [{'url': url, 'key': info_key(info) if info.get('id') else None, 'title': info.get('title'), 'playlist': False}]
+    
+    entries = []
+    for entry in flat_entries(info):
+        if not entry['playlist']:
+            entries.append(entry)
+        elif depth < MAX_DEPTH:
+            try:
+                entries.extend(playlist_entries(entry['url'], options, depth + 1))
+            except Exception as e:
+                print(f"Could not expand {entry['url']}: {str(e)}")
+    return entries
+
+def expand_playlist(parent):
+    """Turn a playlist job into child jobs that go through the normal queue (runs in probe_executor)"""
+    url_index, url, options = parent.url_index, parent.url, parent.options
+    started = time.monotonic()
+    try:
+        entries = playlist_entries(url, options)
+    except Exception as e:
+        entries = None
+        error = str(e)
+    else:
+        parent.timings['extraction'] = time.monotonic() - started
+        extraction_seconds.observe(parent.timings['extraction'], source='playlist')
+    
+    if parent.cancelled:
+        finish_playlist(parent)
+        return
+    if not entries:
+        parent.status = 'failed'
+        parent.error = error if entries is None else "The playlist has no videos"
+        parent.failure = classify_failure([parent.error])
+        playlists.remove(parent.id)
+        job_store.update(parent.id, status='failed', error=parent.error, failure=parent.failure, finished_at=time.time())
+        print(f"[URL {url_index + 1}] ✗ Could not expand playlist {url}: {parent.error}")
+        event_bus.publish({
+            'job_id': parent.id,
+            'type': 'error',
+            'message': f"Could not expand playlist: {url} ({parent.error})",
+            'url_index': url_index,
+            'url': url,
+            'failure': parent.failure,
+            'progress': 0
+        })
+        return
     
-    # All retries failed
-    print(f"[URL {url_index + 1}] ✗ Failed after {max_retries} attempts")
-    output_queue.put({
-        'type': 'error',
-        'message': f"Failed after {max_retries} attempts",
+    # Each entry gets its own archive check; playlists can also list a video twice
+    fingerprint = options_fingerprint(options)
+    seen = set()
+    children = []
+    for entry in entries:
+        if (entry['key'] or entry['url']) in seen:
+            continue
+        seen.add(entry['key'] or entry['url'])
+        child = Job(entry['url'], url_index, options, parent_id=parent.id)
+        child.url_key = entry['key']
+        archived = download_archive.lookup(entry['key'], fingerprint) if entry['key'] else None
+        if archived:
+            child.status = 'skipped'
+            child.progress = 100
+            child.output_path = archived.get('output_path')
+        children.append(child)
+    skipped = sum(1 for child in children if child.status == 'skipped')
+    if skipped:
+        jobs_finished_total.inc(skipped, status='skipped')
+    
+    parent.entries = len(children)
+    parent.status = 'running'
+    job_store.add_many(children)
+    job_store.update(parent.id, status='running', entries=parent.entries, started_at=time.time())
+    playlists.add(parent, [(child.id, child.status, child.progress) for child in children])
+    for child in children:
+        if child.status == 'queued':
+            scheduler.submit(child)
+    if parent.cancelled:
+        # Cancelled while the entries were being queued
+        for child in children:
+            cancel_child(child.id)
+    
+    message = f"Playlist expanded into {len(children)} video(s)"
+    if skipped:
+        message += f", {skipped} already downloaded"
+    print(f"[URL {url_index + 1}] {message}")
+    event_bus.publish({
+        'job_id': parent.id,
+        'type': 'playlist',
+        'message': message,
         'url_index': url_index,
         'url': url,
-        'progress': 0
+        'entries': len(children),
+        'skipped': skipped,
+        'progress': parent.progress
     })
-    return 1
+    publish_playlist(parent, force=True)
+
+def playlist_progress(job, final=False):
+    """Fold a playlist entry's status and progress into its parent's aggregate"""
+    if not job.parent_id:
+        return
+    if not playlists.update(job.parent_id, job.id, job.status, job.progress):
+        return
+    parent = playlists.parent(job.parent_id)
+    if parent is None:
+        return
+    if final and job.status == 'failed':
+        event_bus.publish({
+            'job_id': parent.id,
+            'type': 'warning',
+            'message': f"Playlist entry failed: {job.url} ({job.error})",
+            'url_index': parent.url_index,
+            'url': parent.url,
+            'progress': parent.progress
+        })
+    publish_playlist(parent, force=final)
+
+def publish_playlist(parent, force=False):
+    """Send a playlist's aggregate progress (throttled unless forced) and finish it once every entry is done"""
+    now = time.time()
+    if not force and now - parent.progress_saved_at < PROGRESS_SAVE_INTERVAL:
+        return
+    summary = playlists.summary(parent.id)
+    if summary is None:
+        return
+    parent.progress = summary['progress']
+    if summary['finished'] == summary['entries']:
+        finish_playlist(parent, summary)
+        return
+    
+    parent.progress_saved_at = now
+    job_store.update(parent.id, progress=parent.progress)
+    event_bus.publish({
+        'job_id': parent.id,
+        'type': 'log',
+        'message': f"[playlist] {summary['finished']} of {summary['entries']} video(s) done",
+        'url_index': parent.url_index,
+        'url': parent.url,
+        'progress': parent.progress,
+        'status': 'downloading',
+        'entries': summary['entries'],
+        'finished': summary['finished'],
+        'counts': summary['counts']
+    })
+
+def finish_playlist(parent, summary=None):
+    """Record the final status of a playlist job once all of its entries are done"""
+    # Several entries can finish at once; only the first caller gets to finish the parent
+    if not playlists.remove(parent.id):
+        return
+    counts = summary['counts'] if summary else {}
+    failed = counts.get('failed', 0)
+    if parent.cancelled:
+        parent.status = 'cancelled'
+    elif failed:
+        parent.status = 'failed'
+        parent.error = f"{failed} of {summary['entries']} video(s) failed"
+    else:
+        parent.status = 'completed'
+        parent.progress = 100
+    job_store.update(
+        parent.id,
+        status=parent.status,
+        progress=parent.progress,
+        error=parent.error if parent.status == 'failed' else None,
+        finished_at=time.time()
+    )
+    
+    url_index, url = parent.url_index, parent.url
+    if parent.status == 'completed':
+        parts = [f"{counts.get(status)} {status}" for status in ('completed', 'skipped', 'cancelled') if counts.get(status)]
+        print(f"[URL {url_index + 1}] ✓ Playlist complete: {url} ({', '.join(parts)})")
+        event_bus.publish({
+            'job_id': parent.id,
+            'type': 'complete',
+            'message': f"Playlist complete ({', '.join(parts)})",
+            'url_index': url_index,
+            'url': url,
+            'return_code': 0,
+            'progress': 100
+        })
+    else:
+        message = f"Cancelled: {url}" if parent.status == 'cancelled' else f"Playlist incomplete: {url} ({parent.error})"
+        print(f"[URL {url_index + 1}] ✗ {message}")
+        event_bus.publish({
+            'job_id': parent.id,
+            'type': 'error',
+            'message': message,
+            'url_index': url_index,
+            'url': url,
+            'progress': parent.progress
+        })
+
+def start_playlist(parent):
+    """Register a stored playlist job and expand it in the background"""
+    parent.status = 'expanding'
+    playlists.add(parent, [])
+    probe_executor.submit(expand_playlist, parent)
+
+def resume_jobs():
+    """Re-queue jobs that were queued, running or waiting to retry when the server stopped.
+
+    yt-dlp runs with --continue, so partially downloaded files pick up where
+    they left off.
+    """
+    unfinished = job_store.unfinished()
+    clean_staging()
+    resumed_playlists = []
+    for record in unfinished:
+        job = Job(record['url'], record['url_index'], record['options'], job_id=record['id'],
+                  attempts=record['attempts'], parent_id=record['parent_id'], batch_id=record['batch_id'])
+        job.progress = record['progress']
+        children = job_store.children(job.id)
+        if children:
+            # Already expanded (parents are stored before their children): track the entries again
+            job.entries = len(children)
+            job.status = 'running'
+            playlists.add(job, [(child['id'], child['status'], child['progress']) for child in children])
+            resumed_playlists.append(job)
+        elif record['status'] == 'expanding' or record['entries'] is not None:
+            job_store.update(job.id, status='expanding')
+            start_playlist(job)
+        elif record['status'] == 'processing' and record['output_path'] and os.path.exists(record['output_path']):
+            # Downloaded already; only the ffmpeg work is left
+            job.output_path = record['output_path']
+            queue_postprocess(job)
+        else:
+            job_store.update(job.id, status='queued')
+            scheduler.submit(job)
+    for job in resumed_playlists:
+        # Entries may all have finished just before the server stopped
+        publish_playlist(job, force=True)
+    return len(unfinished)
+
+def clean_staging():
+    """Remove staging directories left by jobs that will not run again, at startup.
+
+    Unfinished jobs resume from theirs. Failed ones only keep theirs for a
+    /jobs/<id>/retry until the server restarts, so they cannot pile up.
+    """
+    if not STAGING_DIR:
+        return
+    for entry in os.scandir(STAGING_DIR):
+        record = job_store.get(entry.name)
+        if not record or record['status'] not in UNFINISHED_STATUSES:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+# Splits BANDWIDTH_LIMIT/HOST_BANDWIDTH across running downloads
+bandwidth = BandwidthController(
+    total_rate=BANDWIDTH_LIMIT,
+    host_rates=HOST_BANDWIDTH,
+    on_change=apply_rate,
+    # Restarting yt-dlp.exe is expensive, so only act on large changes there
+    tolerance=0.05 if download_engine else 0.3
+)
+
+# Queued jobs start once their estimated size fits in the free disk space
+disk_budget = DiskBudget(estimate_job_size, job_dirs, reserve=DISK_RESERVE)
+
+# Bounded worker pool shared by all batches
+scheduler = DownloadScheduler(
+    run_job,
+    max_workers=MAX_WORKERS,
+    per_host_limit=PER_HOST_LIMIT,
+    host_limits=HOST_LIMITS,
+    breaker=circuit_breaker,
+    admission=disk_budget
+)
+
+def download_speeds():
+    return {(job.id, job.host): job.speed or 0 for job in scheduler.running_jobs()}
+
+metrics.gauge('queue_depth', 'Jobs waiting for a download slot (queued) or for a retry timer (delayed)',
+              lambda: {(state,): scheduler.stats()[state] for state in ('queued', 'delayed')}, ['state'])
+metrics.gauge('workers', 'Download worker slots', lambda: scheduler.max_workers)
+metrics.gauge('active_workers', 'Download worker slots running a job', lambda: scheduler.stats()['running'])
+metrics.gauge('postprocess_jobs', 'Jobs in the post-processing stage',
+              lambda: {(state,): postprocess_queue.stats()[state] for state in ('queued', 'running')}, ['state'])
+metrics.gauge('postprocess_workers', 'Post-processing worker threads', lambda: postprocess_queue.max_workers)
+metrics.gauge('download_speed_bytes', 'Current download speed per running job (bytes/s)', download_speeds, ['job_id', 'host'])
+metrics.gauge('download_speed_bytes_total', 'Current download speed of all running jobs (bytes/s)',
+              lambda: sum(download_speeds().values()))
+metrics.gauge('jobs', 'Jobs in the job table by status', lambda: job_store.counts(), ['status'])
+metrics.gauge('sse_subscribers', 'Connected /stream clients', event_bus.subscriber_count)
+metrics.gauge('sse_dropped_events_total', 'Progress events dropped for lagging /stream clients',
+              lambda: event_bus.dropped, kind='counter')
+metrics.gauge('disk_reserved_bytes', 'Bytes admitted downloads are still expected to write', disk_budget.reserved)
+metrics.gauge('fragment_concurrency', 'Concurrent fragments the acceleration tuner uses per site',
+              accelerator.stats, ['host'])
+metrics.gauge('circuit_open', 'Sites whose queue is paused for rate limiting (1 open, 0.5 trial download)',
+              lambda: {host: 1 if state['state'] == 'open' else 0.5
+                       for host, state in circuit_breaker.stats().items() if state['state'] != 'closed'}, ['host'])
 
 @app.route('/')
 def index():
@@ -208,220 +1738,274 @@ def download():
         print(f"Downloading {len(urls)} video(s)")
         print(f"{'='*60}\n")
         
-        # Clear the output queue
-        while not output_queue.empty():
-            output_queue.get()
+        # Clients replay from here so nothing emitted before they connect is lost
+        last_event_id = event_bus.last_id
         
-        # Start a thread for each URL
+        # Drop duplicates and anything already in the download archive before starting yt-dlp;
+        # queue the rest, workers pick them up as download slots free up
+        fingerprint = options_fingerprint(options)
+        seen = {}
+        jobs = []
+        skipped = 0
         for i, url in enumerate(urls):
-            def start_download(url_index, url_string):
-                try:
-                    # Build the command
-                    cmd = ['yt-dlp.exe']
-                    cmd.extend(['--ignore-config', '--continue', '--no-overwrites', '--mtime'])
-                    
-                    # Add rate limiting options
-                    cmd.extend(['--rate-limit', '1M'])  # Limit download rate
-                    cmd.extend(['--retries', '10'])     # Increase retry count
-                    cmd.extend(['--fragment-retries', '10'])  # Retry failed fragments
-                    
-                    # Add console output options
-                    cmd.extend(['--no-colors'])  # Remove colors for cleaner console output
-                    
-                    # Add authentication settings
-                    auth = options.get('authentication', {})
-                    if auth.get('enabled'):
-                        method = auth.get('method')
-                        
-                        if method == 'browser' and auth.get('browser'):
-                            # Browser cookies authentication
-                            browser = auth.get('browser')
-                            cmd.extend(['--cookies-from-browser', browser])
-                            
-                            if auth.get('profile'):
-                                cmd.extend(['--cookies-from-browser', f"{browser}:{auth.get('profile')}"])
-                        
-                        elif method == 'manual' and auth.get('username') and auth.get('password'):
-                            # Manual login authentication
-                            cmd.extend(['--username', auth.get('username')])
-                            cmd.extend(['--password', auth.get('password')])
-                            
-                            if auth.get('twoFactor'):
-                                cmd.extend(['--twofactor', auth.get('twoFactor')])
-                        
-                        elif method == 'file' and auth.get('cookieFile'):
-                            # Cookie file authentication
-                            cookie_file_path = os.path.join(os.getcwd(), auth.get('cookieFile'))
-                            if os.path.exists(cookie_file_path):
-                                cmd.extend(['--cookies', cookie_file_path])
-                    
-                    # Add proxy settings
-                    proxy = options.get('proxy', {})
-                    if proxy.get('enabled'):
-                        proxy_url = f"{proxy['type']}://"
-                        if proxy.get('username') and proxy.get('password'):
-                            proxy_url += f"{proxy['username']}:{proxy['password']}@"
-                        proxy_url += f"{proxy['host']}:{proxy['port']}"
-                        cmd.extend(['--proxy', proxy_url])
-                        
-                        if proxy.get('bypass'):
-                            cmd.extend(['--proxy-bypass', proxy['bypass']])
-                    
-                    # Add format/quality options
-                    quality = options.get('quality')
-                    if quality:
-                        cmd.extend(['-f', quality])
-                    
-                    # Add output format
-                    format_type = options.get('format')
-                    if format_type:
-                        if format_type in ['mp3', 'wav', 'flac', 'aac', 'ogg', 'm4a']:
-                            cmd.extend(['-x', '--audio-format', format_type])
-                        else:
-                            cmd.extend(['--merge-output-format', format_type])
-                    
-                    # Add subtitle options with better error handling
-                    subtitle_options = []
-                    if options.get('writeSub') or options.get('embedSubs') or options.get('persianSubs'):
-                        # Get subtitle format (default to srt)
-                        sub_format = options.get('subtitleFormat', 'srt')
-                        
-                        # Build subtitle languages list
-                        langs = []
-                        if options.get('subtitleLangs'):
-                            langs.extend([lang.strip() for lang in options.get('subtitleLangs').split(',')])
-                        
-                        # Add Persian if requested
-                        if options.get('persianSubs'):
-                            langs.append('fa')
-                            # Also try auto-generated Persian
-                            langs.append('fa-auto')
-                        
-                        # Remove duplicates
-                        langs = list(set(langs))
-                        
-                        if langs:
-                            cmd.extend(['--sub-langs', ','.join(langs)])
-                        
-                        if options.get('writeSub'):
-                            cmd.append('--write-sub')
-                            cmd.append('--write-auto-sub')
-                            # Force specified subtitle format
-                            cmd.extend(['--sub-format', sub_format])
-                            cmd.extend(['--convert-subs', sub_format])
-                        
-                        if options.get('embedSubs'):
-                            cmd.append('--embed-subs')
-                            # Also force specified format for embedded subtitles
-                            cmd.extend(['--sub-format', sub_format])
-                            cmd.extend(['--convert-subs', sub_format])
-                        
-                        # Store subtitle options for separate download if needed
-                        subtitle_options = ['--write-sub', '--write-auto-sub', '--sub-langs', ','.join(langs), '--sub-format', sub_format, '--convert-subs', sub_format]
-                    
-                    # Add additional options
-                    if options.get('embedThumb'):
-                        cmd.append('--embed-thumbnail')
-                    if options.get('writeDesc'):
-                        cmd.append('--write-description')
-                    if options.get('writeMeta'):
-                        cmd.append('--write-info-json')
-                    if options.get('writeComments'):
-                        cmd.append('--write-comments')
-                    if options.get('writeThumbnail'):
-                        cmd.append('--write-thumbnail')
-                    
-                    # Add output template
-                    if options.get('outputTemplate'):
-                        cmd.extend(['-o', options['outputTemplate']])
-                    
-                    # Add download path
-                    if options.get('downloadPath'):
-                        download_path = options['downloadPath']
-                        if not os.path.exists(download_path):
-                            os.makedirs(download_path, exist_ok=True)
-                        cmd.extend(['-P', download_path])
-                    
-                    # Add the URL
-                    cmd.append(url_string)
-                    
-                    # First attempt to download with subtitles
-                    return_code = run_with_retry(cmd, url_index, url_string)
-                    
-                    # If subtitle download failed, try without subtitles
-                    if return_code != 0 and subtitle_options:
-                        print(f"[URL {url_index + 1}] Subtitle download failed, retrying without subtitles...")
-                        output_queue.put({
-                            'type': 'warning',
-                            'message': "Subtitle download failed, retrying without subtitles...",
-                            'url_index': url_index,
-                            'url': url_string,
-                            'progress': 0
-                        })
-                        
-                        # Create a new command without subtitle options
-                        cmd_no_subs = [arg for arg in cmd if arg not in subtitle_options]
-                        
-                        # Try again without subtitles
-                        return_code = run_with_retry(cmd_no_subs, url_index, url_string)
-                    
-                    # Send final status to web interface
-                    if return_code == 0:
-                        output_queue.put({
-                            'type': 'log',
-                            'message': f"Successfully downloaded: {url_string}",
-                            'url_index': url_index,
-                            'url': url_string,
-                            'progress': 100
-                        })
-                    else:
-                        output_queue.put({
-                            'type': 'error',
-                            'message': f"Failed to download: {url_string}",
-                            'url_index': url_index,
-                            'url': url_string,
-                            'progress': 0
-                        })
-                
-                except Exception as e:
-                    print(f"[URL {url_index + 1}] ✗ Error processing {url_string}: {str(e)}")
-                    output_queue.put({
-                        'type': 'error',
-                        'message': f"Error processing {url_string}: {str(e)}",
-                        'url_index': url_index,
-                        'url': url_string,
-                        'progress': 0
-                    })
-            
-            # Start each download with a small delay to avoid overwhelming the server
-            thread = threading.Thread(target=start_download, args=(i, url))
-            thread.daemon = True
-            thread.start()
-            time.sleep(1)  # Delay between starting downloads for better console visibility
+            job = Job(url, i, options)
+            if is_playlist_url(url) or url in probed_playlists:
+                # Expanded into one job per entry; the entries are checked against the archive individually
+                if url in seen:
+                    skip_job(job, None, f"Duplicate of URL {seen[url] + 1}: {url}")
+                    skipped += 1
+                else:
+                    seen[url] = i
+                    job.status = 'expanding'
+                    job_store.add(job)
+                    start_playlist(job)
+                jobs.append(job.to_dict())
+                continue
+            key = info_cache.key_for_url(url)
+            job.url_key = key or normalize_url(url)
+            entry = download_archive.lookup(key, fingerprint) if key else None
+            if entry:
+                skip_job(job, entry, f"Already downloaded: {url}")
+                skipped += 1
+            elif job.url_key in seen:
+                skip_job(job, None, f"Duplicate of URL {seen[job.url_key] + 1}: {url}")
+                skipped += 1
+            else:
+                seen[job.url_key] = i
+                enqueue_job(job)
+            jobs.append(job.to_dict())
         
-        return jsonify({'success': True, 'message': 'Downloads started'})
+        return jsonify({
+            'success': True,
+            'message': 'Downloads queued',
+            'jobs': jobs,
+            'skipped': skipped,
+            'last_event_id': last_event_id
+        })
     except Exception as e:
         print(f"Error starting downloads: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/download/bulk', methods=['POST', 'OPTIONS'])
+def download_bulk():
+    # Handle preflight OPTIONS request for CORS
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    # The body is the URL list (NDJSON or one URL per line), so options come in an X-Options
+    # header or a first {"options": {...}} line. Not the query string: they can hold
+    # credentials, and URLs end up in logs.
+    if 'options' in request.args:
+        return jsonify({'success': False, 'error': 'send options in the X-Options header or the first line, not the URL'}), 400
+    try:
+        options = parse_options_header(request.headers['X-Options']) if 'X-Options' in request.headers else {}
+        line_options, entries = read_upload(request.stream)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if line_options is not None:
+        options = line_options
+    
+    batch_id = uuid.uuid4().hex[:12]
+    counts = {'accepted': 0, 'duplicates': 0, 'skipped': 0, 'invalid': 0}
+    try:
+        # Only one chunk of the upload is held in memory at a time
+        for chunk in chunked(entries, BULK_CHUNK_SIZE):
+            ingest_chunk(chunk, options, batch_id, counts)
+    except Exception as e:
+        print(f"Error ingesting batch {batch_id}: {str(e)}")
+        return jsonify({'success': False, 'error': str(e), 'batch_id': batch_id, 'counts': counts}), 500
+    
+    print(f"Batch {batch_id}: {counts['accepted']} queued, {counts['duplicates']} duplicate(s), "
+          f"{counts['skipped']} already downloaded, {counts['invalid']} invalid line(s)")
+    return jsonify({'success': True, 'batch_id': batch_id, 'counts': counts})
+
+@app.route('/probe', methods=['POST', 'OPTIONS'])
+def probe():
+    # Handle preflight OPTIONS request for CORS
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'success': False, 'error': 'No data received'}), 400
+        
+        urls = list(dict.fromkeys(url.strip() for url in data.get('urls', []) if url.strip()))
+        options = data.get('options', {})
+        if not urls:
+            return jsonify({'success': False, 'error': 'No URLs provided'}), 400
+        
+        # Extract all URLs in parallel; cached ones return immediately
+        futures = [(url, probe_executor.submit(probe_url, url, options)) for url in urls]
+        results = []
+        for url, future in futures:
+            try:
+                infos, cached = future.result()
+                results.append({
+                    'url': url,
+                    'success': True,
+                    'cached': cached,
+                    'videos': [summarize_info(info) for info in infos]
+                })
+            except Exception as e:
+                results.append({'url': url, 'success': False, 'error': str(e)})
+        
+        return jsonify({'success': True, 'results': results, 'cache': info_cache.stats()})
+    except Exception as e:
+        print(f"Probe error: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/stream', methods=['GET', 'OPTIONS'])
 def stream():
     # Handle preflight OPTIONS request for CORS
     if request.method == 'OPTIONS':
         return '', 200
         
+    # Browsers send Last-Event-ID when EventSource reconnects; the query
+    # parameter lets the first connection resume from a /download response
+    last_event_id = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('lastEventId'))
+    subscriber = event_bus.subscribe(last_event_id)
+    
     def generate():
-        while True:
-            try:
-                # Get message from queue with timeout
-                message = output_queue.get(timeout=1)
-                yield f"data: {json.dumps(message)}\n\n"
-            except queue.Empty:
-                # Send heartbeat to keep connection alive
-                yield f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
+        try:
+            while True:
+                items = event_bus.get(subscriber, timeout=1)
+                if not items:
+                    # Send heartbeat to keep connection alive
+                    yield HEARTBEAT_FRAME
+                    continue
+                
+                # Pack everything pending into one frame
+                yield batch_frame(items)
+                
+                # Let a few more events pile up before the next frame
+                time.sleep(STREAM_BATCH_INTERVAL)
+        finally:
+            event_bus.unsubscribe(subscriber)
     
     return Response(generate(), mimetype='text/event-stream')
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    try:
+        # SQLite reads a negative LIMIT as no limit, so clamp rather than trust the sign
+        limit = max(1, min(int(request.args.get('limit', 100)), 1000))
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit and offset must be integers'}), 400
+    status = request.args.get('status')
+    parent_id = request.args.get('parent')
+    batch_id = request.args.get('batch')
+    jobs = [merge_live_state(record) for record in job_store.list(status, limit, offset, parent_id, batch_id)]
+    # Filtered to a bulk upload, the counts are that batch's progress
+    return jsonify({'success': True, 'jobs': jobs, 'counts': job_store.counts(batch_id)})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    record = job_store.get(job_id)
+    if not record:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    record['disk'] = disk_usage(record, scheduler.get(job_id))
+    return jsonify({'success': True, 'job': merge_live_state(record)})
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST', 'OPTIONS'])
+def cancel_job(job_id):
+    # Handle preflight OPTIONS request for CORS
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    record = job_store.get(job_id)
+    if not record:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    if record['status'] not in ('queued', 'expanding', 'running', 'retrying'):
+        return jsonify({'success': False, 'error': f"Job is already {record['status']}"}), 409
+    
+    parent = playlists.parent(job_id)
+    if parent:
+        # Cancelling a playlist cancels every entry that has not finished yet
+        parent.cancelled = True
+        for child_id in playlists.children(job_id):
+            cancel_child(child_id)
+        if parent.status == 'expanding':
+            job_store.update(job_id, status='cancelled', finished_at=time.time())
+    else:
+        cancel_child(job_id)
+        job_store.update(job_id, status='cancelled', finished_at=time.time())
+    print(f"[URL {record['url_index'] + 1}] Cancelled {record['url']}")
+    return jsonify({'success': True, 'message': 'Job cancelled'})
+
+def cancel_child(job_id):
+    """Cancel one queued or running job"""
+    job = scheduler.cancel(job_id)
+    if job is None:
+        return
+    job_store.update(job_id, status='cancelled', finished_at=time.time())
+    if job.status != 'running':
+        # Never reaches run_job, so report it to its playlist here
+        job.status = 'cancelled'
+        jobs_finished_total.inc(status='cancelled')
+        disk_budget.release(job_id)
+        discard_staging(job_id)  # A job waiting to retry may have partial files
+        playlist_progress(job, final=True)
+
+@app.route('/jobs/<job_id>/retry', methods=['POST', 'OPTIONS'])
+def retry_job(job_id):
+    # Handle preflight OPTIONS request for CORS
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    record = job_store.get(job_id)
+    if not record:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    if record['status'] not in ('failed', 'cancelled'):
+        return jsonify({'success': False, 'error': f"Only failed or cancelled jobs can be retried (job is {record['status']})"}), 409
+    if scheduler.get(job_id) or playlists.parent(job_id):
+        return jsonify({'success': False, 'error': 'Job is still shutting down, try again shortly'}), 409
+    
+    job = Job(record['url'], record['url_index'], record['options'], job_id=record['id'],
+              attempts=record['attempts'], parent_id=record['parent_id'], batch_id=record['batch_id'])
+    children = job_store.children(job_id)
+    if children:
+        # A playlist: queue its failed and cancelled entries again
+        job.entries = len(children)
+        job.status = 'running'
+        retried = []
+        for child in children:
+            if child['status'] in ('failed', 'cancelled'):
+                child['status'], child['progress'] = 'queued', 0
+                retried.append(Job(child['url'], child['url_index'], child['options'], job_id=child['id'],
+                                   attempts=child['attempts'], parent_id=job_id))
+        job_store.update(job_id, status='running', error=None, failure=None, finished_at=None)
+        playlists.add(job, [(child['id'], child['status'], child['progress']) for child in children])
+        for child in retried:
+            job_store.update(child.id, status='queued', progress=0, error=None, started_at=None, finished_at=None)
+            scheduler.submit(child)
+        publish_playlist(job, force=True)
+    elif not record['parent_id'] and (is_playlist_url(record['url']) or record['url'] in probed_playlists):
+        # A playlist that could not be expanded
+        job_store.update(job_id, status='expanding', progress=0, error=None, failure=None, finished_at=None)
+        start_playlist(job)
+    else:
+        job_store.update(job_id, status='queued', progress=0, error=None, started_at=None, finished_at=None)
+        scheduler.submit(job)
+    return jsonify({'success': True, 'message': 'Job queued for retry', 'job': job.to_dict()})
+
+def merge_live_state(record):
+    """Overlay the in-memory state of a queued or running job on its stored record"""
+    job = scheduler.get(record['id']) or playlists.parent(record['id'])
+    if job:
+        record['progress'] = job.progress
+        record['output_path'] = job.output_path or record['output_path']
+        if job.status == 'waiting_disk':
+            record['status'] = job.status  # Only the scheduler knows; it is stored as queued
+    # Options can hold proxy/auth credentials; never echo them back
+    record.pop('options', None)
+    return record
+
 @app.route('/update', methods=['POST', 'OPTIONS'])
 def update():
     # Handle preflight OPTIONS request for CORS
@@ -492,13 +2076,25 @@ if __name__ == '__main__':
     print("\n" + "="*60)
     print("   YouTube Downloader GUI Server")
     print("="*60)
-    print("Server starting on http://localhost:5000")
+    print(f"Server starting on http://localhost:{PORT}")
     print("Press Ctrl+C to stop the server")
     print("="*60 + "\n")
     
+    archived = download_archive.sync()
+    if archived:
+        print(f"Indexed {archived} new download archive entries from {ARCHIVE_DIR}")
+    resumed = resume_jobs()
+    if resumed:
+        print(f"Resuming {resumed} unfinished download(s) from {JOB_DB_PATH}\n")
+    
     try:
-        app.run(debug=False, port=5000)  # Disabled debug to avoid duplicate output
+        if SERVER == 'asgi':
+            serve(create_asgi_app(app, event_bus, process_supervisor, STREAM_BATCH_INTERVAL), PORT)
+        else:
+            app.run(debug=False, port=PORT)  # Disabled debug to avoid duplicate output
     except KeyboardInterrupt:
         print("\n\nServer stopped by user")
     except Exception as e:
-        print(f"\n\nServer error: {str(e)}")
\ No newline at end of file
+        print(f"\n\nServer error: {str(e)}")
+    finally:
+        cookie_jars.close()
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Options that change what ends up on disk; anything else (proxy, auth, ...) does not
+FINGERPRINT_OPTIONS = [
+    'quality', 'format', 'embedSubs', 'embedThumb', 'writeSub', 'persianSubs',
+    'subtitleLangs', 'subtitleFormat', 'outputTemplate', 'downloadPath',
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive (
+    extractor TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    output_path TEXT,
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (extractor, video_id, fingerprint)
+);
+"""
+
+
+def options_fingerprint(options):
+    """Short hash of the options that decide which file a download produces"""
+    relevant = {name: options.get(name) for name in FINGERPRINT_OPTIONS if options.get(name)}
+    return hashlib.sha1(json.dumps(relevant, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def split_key(key):
+    """'youtube:abc' -> ('youtube', 'abc')"""
+    extractor, _, video_id = key.partition(':')
+    return extractor, video_id
+
+
+class DownloadArchive:
+    """Index of finished downloads, shared with yt-dlp's --download-archive.
+
+    Each options fingerprint gets its own archive file, so yt-dlp skips a
+    video only when it was already fetched with the same format settings.
+    yt-dlp appends to those files itself; sync() pulls new lines into an
+    indexed SQLite table so /download can filter URLs before starting any
+    process.
+    """
+
+    def __init__(self, db_path, archive_dir):
+        self.archive_dir = archive_dir
+        os.makedirs(archive_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._offsets = {}  # fingerprint -> bytes of its archive file already indexed
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+
+    def file_for(self, fingerprint):
+        """Path passed to yt-dlp as --download-archive"""
+        return os.path.join(self.archive_dir, f'{fingerprint}.txt')
+
+    def pending_file_for(self, job_id):
+        """--download-archive for a job whose file still has to be post-processed.
+
+        yt-dlp marks a video as done as soon as it exits, before ffmpeg has
+        run; writing to a per-job file keeps a failed post-processing from
+        being skipped on the next try. commit_pending() moves the entries to
+        the real archive once the file is finished.
+        """
+        pending_dir = os.path.join(self.archive_dir, 'pending')
+        os.makedirs(pending_dir, exist_ok=True)
+        return os.path.join(pending_dir, f'{job_id}.txt')
+
+    def commit_pending(self, job_id, fingerprint, output_path=None):
+        """Record the entries yt-dlp wrote to a job's pending file, then remove it"""
+        path = self.pending_file_for(job_id)
+        try:
+            with open(path, encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        for line in lines:
+            parts = line.strip().split(' ', 1)
+            if len(parts) == 2:
+                self.record(f'{parts[0]}:{parts[1]}', fingerprint, output_path)
+        self.discard_pending(job_id)
+
+    def discard_pending(self, job_id):
+        try:
+            os.remove(self.pending_file_for(job_id))
+        except OSError:
+            pass
+
+    def lookup(self, key, fingerprint):
+        """Return the archive entry for a video key and fingerprint, or None"""
+        extractor, video_id = split_key(key)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT output_path, recorded_at FROM archive WHERE extractor = ? AND video_id = ? AND fingerprint = ?',
+                (extractor, video_id, fingerprint)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'key': key, 'output_path': row[0], 'recorded_at': row[1]}
+
+    def record(self, key, fingerprint, output_path=None):
+        """Add or update an entry, keeping yt-dlp's archive file in step"""
+        extractor, video_id = split_key(key)
+        with self._lock:
+            cursor = self._conn.execute(
+                'UPDATE archive SET output_path = COALESCE(?, output_path) '
+                'WHERE extractor = ? AND video_id = ? AND fingerprint = ?',
+                (output_path, extractor, video_id, fingerprint)
+            )
+            if cursor.rowcount == 0:
+                self._conn.execute(
+                    'INSERT INTO archive (extractor, video_id, fingerprint, output_path, recorded_at) VALUES (?, ?, ?, ?, ?)',
+                    (extractor, video_id, fingerprint, output_path, time.time())
+                )
+                with open(self.file_for(fingerprint), 'a', encoding='utf-8') as f:
+                    f.write(f'{extractor} {video_id}\n')
+            self._conn.commit()
+
+    def sync(self, fingerprint=None):
+        """Index lines yt-dlp appended to one (or every) archive file. Returns the number added."""
+        if fingerprint is None:
+            fingerprints = [name[:-4] for name in os.listdir(self.archive_dir) if name.endswith('.txt')]
+        else:
+            fingerprints = [fingerprint]
+        added = 0
+        with self._lock:
+            for fp in fingerprints:
+                path = self.file_for(fp)
+                try:
+                    with open(path, 'rb') as f:
+                        f.seek(self._offsets.get(fp, 0))
+                        data = f.read()
+                except OSError:
+                    continue
+                # Only consume complete lines; yt-dlp may be mid-write
+                end = data.rfind(b'\n') + 1
+                self._offsets[fp] = self._offsets.get(fp, 0) + end
+                now = time.time()
+                for line in data[:end].decode('utf-8', errors='replace').splitlines():
+                    parts = line.strip().split(' ', 1)
+                    if len(parts) != 2:
+                        continue
+                    cursor = self._conn.execute(
+                        'INSERT OR IGNORE INTO archive (extractor, video_id, fingerprint, recorded_at) VALUES (?, ?, ?, ?)',
+                        (parts[0], parts[1], fp, now)
+                    )
+                    added += cursor.rowcount
+            self._conn.commit()
+        return added
@@ -0,0 +1,306 @@
+import asyncio
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from events import HEARTBEAT_FRAME, batch_frame, parse_event_id
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+# Longest output line read from a child; yt-dlp's error dumps can be long
+LINE_LIMIT = 1024 * 1024
+
+WSGI_THREADS = 32  # Flask requests served at once
+OUTPUT_THREADS = 4  # Threads running on_line callbacks for all children
+
+
+def asgi_available():
+    return uvicorn is not None
+
+
+class AsyncWakeup:
+    """threading.Event stand-in for EventBus subscribers served by a coroutine.
+
+    set() may be called from any thread (the bus calls it under its lock);
+    clear() and wait() run on the event loop.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._event = asyncio.Event()
+        self._flag = False
+
+    def set(self):
+        if not self._flag:
+            # One loop callback per wakeup, however many events arrive before the coroutine runs
+            self._flag = True
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    def clear(self):
+        self._flag = False
+        self._event.clear()
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._flag
+
+
+class AsyncProcess:
+    """A child started by ProcessSupervisor, with the subset of Popen that app.py and Job use"""
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._process = None
+        self._terminate = False
+        self._done = threading.Event()
+        self.returncode = None
+        self.error = None
+
+    async def _run(self, cmd, on_line, executor):
+        try:
+            self._process = await asyncio.create_subprocess_exec(
+                *cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, limit=LINE_LIMIT)
+            if self._terminate:
+                self._process.terminate()
+            while True:
+                line = await self._process.stdout.readline()
+                if not line:
+                    break
+                # Awaited, so one child's lines are handled in order
+                await self._loop.run_in_executor(executor, on_line, line)
+            self.returncode = await self._process.wait()
+        except Exception as e:
+            self.error = e
+            if self._process and self._process.returncode is None:
+                self._process.kill()
+                self.returncode = await self._process.wait()
+            else:
+                self.returncode = -1
+        finally:
+            self._done.set()
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self._loop.call_soon_threadsafe(self._terminate_now)
+
+    def _terminate_now(self):
+        self._terminate = True
+        if self._process and self._process.returncode is None:
+            self._process.terminate()
+
+    def wait(self):
+        """Block until the child has exited; re-raises an error from reading its output"""
+        self._done.wait()
+        if self.error:
+            raise self.error
+        return self.returncode
+
+
+class ProcessSupervisor:
+    """Runs yt-dlp.exe children on one asyncio event loop instead of a reader thread each.
+
+    The loop is the ASGI server's, handed over by attach() at startup;
+    start() waits for it so jobs resumed before the server is up are fine.
+    The loop only reads; on_line callbacks write to SQLite, so they run on
+    a small shared pool of threads instead.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self._ready = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=OUTPUT_THREADS, thread_name_prefix='output')
+
+    def attach(self, loop):
+        self.loop = loop
+        self._ready.set()
+
+    def start(self, cmd, on_line):
+        """Start cmd and feed each line of its output (bytes) to on_line. Returns an AsyncProcess."""
+        self._ready.wait()
+        process = AsyncProcess(self.loop)
+        asyncio.run_coroutine_threadsafe(process._run(cmd, on_line, self._executor), self.loop)
+        return process
+
+
+def wsgi_environ(scope, body):
+    """The WSGI environ for an ASGI http scope whose whole body is in the file body"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # The body is complete, so Flask may read it without a Content-Length (chunked uploads to /download/bulk)
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class WsgiApp:
+    """ASGI wrapper running a WSGI app (Flask) on a pool of threads.
+
+    Like asgiref's WsgiToAsgi, but each request gets its own thread rather
+    than all of them sharing one, so a slow request such as /download/bulk
+    does not hold up the others. The request body is received in full
+    before the app is called.
+    """
+
+    def __init__(self, wsgi_app, threads=WSGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        with tempfile.SpooledTemporaryFile(max_size=65536) as body:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+
+            def send_sync(message):
+                asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+            await loop.run_in_executor(self._executor, self._run, scope, body, send_sync)
+
+    def _run(self, scope, body, send):
+        """Call the WSGI app and send its response (runs on a pool thread)"""
+        response = {'start': None, 'sent': False}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response['sent']:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['start'] = {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            }
+            return write
+
+        def write(data):
+            if not response['sent']:
+                response['sent'] = True
+                send(response['start'])
+            if data:
+                send({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+        result = self.wsgi_app(wsgi_environ(scope, body), start_response)
+        try:
+            for data in result:
+                write(data)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        write(b'')
+        send({'type': 'http.response.body'})
+
+
+def create_asgi_app(wsgi_app, event_bus, supervisor, batch_interval, heartbeat_interval=1):
+    """ASGI app serving /stream from the event loop and every other route through the Flask app.
+
+    Same HTTP API as the threaded server, but an SSE client costs a
+    coroutine rather than a worker thread parked in EventBus.get().
+    """
+    flask_app = WsgiApp(wsgi_app)
+
+    async def stream(scope, receive, send):
+        # Same cursor rules as the Flask route: the header on reconnects, else the query parameter
+        header = dict(scope['headers']).get(b'last-event-id', b'').decode('latin-1')
+        query = parse_qs(scope['query_string'].decode('latin-1'))
+        last_event_id = parse_event_id(header or (query.get('lastEventId') or [None])[0])
+
+        wakeup = AsyncWakeup(asyncio.get_running_loop())
+        subscriber = event_bus.subscribe(last_event_id, wakeup)
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'cache-control', b'no-cache'),
+                    (b'access-control-allow-origin', b'*'),
+                ],
+            })
+            while not disconnected.is_set():
+                if not await wakeup.wait(heartbeat_interval):
+                    frame = HEARTBEAT_FRAME
+                else:
+                    items = event_bus.drain(subscriber)
+                    if not items:
+                        continue
+                    frame = batch_frame(items)
+                await send({'type': 'http.response.body', 'body': frame.encode('utf-8'), 'more_body': True})
+                if frame is not HEARTBEAT_FRAME:
+                    # Let a few more events pile up before the next frame
+                    await asyncio.sleep(batch_interval)
+        finally:
+            watcher.cancel()
+            event_bus.unsubscribe(subscriber)
+
+    async def lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                supervisor.attach(asyncio.get_running_loop())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['path'] == '/stream' and scope['method'] == 'GET':
+            await stream(scope, receive, send)
+        else:
+            await flask_app(scope, receive, send)
+
+    return app
+
+
+def serve(asgi_app, port):
+    """Run an app from create_asgi_app() until interrupted"""
+    # Open /stream connections never finish on their own, so do not wait long for them on shutdown
+    uvicorn.run(asgi_app, host='127.0.0.1', port=port, log_level='warning', timeout_graceful_shutdown=2)
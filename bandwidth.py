@@ -0,0 +1,246 @@
+import re
+import threading
+import time
+
+from scheduler import host_key
+
+RATE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_rate(value):
+    """Parse a yt-dlp style rate such as '500K', '10M' or '1.5G' (bytes/s). Empty or 0 means unlimited."""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?)I?B?(?:/S)?\s*', (value or '').upper())
+    if not match:
+        return None
+    rate = float(match.group(1)) * RATE_UNITS[match.group(2)]
+    return rate or None
+
+
+def parse_host_rates(value):
+    """Parse 'youtube.com=10M,vimeo.com=2M' into a dict of per-host budgets"""
+    rates = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        host, rate = item.split('=', 1)
+        rate = parse_rate(rate)
+        if rate:
+            rates[host_key('http://' + host.strip().lower())] = rate
+    return rates
+
+
+def fair_share(budget, demands):
+    """Max-min fair split of budget between demands (key -> bytes/s, may be inf).
+
+    Keys asking for less than an equal share get what they ask for; the rest
+    is divided evenly between the others.
+    """
+    shares = {}
+    remaining = dict(demands)
+    while remaining:
+        equal = budget / len(remaining)
+        satisfied = {key: demand for key, demand in remaining.items() if demand <= equal}
+        if not satisfied:
+            shares.update((key, equal) for key in remaining)
+            break
+        for key, demand in satisfied.items():
+            shares[key] = demand
+            budget -= demand
+            del remaining[key]
+    return shares
+
+
+class TokenBucket:
+    """Classic token bucket: refills at ``rate`` bytes/s, holds at most ``burst`` seconds worth"""
+
+    def __init__(self, rate=None, burst=0.5):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = 0
+        self._updated = time.monotonic()
+
+    def set_rate(self, rate):
+        self.rate = rate
+
+    def consume(self, amount):
+        """Take amount bytes from the bucket; returns how long to sleep to stay within the rate"""
+        now = time.monotonic()
+        if not self.rate:
+            self._updated = now
+            return 0
+        self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.rate * self.burst)
+        self._updated = now
+        self._tokens -= amount
+        return -self._tokens / self.rate if self._tokens < 0 else 0
+
+
+class BandwidthController:
+    """Splits a global bandwidth budget (and optional per-host budgets) between active jobs.
+
+    Jobs are registered while they download and report the speed they see.
+    A job running well below its allocation is held back by something else
+    (the server, its host budget), so it keeps roughly what it uses and the
+    spare bandwidth goes to the jobs that are hitting their limit. Allocations
+    are recomputed whenever a job starts or finishes and every ``interval``
+    seconds; ``on_change(job_id, rate)`` is called for jobs whose allocation
+    moved by more than ``tolerance`` and should return False if the new rate
+    could not be applied yet, so it is offered again on the next pass.
+    """
+
+    def __init__(self, total_rate=None, host_rates=None, on_change=None, interval=2.0,
+                 tolerance=0.25, min_rate=64 * 1024, saturation=0.9, headroom=1.25):
+        self.total_rate = total_rate
+        self.host_rates = host_rates or {}
+        self.on_change = on_change
+        self.interval = interval
+        self.tolerance = tolerance
+        self.min_rate = min_rate
+        self.saturation = saturation  # Share of its allocation a job must use to count as limited by it
+        self.headroom = headroom      # Allocation given to other jobs, as a multiple of their speed
+        self._lock = threading.Lock()
+        self._jobs = {}     # job id -> {'host', 'speed', 'rate', 'applied'}
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return bool(self.total_rate or self.host_rates)
+
+    def add(self, job_id, host):
+        """Register a starting job and return its initial rate (None for unlimited)"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._jobs[job_id] = {'host': host, 'speed': None, 'rate': None, 'applied': None}
+            self._ensure_thread()
+        self.rebalance()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+            # Other jobs may not have slowed down yet: start within what is actually spare
+            rate = job['rate']
+            spare = self._spare(job_id)
+            if spare is not None and (rate is None or rate > spare):
+                rate = max(spare, self.min_rate)
+            job['applied'] = rate
+            return rate
+
+    def remove(self, job_id):
+        with self._lock:
+            removed = self._jobs.pop(job_id, None)
+        if removed:
+            self.rebalance()
+
+    def observe(self, job_id, speed):
+        """Feed a speed sample (bytes/s) from a job's progress stream"""
+        if not speed:
+            return
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                # Smooth out per-block jitter
+                job['speed'] = speed if job['speed'] is None else 0.7 * job['speed'] + 0.3 * speed
+
+    def rate(self, job_id):
+        """Rate a job should (re)start with (None for unlimited)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+            if job['applied'] != job['rate']:
+                spare = self._spare(job_id)
+                job['applied'] = job['rate'] if spare is None or job['rate'] is None else min(job['rate'], max(spare, self.min_rate))
+            return job['applied']
+
+    def stats(self):
+        with self._lock:
+            return {
+                'total_rate': self.total_rate,
+                'host_rates': dict(self.host_rates),
+                'allocated': sum(job['rate'] or 0 for job in self._jobs.values()),
+                'observed': sum(job['speed'] or 0 for job in self._jobs.values()),
+                'jobs': {job_id: {'host': job['host'], 'rate': job['rate'], 'speed': job['speed']}
+                         for job_id, job in self._jobs.items()},
+            }
+
+    def rebalance(self):
+        """Recompute every allocation and push the ones that changed enough"""
+        with self._lock:
+            rates = self._allocate()
+            changed = []
+            for job_id, rate in rates.items():
+                job = self._jobs[job_id]
+                job['rate'] = rate
+                applied = job['applied']
+                if applied == rate:
+                    continue
+                if applied and rate and max(rate, applied) <= min(rate, applied) * (1 + self.tolerance):
+                    continue
+                changed.append((job_id, rate))
+        for job_id, rate in changed:
+            applied = True
+            if self.on_change:
+                try:
+                    applied = self.on_change(job_id, rate) is not False
+                except Exception as e:
+                    print(f"Bandwidth rebalance error: {str(e)}")
+                    applied = False
+            if applied:
+                with self._lock:
+                    job = self._jobs.get(job_id)
+                    if job:
+                        job['applied'] = rate
+
+    def _spare(self, job_id):
+        """Budget left for job_id after the rates other jobs are currently running at (controller lock held)"""
+        host = self._jobs[job_id]['host']
+        spare = None
+        for budget, others in (
+            (self.total_rate, [job for key, job in self._jobs.items() if key != job_id]),
+            (self.host_rates.get(host), [job for key, job in self._jobs.items() if key != job_id and job['host'] == host]),
+        ):
+            if budget:
+                left = budget - sum(job['applied'] or 0 for job in others)
+                spare = left if spare is None else min(spare, left)
+        return spare
+
+    def _allocate(self):
+        """Allocation for every job (controller lock held)"""
+        demands = {}
+        for job_id, job in self._jobs.items():
+            # Judge against the limit the job is actually running with, not a pending one
+            speed, rate = job['speed'], job['applied']
+            if speed is None or rate is None or speed >= rate * self.saturation:
+                # Unknown, unlimited so far, or using (nearly) all it was given: wants more
+                demands[job_id] = float('inf')
+            else:
+                demands[job_id] = max(speed * self.headroom, self.min_rate)
+
+        # Per-host budgets cap what each host's jobs can ask for
+        by_host = {}
+        for job_id, job in self._jobs.items():
+            by_host.setdefault(job['host'], []).append(job_id)
+        for host, job_ids in by_host.items():
+            budget = self.host_rates.get(host)
+            if budget:
+                shares = fair_share(budget, {job_id: demands[job_id] for job_id in job_ids})
+                demands.update(shares)
+
+        if self.total_rate:
+            rates = fair_share(self.total_rate, demands)
+        else:
+            rates = demands
+        return {job_id: None if rate == float('inf') else max(rate, self.min_rate)
+                for job_id, rate in rates.items()}
+
+    def _ensure_thread(self):
+        # Started lazily (controller lock held) so nothing runs without a budget
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='bandwidth-controller')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.rebalance()
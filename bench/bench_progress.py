@@ -0,0 +1,70 @@
+"""Micro-benchmark: legacy regex progress scraping vs. the JSON progress template.
+
+Both fixtures were recorded from the same yt-dlp download, once with the
+default progress output and once with progress.PROGRESS_ARGS.
+
+    python bench/bench_progress.py [repeat]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from progress import parse_progress_line
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def parse_legacy(lines):
+    """The stdout scraping print_simple_progress did before the progress template"""
+    records = 0
+    for line in lines:
+        decoded_line = line.decode('utf-8', errors='replace').strip()
+        re.search(r'\[youtube\] (.+): Downloading webpage', decoded_line)
+        if '[download]' in decoded_line and '%' in decoded_line:
+            progress_match = re.search(r'\[download\]\s+(\d+(?:\.\d+)?)%', decoded_line)
+            if progress_match:
+                float(progress_match.group(1))
+                re.search(r'of\s+([\d.]+\s+[KMGT]?iB)', decoded_line)
+                re.search(r'at\s+([\d.]+\s+[KMGT]?iB/s)', decoded_line)
+                re.search(r'ETA\s+([\d:]+)', decoded_line)
+                records += 1
+    return records
+
+
+def parse_structured(lines):
+    """The current reader: one JSON parse per progress line, decode only for other output"""
+    records = 0
+    for line in lines:
+        record = parse_progress_line(line)
+        if record:
+            record.percent
+            records += 1
+        else:
+            line.decode('utf-8', errors='replace').strip()
+    return records
+
+
+def load(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return f.readlines()
+
+
+def bench(label, parser, lines, repeat):
+    records = parser(lines)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parser(lines)
+    elapsed = time.perf_counter() - start
+    total = len(lines) * repeat
+    print(f"{label:<12} {total / elapsed:>12,.0f} lines/s {elapsed / total * 1e6:>8.2f} us/line  ({records} progress records per pass)")
+    return elapsed
+
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    legacy = bench('legacy', parse_legacy, load('progress_legacy.log'), repeat)
+    structured = bench('structured', parse_structured, load('progress_json.log'), repeat)
+    print(f"speed-up: {legacy / structured:.2f}x")
@@ -0,0 +1,339 @@
+"""Load test: the server's own overhead with yt-dlp.exe replaced by bench/fake_ytdlp.py.
+
+For every batch size a fresh app.py is started in a temporary directory,
+N /stream subscribers connect, one POST /download queues the batch and the
+run ends when the job table has no unfinished jobs left. Reported per batch:
+
+    accept     time for /download to answer (queueing, dedupe, job table inserts)
+    events/s   SSE events received per second, summed over all subscribers
+    latency    stub printing a progress line -> subscriber receiving its event (p50/p95/p99)
+    cpu        server CPU time and utilisation (the stub processes are not counted)
+    rss        peak resident memory of the server
+    threads    peak thread count of the server
+
+Needs Linux (/proc) and only talks to 127.0.0.1.
+
+    python bench/bench_server.py --batches 10,100,1000 --subscribers 4
+    python bench/bench_server.py --batches 5000 --size 1M --speed 1M --workers 32 --json before.json
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(BENCH_DIR, '..', 'app.py')
+STUB = os.path.join(BENCH_DIR, 'fake_ytdlp.py')
+
+# Job states that mean a batch is still running (jobstore.UNFINISHED_STATUSES)
+UNFINISHED_STATUSES = ('queued', 'expanding', 'running', 'retrying', 'processing')
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def parse_size(value):
+    """'50M' -> 52428800; K, M and G are binary like the server's YTDLP_GUI_BANDWIDTH"""
+    value = value.strip().upper().rstrip('B').rstrip('I')
+    multiplier = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}.get(value[-1:], 1)
+    return int(float(value.rstrip('KMG')) * multiplier)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def install_stub(bin_dir):
+    """Put the stub on PATH as yt-dlp.exe, the name app.py runs"""
+    os.makedirs(bin_dir, exist_ok=True)
+    path = os.path.join(bin_dir, 'yt-dlp.exe')
+    with open(path, 'w') as f:
+        f.write(f'#!{sys.executable}\n'
+                f'import runpy\n'
+                f'runpy.run_path({STUB!r}, run_name="__main__")\n')
+    os.chmod(path, 0o755)
+
+
+class ProcessSampler(threading.Thread):
+    """Samples CPU time, RSS and thread count of a process from /proc"""
+
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self.cpu_start = self.cpu_time()
+
+    def cpu_time(self):
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        # utime and stime only: children (the stubs) are not the server's overhead
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+    def sample(self):
+        with open(f'/proc/{self.pid}/statm') as f:
+            self.peak_rss = max(self.peak_rss, int(f.read().split()[1]) * PAGE_SIZE)
+        with open(f'/proc/{self.pid}/status') as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    self.peak_threads = max(self.peak_threads, int(line.split()[1]))
+                    break
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sample()
+            except OSError:
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.cpu_time() - self.cpu_start
+
+
+class StreamSubscriber(threading.Thread):
+    """One /stream client that timestamps every event it receives"""
+
+    def __init__(self, port):
+        super().__init__(daemon=True)
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        self.conn.request('GET', '/stream')
+        self.response = self.conn.getresponse()
+        self.stopped = False
+        self.events = 0
+        self.received = []  # (receive time, url, downloaded_bytes) of progress events
+
+    def run(self):
+        try:
+            for line in self.response:
+                if self.stopped:
+                    break
+                if not line.startswith(b'data: ['):
+                    continue  # Heartbeats, "event:" and "id:" lines
+                now = time.time()
+                for event in json.loads(line[6:]):
+                    self.events += 1
+                    if event.get('downloaded_bytes') is not None:
+                        self.received.append((now, event.get('url'), event['downloaded_bytes']))
+        except (OSError, http.client.HTTPException):
+            pass
+
+    def stop(self):
+        self.stopped = True
+        self.join(timeout=5)  # Wakes up on the next heartbeat at the latest
+        self.conn.close()
+
+
+def request(port, method, path, body=None, timeout=600):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = conn.getresponse()
+        return json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def start_server(work_dir, port, args):
+    env = dict(os.environ)
+    env.update({
+        'PATH': os.path.join(work_dir, 'bin') + os.pathsep + env.get('PATH', ''),
+        'YTDLP_GUI_PORT': str(port),
+        'YTDLP_GUI_ENGINE': 'subprocess',
+        'YTDLP_GUI_SERVER': args.server,
+        'YTDLP_GUI_MAX_WORKERS': str(args.workers),
+        'YTDLP_GUI_PER_HOST_LIMIT': str(args.workers),  # Every bench URL is on one host
+        'YTDLP_GUI_PROGRESS_RATE': str(args.progress_rate),
+        'YTDLP_GUI_MAX_RETRIES': '0',  # A failed job is finished, not waiting on a retry timer
+        'FAKE_YTDLP_SIZE': str(args.size),
+        'FAKE_YTDLP_SPEED': str(args.speed),
+        'FAKE_YTDLP_RATE': str(args.rate),
+        'FAKE_YTDLP_STARTUP': str(args.startup),
+        'FAKE_YTDLP_FAIL_RATE': str(args.fail_rate),
+        'FAKE_YTDLP_FAILURE': args.failure,
+        'FAKE_YTDLP_LOG': os.path.join(work_dir, 'progress.log'),
+    })
+    for name in ('YTDLP_GUI_DB', 'YTDLP_GUI_ARCHIVE_DIR', 'YTDLP_GUI_INFO_CACHE_DIR', 'YTDLP_GUI_BANDWIDTH',
+                 'YTDLP_GUI_HOST_BANDWIDTH', 'YTDLP_GUI_HOST_LIMITS', 'YTDLP_GUI_STAGING_DIR',
+                 'YTDLP_GUI_DISK_RESERVE'):
+        env.pop(name, None)  # Defaults keep everything inside work_dir
+    log = open(os.path.join(work_dir, 'server.log'), 'wb')
+    process = subprocess.Popen([sys.executable, os.path.abspath(APP)], cwd=work_dir, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited with code {process.returncode}, see {work_dir}/server.log')
+        try:
+            request(port, 'GET', '/jobs?limit=1', timeout=1)
+            return process
+        except (OSError, ValueError):
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('Server did not start within 30 seconds')
+
+
+def load_emit_times(path):
+    times = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                parts = line.rstrip('\n').split(' ', 2)
+                if len(parts) == 3:
+                    times.setdefault((parts[2], int(parts[1])), float(parts[0]))
+    except OSError:
+        pass
+    return times
+
+
+def run_batch(batch_size, args):
+    work_dir = tempfile.mkdtemp(prefix='ytdlp-gui-bench-')
+    port = free_port()
+    install_stub(os.path.join(work_dir, 'bin'))
+    server = start_server(work_dir, port, args)
+    try:
+        sampler = ProcessSampler(server.pid)
+        sampler.start()
+        subscribers = [StreamSubscriber(port) for _ in range(args.subscribers)]
+        for subscriber in subscribers:
+            subscriber.start()
+
+        urls = [f'https://bench.invalid/watch/{batch_size}-{i}' for i in range(batch_size)]
+        options = {'downloadPath': os.path.join(work_dir, 'downloads')}
+        start = time.time()
+        response = request(port, 'POST', '/download', {'urls': urls, 'options': options})
+        accepted = time.time() - start
+        if not response.get('success'):
+            raise RuntimeError(f"/download failed: {response.get('error')}")
+
+        counts = {}
+        timed_out = False
+        while True:
+            counts = request(port, 'GET', '/jobs?limit=1')['counts']
+            if not any(counts.get(status) for status in UNFINISHED_STATUSES):
+                break
+            if time.time() - start > args.timeout:
+                timed_out = True
+                break
+            time.sleep(0.25)
+        elapsed = time.time() - start
+        time.sleep(0.5)  # Let the last SSE frames arrive
+
+        cpu = sampler.stop()
+        for subscriber in subscribers:
+            subscriber.stop()
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    emitted = load_emit_times(os.path.join(work_dir, 'progress.log'))
+    latencies = []
+    for subscriber in subscribers:
+        for received_at, url, downloaded in subscriber.received:
+            emitted_at = emitted.get((url, downloaded))
+            if emitted_at is not None:
+                latencies.append(received_at - emitted_at)
+    events = sum(subscriber.events for subscriber in subscribers)
+    if args.keep:
+        print(f'Kept {work_dir}')
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'batch': batch_size,
+        'subscribers': args.subscribers,
+        'accept_seconds': accepted,
+        'elapsed_seconds': elapsed,
+        'timed_out': timed_out,
+        'counts': counts,
+        'events': events,
+        'events_per_second': events / elapsed if elapsed else 0,
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p95': percentile(latencies, 0.95),
+        'latency_p99': percentile(latencies, 0.99),
+        'latency_samples': len(latencies),
+        'cpu_seconds': cpu,
+        'cpu_percent': cpu * 100 / elapsed if elapsed else 0,
+        'peak_rss_bytes': sampler.peak_rss,
+        'peak_threads': sampler.peak_threads,
+    }
+
+
+def format_ms(seconds):
+    return f'{seconds * 1000:.1f}' if seconds is not None else '-'
+
+
+def print_result(result):
+    failed = result['counts'].get('failed', 0)
+    print(f"{result['batch']:>6} {format_ms(result['accept_seconds']):>10} {result['elapsed_seconds']:>9.1f} "
+          f"{result['events']:>9} {result['events_per_second']:>9.0f} "
+          f"{format_ms(result['latency_p50']):>8} {format_ms(result['latency_p95']):>8} {format_ms(result['latency_p99']):>8} "
+          f"{result['cpu_seconds']:>7.1f} {result['cpu_percent']:>6.0f} "
+          f"{result['peak_rss_bytes'] / 1024 / 1024:>8.1f} {result['peak_threads']:>7} {failed:>6}"
+          f"{'  TIMED OUT' if result['timed_out'] else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--batches', default='10,100,1000', help='comma-separated batch sizes (URLs per /download)')
+    parser.add_argument('--subscribers', type=int, default=4, help='concurrent /stream clients')
+    parser.add_argument('--server', choices=['threaded', 'asgi'], default='threaded', help='YTDLP_GUI_SERVER for the server')
+    parser.add_argument('--workers', type=int, default=16, help='YTDLP_GUI_MAX_WORKERS for the server')
+    parser.add_argument('--progress-rate', type=float, default=2, help='YTDLP_GUI_PROGRESS_RATE for the server')
+    parser.add_argument('--size', type=parse_size, default=parse_size('20M'), help='bytes per fake download')
+    parser.add_argument('--speed', type=parse_size, default=parse_size('10M'), help='bytes per second per fake download')
+    parser.add_argument('--rate', type=float, default=10, help='progress lines per second per fake download')
+    parser.add_argument('--startup', type=float, default=0.2, help='seconds of fake extraction before the first byte')
+    parser.add_argument('--fail-rate', type=float, default=0, help='fraction of URLs that fail')
+    parser.add_argument('--failure', choices=['unavailable', 'network', '429'], default='unavailable',
+                        help='how failing URLs fail')
+    parser.add_argument('--timeout', type=float, default=1800, help='seconds to wait for one batch')
+    parser.add_argument('--json', help='also write the results to this file, for comparing runs')
+    parser.add_argument('--keep', action='store_true', help='keep the work directories (server.log, jobs.db)')
+    args = parser.parse_args()
+
+    if not os.path.isdir('/proc/self'):
+        sys.exit('bench_server.py needs /proc (Linux)')
+    batches = [int(size) for size in args.batches.split(',') if size.strip()]
+
+    print(f"server={args.server} workers={args.workers} subscribers={args.subscribers} progress_rate={args.progress_rate} "
+          f"size={args.size} speed={args.speed}/s rate={args.rate}/s fail_rate={args.fail_rate} ({args.failure})")
+    print(f"{'batch':>6} {'accept ms':>10} {'elapsed s':>9} {'events':>9} {'events/s':>9} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'cpu s':>7} {'cpu %':>6} {'rss MiB':>8} {'threads':>7} {'failed':>6}")
+    results = []
+    for batch_size in batches:
+        result = run_batch(batch_size, args)
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Stand-in for yt-dlp.exe that downloads nothing, for load tests of the server.
+
+It takes the command lines app.py builds, prints the output yt-dlp would
+(extractor lines, "Destination:", progress in --progress-template form or
+as plain "[download]" lines) at a configurable rate, writes a sparse dummy
+file of the requested size and appends to --download-archive. A
+"--exec before_dl:" hook is run on the file first, and a file that is then
+in place is reported as already downloaded. Behaviour is
+set through the environment, which it inherits from the server:
+
+    FAKE_YTDLP_SIZE       bytes per download (default 50 MiB)
+    FAKE_YTDLP_SPEED      bytes per second (default 25 MiB/s)
+    FAKE_YTDLP_RATE       progress lines per second (default 10)
+    FAKE_YTDLP_STARTUP    seconds of "extraction" before the first byte (default 0.2)
+    FAKE_YTDLP_FAIL_RATE  fraction of URLs that fail (default 0), picked by a hash of the URL
+    FAKE_YTDLP_FAILURE    unavailable (permanent), network (retryable, halfway through) or 429
+    FAKE_YTDLP_LOG        file that gets "time downloaded_bytes url" for every progress line
+
+bench/bench_server.py installs it as yt-dlp.exe on the server's PATH.
+"""
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import time
+import zlib
+
+FAILURES = {
+    'unavailable': 'ERROR: [generic] {id}: Video unavailable. This video has been removed by the uploader',
+    'network': 'ERROR: unable to download video data: <urlopen error [Errno 104] Connection reset by peer>',
+    '429': 'ERROR: [generic] {id}: Unable to download webpage: HTTP Error 429: Too Many Requests',
+}
+
+# Options that take a value, so the URL can be told apart from option arguments
+VALUE_OPTIONS = {
+    '-o', '-P', '-f', '--merge-output-format', '--download-archive', '--retries', '--fragment-retries',
+    '--progress-template', '--user-agent', '--rate-limit', '--cookies', '--cookies-from-browser',
+    '--proxy', '--proxy-bypass', '--sub-langs', '--sub-format', '--convert-subs', '--load-info-json',
+    '-u', '-p', '--username', '--password', '-N', '--concurrent-fragments', '--downloader',
+    '--downloader-args', '--paths', '--output', '--exec',
+}
+
+TEMPLATE_FIELD = re.compile(r'%\(([\w.]+)(?:\|([^)]*))?\)([sj])')
+
+
+def env_float(name, default):
+    return float(os.environ.get(name) or default)
+
+
+def parse_args(argv):
+    options = {}
+    urls = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg in VALUE_OPTIONS and i + 1 < len(argv):
+            options[arg] = argv[i + 1]
+            i += 2
+            continue
+        if arg.startswith('-'):
+            options[arg] = True
+        else:
+            urls.append(arg)
+        i += 1
+    return options, urls
+
+
+def video_id(url):
+    return f'{zlib.crc32(url.encode()):08x}'
+
+
+def render_template(template, progress):
+    """Fill in a --progress-template the way yt-dlp does for the fields app.py uses"""
+    if ':' in template.split('[', 1)[0]:
+        template = template.split(':', 1)[1]  # Drop the "download:" type prefix
+
+    def field(match):
+        name, default, conversion = match.groups()
+        value = progress.get(name.split('.', 1)[1]) if name.startswith('progress.') else None
+        if conversion == 'j':
+            return json.dumps(value)
+        return str(value) if value is not None else (default if default is not None else 'NA')
+
+    return TEMPLATE_FIELD.sub(field, template)
+
+
+def format_bytes(num_bytes):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if abs(num_bytes) < 1024:
+            return f'{num_bytes:.2f}{unit}'
+        num_bytes /= 1024
+    return f'{num_bytes:.2f}TiB'
+
+
+def output_path(options, url, vid):
+    template = options.get('-o') or options.get('--output') or '%(title)s [%(id)s].%(ext)s'
+    fields = {'id': vid, 'title': f'Bench video {vid}', 'ext': options.get('--merge-output-format') or 'mp4',
+              'extractor': 'generic', 'uploader': 'bench'}
+    name = re.sub(r'%\((\w+)\)s', lambda m: str(fields.get(m.group(1), 'NA')), template)
+    return os.path.join(options.get('-P') or options.get('--paths') or '.', name)
+
+
+def run_before_dl(options, path):
+    """Run a --exec before_dl: hook the way yt-dlp does, with the quoted file name appended"""
+    hook = options.get('--exec')
+    if not isinstance(hook, str) or not hook.startswith('before_dl:'):
+        return 0
+    quoted = subprocess.list2cmdline([path]) if os.name == 'nt' else shlex.quote(path)
+    command = hook[len('before_dl:'):].replace('%%', '%') + ' ' + quoted
+    emit(f'[Exec] Executing command: {command}')
+    return subprocess.run(command, shell=True).returncode
+
+
+def emit(line):
+    sys.stdout.write(line + '\n')
+    sys.stdout.flush()
+
+
+def download(options, url):
+    size = int(env_float('FAKE_YTDLP_SIZE', 50 * 1024 * 1024))
+    speed = env_float('FAKE_YTDLP_SPEED', 25 * 1024 * 1024)
+    rate = env_float('FAKE_YTDLP_RATE', 10)
+    fail_rate = env_float('FAKE_YTDLP_FAIL_RATE', 0)
+    failure = os.environ.get('FAKE_YTDLP_FAILURE') or 'unavailable'
+    log_path = os.environ.get('FAKE_YTDLP_LOG')
+
+    vid = video_id(url)
+    fails = fail_rate > 0 and zlib.crc32(url.encode(), 1) % 10000 < fail_rate * 10000
+
+    emit(f'[generic] Extracting URL: {url}')
+    emit(f'[generic] {vid}: Downloading webpage')
+    time.sleep(env_float('FAKE_YTDLP_STARTUP', 0.2))
+    if fails and failure != 'network':
+        emit(FAILURES.get(failure, FAILURES['unavailable']).format(id=vid))
+        return 1
+
+    emit(f'[info] {vid}: Downloading 1 format(s): 18')
+    path = output_path(options, url, vid)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    hook_code = run_before_dl(options, path)
+    if hook_code:
+        emit(f'ERROR: Command returned error code {hook_code}')
+        return 1
+    if os.path.exists(path):
+        emit(f'[download] {path} has already been downloaded')
+        return 0
+    emit(f'[download] Destination: {path}')
+
+    template = options.get('--progress-template')
+    log = open(log_path, 'a', buffering=1) if log_path else None
+    start = time.monotonic()
+    downloaded = 0
+    try:
+        while True:
+            elapsed = time.monotonic() - start
+            downloaded = min(size, int(elapsed * speed)) if speed > 0 else size
+            done = downloaded >= size
+            if fails and downloaded >= size // 2:
+                emit(FAILURES['network'])
+                return 1
+            progress = {
+                'status': 'finished' if done else 'downloading',
+                'downloaded_bytes': downloaded,
+                'total_bytes': size,
+                'total_bytes_estimate': None,
+                'speed': speed if speed > 0 else None,
+                'eta': int((size - downloaded) / speed) if speed > 0 else 0,
+                'fragment_index': None,
+                'fragment_count': None,
+            }
+            if template:
+                emit(render_template(template, progress))
+            else:
+                emit(f'[download] {downloaded * 100 / size:5.1f}% of {format_bytes(size)} '
+                     f'at {format_bytes(speed)}/s ETA {progress["eta"] // 60:02d}:{progress["eta"] % 60:02d}')
+            if log:
+                log.write(f'{time.time():.6f} {downloaded} {url}\n')
+            if done:
+                break
+            time.sleep(1 / rate if rate > 0 else 0)
+    finally:
+        if log:
+            log.close()
+
+    # Sparse, so thousands of downloads cost no disk space
+    with open(path, 'wb') as f:
+        f.truncate(size)
+    if not template:
+        emit(f'[download] 100% of {format_bytes(size)} in {time.monotonic() - start:.2f}s at {format_bytes(speed)}/s')
+    if options.get('--download-archive'):
+        with open(options['--download-archive'], 'a') as f:
+            f.write(f'generic {vid}\n')
+    return 0
+
+
+def main(argv):
+    options, urls = parse_args(argv)
+    if options.get('--update'):
+        emit('yt-dlp is up to date (bench stub)')
+        return 0
+    if options.get('--load-info-json'):
+        with open(options['--load-info-json'], encoding='utf-8') as f:
+            urls = [json.load(f).get('webpage_url') or options['--load-info-json']]
+    if not urls:
+        emit('ERROR: You must provide at least one URL.')
+        return 2
+    if options.get('--dump-json') or options.get('--dump-single-json'):
+        for url in urls:
+            vid = video_id(url)
+            emit(json.dumps({'id': vid, 'title': f'Bench video {vid}', 'extractor_key': 'Generic',
+                             'webpage_url': url, 'ext': 'mp4', 'formats': []}))
+        return 0
+    if options.get('--skip-download'):
+        return 0
+    return_code = 0
+    for url in urls:
+        return_code = download(options, url) or return_code
+    return return_code
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,171 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+# yt-dlp output when cookies are missing, stale or rejected
+AUTH_FAILURE_PATTERN = re.compile(
+    r'Sign in to confirm|login required|log in to|cookies (?:are|have) (?:no longer valid|expired)|'
+    r'--cookies-from-browser or --cookies|HTTP Error 401|members[- ]only|Private video', re.I)
+
+EXPORT_RETRY_DELAY = 60  # Seconds before a browser whose export failed is tried again
+MIN_REFRESH_INTERVAL = 60  # An auth failure does not re-export a jar younger than this
+
+
+def browser_auth(options):
+    """(browser, profile) when the options authenticate with browser cookies, else None"""
+    auth = options.get('authentication', {})
+    if auth.get('enabled') and auth.get('method') == 'browser' and auth.get('browser'):
+        return auth['browser'], auth.get('profile') or None
+    return None
+
+
+def browser_spec(browser, profile):
+    """The --cookies-from-browser argument"""
+    return f'{browser}:{profile}' if profile else browser
+
+
+def is_auth_failure(messages):
+    return any(AUTH_FAILURE_PATTERN.search(message) for message in messages)
+
+
+def export_browser_cookies(browser, profile, path, timeout=120):
+    """Write a browser's cookies to a Netscape cookie file with yt-dlp.exe.
+
+    Without a URL yt-dlp exits with a usage error, but only after saving the
+    cookies it loaded to --cookies, so no page is requested.
+    """
+    cmd = ['yt-dlp.exe', '--ignore-config', '--no-colors',
+           '--cookies-from-browser', browser_spec(browser, profile), '--cookies', path]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+    if not os.path.exists(path) or not os.path.getsize(path):
+        lines = [line for line in result.stdout.decode('utf-8', errors='replace').splitlines() if 'ERROR' in line]
+        raise RuntimeError(lines[0] if lines else f"yt-dlp exited with code {result.returncode}")
+
+
+class CookieJarCache:
+    """Browser cookies exported once per ``ttl`` into a cookie file every yt-dlp run shares.
+
+    Reading a browser's cookie database means decrypting it (keyring access)
+    and competing with the running browser for its SQLite lock, so doing it
+    in every process does not scale to a batch. ``export(browser, profile,
+    path)`` does it once per browser profile; runs then get ``--cookies``.
+
+    yt-dlp writes its cookie file back when it exits, so each run gets a
+    private copy (see copy_for) instead of the shared jar, deleted by
+    discard() once the run is over. jar_dir should belong to this process
+    alone (tempfile.mkdtemp()); close() removes it.
+    """
+
+    def __init__(self, jar_dir, export, ttl=1800):
+        self.jar_dir = jar_dir
+        self.export = export
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._key_locks = {}  # (browser, profile) -> lock held while that jar is exported
+        self._jars = {}       # (browser, profile) -> {'path', 'exported_at'}
+        self._failed = {}     # (browser, profile) -> monotonic time of the last failed export
+        self.exports = 0
+        # Cookies are credentials: keep them private
+        os.makedirs(jar_dir, mode=0o700, exist_ok=True)
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _current(self, key):
+        jar = self._jars.get(key)
+        if jar and time.monotonic() - jar['exported_at'] < self.ttl:
+            return jar
+        return None
+
+    def jar_for(self, browser, profile):
+        """Path of the shared jar, exported now if missing or expired; None if the export failed"""
+        key = (browser, profile)
+        with self._lock:
+            jar = self._current(key)
+        if jar:
+            return jar['path']
+        # One export per browser profile; concurrent callers wait for it
+        with self._key_lock(key):
+            with self._lock:
+                jar = self._current(key)
+                failed_at = self._failed.get(key)
+            if jar:
+                return jar['path']
+            if failed_at and time.monotonic() - failed_at < EXPORT_RETRY_DELAY:
+                return None
+            name = re.sub(r'[^\w.-]', '_', browser_spec(browser, profile))
+            path = os.path.join(self.jar_dir, f'{name}.txt')
+            temp_path = path + '.part'
+            try:
+                self.export(browser, profile, temp_path)
+                os.chmod(temp_path, 0o600)
+                os.replace(temp_path, path)  # Copies being made never see a half-written jar
+            except Exception as e:
+                print(f"Could not export cookies from {browser_spec(browser, profile)}: {e}")
+                with self._lock:
+                    self._failed[key] = time.monotonic()
+                return None
+            with self._lock:
+                self._jars[key] = {'path': path, 'exported_at': time.monotonic()}
+                self._failed.pop(key, None)
+                self.exports += 1
+            return path
+
+    def copy_for(self, browser, profile):
+        """A private copy of the jar for one yt-dlp run, or None if there is no jar"""
+        path = self.jar_for(browser, profile)
+        if not path:
+            return None
+        self._sweep()
+        fd, copy_path = tempfile.mkstemp(prefix='run-', suffix='.txt', dir=self.jar_dir)
+        with os.fdopen(fd, 'wb') as dst, open(path, 'rb') as src:
+            shutil.copyfileobj(src, dst)
+        return copy_path
+
+    def discard(self, copy_path):
+        """Delete a copy made by copy_for() once its run has exited; other paths are left alone"""
+        if os.path.dirname(copy_path) != self.jar_dir or not os.path.basename(copy_path).startswith('run-'):
+            return
+        try:
+            os.remove(copy_path)
+        except OSError:
+            pass
+
+    def close(self):
+        shutil.rmtree(self.jar_dir, ignore_errors=True)
+
+    def _sweep(self):
+        """Remove run copies older than the TTL, left by runs that were never discarded"""
+        cutoff = time.time() - self.ttl
+        for entry in os.scandir(self.jar_dir):
+            if entry.name.startswith('run-'):
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def invalidate(self, browser, profile, used_at):
+        """Handle an authentication failure of a run started at used_at (time.monotonic()).
+
+        Drops the jar unless it is younger than MIN_REFRESH_INTERVAL. Returns
+        True when the next run will get newer cookies than the failed one had.
+        """
+        key = (browser, profile)
+        with self._lock:
+            jar = self._jars.get(key)
+            if jar is None or jar['exported_at'] > used_at:
+                return True  # Already dropped or re-exported since that run started
+            if time.monotonic() - jar['exported_at'] < MIN_REFRESH_INTERVAL:
+                return False
+            del self._jars[key]
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {'jars': len(self._jars), 'exports': self.exports}
@@ -0,0 +1,403 @@
+import copy
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from bandwidth import TokenBucket
+from postprocess import AUDIO_CODECS
+from storage import adopt_existing
+from subtitles import subtitle_languages
+
+try:
+    import yt_dlp
+except ImportError:
+    yt_dlp = None
+
+AUDIO_FORMATS = list(AUDIO_CODECS)
+
+# How often a worker checks whether its job was cancelled or its rate limit changed
+CANCEL_CHECK_INTERVAL = 0.5
+
+
+def yt_dlp_available():
+    return yt_dlp is not None
+
+
+def select_formats(info, format_spec):
+    """The formats yt-dlp would download for format_spec, chosen from a probed info dict.
+
+    The streams of a merged format are listed separately. None without
+    yt_dlp, or when the spec matches nothing. Runs yt-dlp's own selection
+    (process_ie_result without downloading) on a copy of info, with a
+    YoutubeDL of its own, so callers on any thread are fine.
+    """
+    if yt_dlp is None or not info or not info.get('formats'):
+        return None
+    params = {'format': format_spec, 'quiet': True, 'no_warnings': True, 'simulate': True, 'check_formats': False}
+    try:
+        with yt_dlp.YoutubeDL(params) as ydl:
+            selected = ydl.process_ie_result(copy.deepcopy(info), download=False)
+    except Exception:
+        return None
+    return selected.get('requested_formats') or [selected]
+
+
+# Params the subtitle-only pass shares with the media download
+SUBTITLE_PASS_KEYS = (
+    'cookiesfrombrowser', 'username', 'password', 'twofactor', 'cookiefile', 'proxy',
+    'retries', 'outtmpl', 'paths', 'no_color',
+)
+
+
+def params_from_options(options, cookie_file=None):
+    """Translate the web UI options dict into YoutubeDL params for the media download.
+
+    Mirrors build_command() in app.py so both backends download the same thing.
+    Subtitles are fetched by a separate pass, see subtitle_params(), and ffmpeg
+    work other than merging is left to the post-processing stage. cookie_file
+    replaces reading the browser's cookies (see cookiejar.CookieJarCache).
+    """
+    params = {
+        'continuedl': True,
+        'nooverwrites': True,
+        'updatetime': True,
+        'retries': 10,
+        'fragment_retries': 10,
+        'no_color': True,
+    }
+
+    # Authentication settings
+    auth = options.get('authentication', {})
+    if auth.get('enabled'):
+        method = auth.get('method')
+        if method == 'browser' and cookie_file:
+            params['cookiefile'] = cookie_file
+        elif method == 'browser' and auth.get('browser'):
+            params['cookiesfrombrowser'] = (auth.get('browser'), auth.get('profile') or None, None, None)
+        elif method == 'manual' and auth.get('username') and auth.get('password'):
+            params['username'] = auth.get('username')
+            params['password'] = auth.get('password')
+            if auth.get('twoFactor'):
+                params['twofactor'] = auth.get('twoFactor')
+        elif method == 'file' and auth.get('cookieFile'):
+            cookie_file_path = os.path.join(os.getcwd(), auth.get('cookieFile'))
+            if os.path.exists(cookie_file_path):
+                params['cookiefile'] = cookie_file_path
+
+    # Proxy settings
+    proxy = options.get('proxy', {})
+    if proxy.get('enabled'):
+        proxy_url = f"{proxy['type']}://"
+        if proxy.get('username') and proxy.get('password'):
+            proxy_url += f"{proxy['username']}:{proxy['password']}@"
+        proxy_url += f"{proxy['host']}:{proxy['port']}"
+        params['proxy'] = proxy_url
+
+    # Format/quality options
+    format_type = options.get('format')
+    if options.get('quality'):
+        params['format'] = options['quality']
+    elif format_type in AUDIO_FORMATS:
+        params['format'] = 'bestaudio/best'
+    if format_type in AUDIO_FORMATS:
+        # Extraction runs in our post-processing stage, so tell yt-dlp the name the file ends up with
+        params['final_ext'] = AUDIO_CODECS[format_type][0]
+    if format_type and format_type not in AUDIO_FORMATS:
+        params['merge_output_format'] = format_type
+
+    # Additional options
+    if options.get('embedThumb'):
+        params['writethumbnail'] = True
+    if options.get('writeDesc'):
+        params['writedescription'] = True
+    if options.get('writeMeta'):
+        params['writeinfojson'] = True
+    if options.get('writeComments'):
+        params['getcomments'] = True
+        params['writeinfojson'] = True
+    if options.get('writeThumbnail'):
+        params['writethumbnail'] = True
+
+    # Output template and download path
+    if options.get('outputTemplate'):
+        params['outtmpl'] = {'default': options['outputTemplate']}
+    if options.get('downloadPath'):
+        os.makedirs(options['downloadPath'], exist_ok=True)
+        params['paths'] = {'home': options['downloadPath']}
+
+    return params
+
+
+def subtitle_params(options, cookie_file=None):
+    """YoutubeDL params for the subtitle-only pass; mirrors subtitles.subtitle_args()"""
+    media = params_from_options(options, cookie_file)
+    params = {key: media[key] for key in SUBTITLE_PASS_KEYS if key in media}
+    sub_format = options.get('subtitleFormat', 'srt')
+    params.update(
+        skip_download=True,
+        writesubtitles=True,
+        writeautomaticsub=bool(options.get('writeSub') or options.get('persianSubs')),
+        subtitlesformat=f'{sub_format}/best',
+        # before_dl: with skip_download the later post-processing stages never run
+        postprocessors=[{'key': 'FFmpegSubtitlesConvertor', 'format': sub_format, 'when': 'before_dl'}],
+    )
+    langs = subtitle_languages(options)
+    if langs:
+        params['subtitleslangs'] = langs
+    return params
+
+
+def export_browser_cookies(browser, profile, path):
+    """Write a browser's cookies to a Netscape cookie file, in this process"""
+    params = {'cookiesfrombrowser': (browser, profile, None, None), 'quiet': True, 'no_warnings': True}
+    with yt_dlp.YoutubeDL(params) as ydl:
+        ydl.cookiejar.save(path)
+
+
+# --- Worker process side ---
+
+_events = None
+_cancelled = None
+_rates = None
+
+
+def _init_worker(events, cancelled, rates):
+    """Pool initializer: keep the queues and pay the yt_dlp import once per worker"""
+    global _events, _cancelled, _rates
+    _events = events
+    _cancelled = cancelled
+    _rates = rates
+    import yt_dlp.extractor  # noqa: F401  (loads the extractor registry up front)
+
+
+class _QueueLogger:
+    """YoutubeDL logger that forwards messages to the parent as log events"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def _put(self, level, msg):
+        _events.put({'job_id': self.job_id, 'type': 'log', 'level': level, 'message': msg})
+
+    def debug(self, msg):
+        # yt-dlp routes regular screen output through debug() as well
+        if not msg.startswith('[debug] '):
+            self._put('info', msg)
+
+    def info(self, msg):
+        self._put('info', msg)
+
+    def warning(self, msg):
+        self._put('warning', msg)
+
+    def error(self, msg):
+        self._put('error', msg)
+
+
+def _extract(url, params):
+    """Extract metadata only, inside a pool worker. Returns a JSON-safe info dict."""
+    params = dict(params, quiet=True, no_warnings=True, skip_download=True)
+    with yt_dlp.YoutubeDL(params) as ydl:
+        return ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+
+def _download(job_id, url, params, info_file=None):
+    """Run one download inside a pool worker. Returns (return_code, error)"""
+    last_check = 0
+    last_bytes = 0
+    # Throttled here rather than with the ratelimit param so a new allocation applies immediately
+    bucket = TokenBucket(_rates.get(job_id))
+
+    def check_cancelled():
+        nonlocal last_check
+        now = time.monotonic()
+        if now - last_check >= CANCEL_CHECK_INTERVAL:
+            last_check = now
+            if job_id in _cancelled:
+                raise yt_dlp.utils.DownloadCancelled('Cancelled by user')
+            bucket.set_rate(_rates.get(job_id))
+
+    def progress_hook(d):
+        nonlocal last_bytes
+        check_cancelled()
+        downloaded = d.get('downloaded_bytes') or 0
+        if d.get('status') == 'downloading':
+            delay = bucket.consume(max(downloaded - last_bytes, 0))
+            if delay:
+                time.sleep(delay)
+        last_bytes = downloaded
+        _events.put({
+            'job_id': job_id,
+            'type': 'progress',
+            'status': d.get('status'),
+            'downloaded_bytes': d.get('downloaded_bytes'),
+            'total_bytes': d.get('total_bytes') or d.get('total_bytes_estimate'),
+            'speed': d.get('speed'),
+            'eta': d.get('eta'),
+            'fragment_index': d.get('fragment_index'),
+            'fragment_count': d.get('fragment_count'),
+            'filename': d.get('filename'),
+        })
+
+    def postprocessor_hook(d):
+        check_cancelled()
+        _events.put({
+            'job_id': job_id,
+            'type': 'postprocess',
+            'status': d.get('status'),
+            'postprocessor': d.get('postprocessor'),
+            'filename': (d.get('info_dict') or {}).get('filepath'),
+        })
+
+    params = dict(
+        params,
+        logger=_QueueLogger(job_id),
+        progress_hooks=[progress_hook],
+        postprocessor_hooks=[postprocessor_hook],
+        quiet=True,
+        noprogress=True,
+    )
+    adopt_from = params.pop('adopt_from', None)
+    try:
+        with yt_dlp.YoutubeDL(params) as ydl:
+            if adopt_from:
+                ydl.add_post_processor(_AdoptExistingPP(ydl, params['paths']['home'], adopt_from, params.get('final_ext')),
+                                       when='before_dl')
+            if info_file:
+                # Metadata was probed already; skip extraction
+                return ydl.download_with_info_file(info_file), None
+            return ydl.download([url]), None
+    except yt_dlp.utils.DownloadCancelled as e:
+        return 1, str(e)
+    except Exception as e:
+        return 1, str(e)
+    finally:
+        # Marks the end of this job's event stream for the parent
+        _events.put({'job_id': job_id, 'type': 'done'})
+
+
+if yt_dlp:
+    class _AdoptExistingPP(yt_dlp.postprocessor.PostProcessor):
+        """before_dl hook running storage.adopt_existing(), like the --exec hook of yt-dlp.exe runs"""
+
+        def __init__(self, downloader, staging_dir, final_dir, final_ext=None):
+            super().__init__(downloader)
+            self.staging_dir = staging_dir
+            self.final_dir = final_dir
+            self.final_ext = final_ext
+
+        def run(self, info):
+            adopt_existing(info['_filename'], self.staging_dir, self.final_dir, self.final_ext)
+            return [], info
+
+
+# --- Server process side ---
+
+class EngineTask:
+    """Popen-like handle for a job running in the engine, so Job.cancel() works unchanged"""
+
+    def __init__(self, engine, job_id):
+        self.engine = engine
+        self.job_id = job_id
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.engine.cancel(self.job_id)
+
+
+class InProcessEngine:
+    """Runs downloads through the yt_dlp Python API in a pool of warm worker processes.
+
+    Workers import yt_dlp once and are reused across jobs, so a job pays no
+    interpreter or extractor start-up cost. Progress arrives as structured
+    events from progress_hooks/postprocessor_hooks and is routed to the
+    callback registered for the job.
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._handlers = {}   # job id -> (on_event, done event)
+
+    def _start(self):
+        with self._lock:
+            if self._executor:
+                return
+            # spawn everywhere: matches Windows and avoids forking a threaded server
+            ctx = multiprocessing.get_context('spawn')
+            self._manager = ctx.Manager()
+            self._cancelled = self._manager.dict()
+            self._rates = self._manager.dict()    # job id -> bytes/s from the bandwidth controller
+            self._events = ctx.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=ctx,
+                initializer=_init_worker,
+                initargs=(self._events, self._cancelled, self._rates)
+            )
+            dispatcher = threading.Thread(target=self._dispatch_events, name='engine-events')
+            dispatcher.daemon = True
+            dispatcher.start()
+
+    def _dispatch_events(self):
+        while True:
+            event = self._events.get()
+            handler = self._handlers.get(event.get('job_id'))
+            if not handler:
+                continue
+            on_event, done = handler
+            if event['type'] == 'done':
+                done.set()
+                continue
+            try:
+                on_event(event)
+            except Exception as e:
+                print(f"Engine event handler error: {str(e)}")
+
+    def run(self, job_id, url, params, on_event, task=None, info_file=None):
+        """Download url in a worker, calling on_event for each progress/log event.
+
+        Blocks until the job finishes and returns (return_code, error).
+        """
+        self._start()
+        done = threading.Event()
+        self._handlers[job_id] = (on_event, done)
+        try:
+            future = self._executor.submit(_download, job_id, url, params, info_file)
+            return_code, error = future.result()
+            # Let the dispatcher deliver the tail of the event stream first
+            done.wait(timeout=5)
+            if task:
+                task.returncode = return_code
+            return return_code, error
+        finally:
+            self._handlers.pop(job_id, None)
+            self._cancelled.pop(job_id, None)
+            self._rates.pop(job_id, None)
+
+    def extract(self, url, params):
+        """Extract metadata for url in a worker without downloading"""
+        self._start()
+        return self._executor.submit(_extract, url, params).result()
+
+    def cancel(self, job_id):
+        self._start()
+        self._cancelled[job_id] = True
+
+    def set_rate(self, job_id, rate):
+        """Change a job's bandwidth limit (bytes/s, None for unlimited); running workers pick it up within CANCEL_CHECK_INTERVAL"""
+        self._start()
+        self._rates[job_id] = rate
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._manager.shutdown()
+                self._executor = None
@@ -0,0 +1,226 @@
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Buffer key for events that do not belong to a job
+GLOBAL_KEY = '_global'
+
+# Events after which a job's progress coalescing state can be forgotten
+FINAL_EVENT_TYPES = ('complete', 'error')
+
+# SSE frame sent when a client has had nothing for a while, so proxies keep the connection open
+HEARTBEAT_FRAME = f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
+
+
+def is_progress(event):
+    """Progress updates may be downsampled; every other event is a state change and is always kept"""
+    return event.get('type') == 'log' and 'status' in event
+
+
+def parse_event_id(value):
+    """Last-Event-ID header or lastEventId parameter as an int, or None"""
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def batch_frame(items):
+    """One SSE frame for (id, event, payload) items; payloads are already JSON encoded"""
+    return f"event: batch\nid: {items[-1][0]}\ndata: [{','.join(item[2] for item in items)}]\n\n"
+
+
+def downsample(items):
+    """Keep every non-progress event but only the latest progress event per job"""
+    seen = set()
+    kept = []
+    for item in reversed(items):
+        event = item[1]
+        if is_progress(event):
+            key = event.get('job_id')
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append(item)
+    kept.reverse()
+    return kept
+
+
+class Subscriber:
+    """One /stream client: a cursor into the bus plus a bounded queue of undelivered events"""
+
+    def __init__(self, cursor, max_pending, wakeup=None):
+        self.cursor = cursor
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.lagged = False
+        # Anything with set() and clear(); asyncserver.AsyncWakeup wakes a coroutine instead of a thread
+        self.wakeup = wakeup or threading.Event()
+
+    def _offer(self, item):
+        # Called with the bus lock held; never blocks the publisher
+        if self.lagged:
+            return
+        if len(self.pending) >= self.max_pending:
+            # Too slow: stop queueing and let get() resync from the ring buffers
+            self.lagged = True
+            self.pending.clear()
+        else:
+            self.pending.append(item)
+        self.wakeup.set()
+
+
+class EventBus:
+    """Fan-out of download events to any number of SSE subscribers.
+
+    Every event gets a monotonically increasing ID and is kept in a bounded
+    ring buffer for its job, so a client reconnecting with Last-Event-ID can
+    resume without loss. Publishers never block: a subscriber that falls more
+    than ``subscriber_queue_size`` events behind is resynced from the ring
+    buffers with progress updates downsampled to the latest one per job.
+
+    With ``progress_rate`` set, progress events are coalesced to at most that
+    many per second per job (latest value wins). Any other event for the job
+    first flushes its held-back progress, so state transitions are never
+    dropped or reordered.
+    """
+
+    def __init__(self, buffer_size=500, max_jobs=1000, subscriber_queue_size=1000, progress_rate=None):
+        self.buffer_size = buffer_size
+        self.max_jobs = max_jobs
+        self.subscriber_queue_size = subscriber_queue_size
+        self.progress_interval = 1.0 / progress_rate if progress_rate else 0
+        self._held = {}                # job id -> latest held-back progress event
+        self._last_progress = {}       # job id -> time its last progress event went out
+        self._flusher = None
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._buffers = OrderedDict()  # job id -> deque of (id, event, payload)
+        self._subscribers = set()
+        self.dropped = 0               # Events skipped by downsampling lagging subscribers
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def publish(self, event):
+        """Store an event and hand it to every subscriber.
+
+        Returns its event ID, or None if a progress event was held back for coalescing.
+        """
+        key = event.get('job_id') or GLOBAL_KEY
+        progress = is_progress(event)
+        if progress and self.progress_interval:
+            with self._lock:
+                now = time.monotonic()
+                if now - self._last_progress.get(key, 0) < self.progress_interval:
+                    # Too soon after the last one: keep only the latest
+                    self._held[key] = event
+                    self._ensure_flusher()
+                    return None
+                self._last_progress[key] = now
+                self._held.pop(key, None)
+        
+        payload = json.dumps(event)  # Encoded once, shared by all subscribers
+        with self._lock:
+            if not progress and self._held:
+                # Flush held-back progress first so it never lands after a state change
+                held = self._held.pop(key, None)
+                if held:
+                    self._append(key, held, json.dumps(held))
+            if event.get('type') in FINAL_EVENT_TYPES:
+                self._last_progress.pop(key, None)
+            return self._append(key, event, payload)
+
+    def _append(self, key, event, payload):
+        """Assign the next ID and deliver an encoded event (bus lock held)"""
+        self._last_id += 1
+        item = (self._last_id, event, payload)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = deque(maxlen=self.buffer_size)
+            if len(self._buffers) > self.max_jobs:
+                self._buffers.popitem(last=False)
+        else:
+            self._buffers.move_to_end(key)
+        buffer.append(item)
+        for subscriber in self._subscribers:
+            subscriber._offer(item)
+        return self._last_id
+
+    def _ensure_flusher(self):
+        # Started lazily (bus lock held) so the bus has no thread until coalescing is needed
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name='event-coalescer')
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def _flush_loop(self):
+        """Publish held-back progress once its job's interval has passed"""
+        while True:
+            time.sleep(self.progress_interval / 2)
+            now = time.monotonic()
+            with self._lock:
+                for key, event in list(self._held.items()):
+                    if now - self._last_progress.get(key, 0) >= self.progress_interval:
+                        del self._held[key]
+                        self._last_progress[key] = now
+                        self._append(key, event, json.dumps(event))
+
+    def subscribe(self, last_event_id=None, wakeup=None):
+        """Register a subscriber, replaying everything after last_event_id if given"""
+        with self._lock:
+            if last_event_id is None:
+                subscriber = Subscriber(self._last_id, self.subscriber_queue_size, wakeup)
+            else:
+                subscriber = Subscriber(last_event_id, self.subscriber_queue_size, wakeup)
+                # Replay lazily through the resync path on the first get()
+                subscriber.lagged = True
+                subscriber.wakeup.set()
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def get(self, subscriber, timeout=None):
+        """Wait for events for a subscriber. Returns a list of (id, event, payload)."""
+        if not subscriber.wakeup.wait(timeout):
+            return []
+        return self.drain(subscriber)
+
+    def drain(self, subscriber):
+        """Take a subscriber's undelivered events without waiting"""
+        with self._lock:
+            subscriber.wakeup.clear()
+            if subscriber.lagged:
+                items = self._since(subscriber.cursor)
+                if len(items) > subscriber.max_pending:
+                    kept = downsample(items)
+                    self.dropped += len(items) - len(kept)
+                    items = kept
+                subscriber.lagged = False
+            else:
+                items = list(subscriber.pending)
+            subscriber.pending.clear()
+            if items:
+                subscriber.cursor = items[-1][0]
+        return items
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _since(self, cursor):
+        """All buffered events newer than cursor, in ID order (bus lock held)"""
+        items = []
+        for buffer in self._buffers.values():
+            # Buffers are ID-ordered, so walk back from the newest event
+            for item in reversed(buffer):
+                if item[0] <= cursor:
+                    break
+                items.append(item)
+        items.sort(key=lambda item: item[0])
+        return items
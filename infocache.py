@@ -0,0 +1,182 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# URL shapes whose video ID can be read without running an extractor
+CANONICAL_PATTERNS = [
+    ('youtube', re.compile(r'(?:youtube(?:-nocookie)?\.com/(?:watch\?(?:.*&)?v=|embed/|shorts/|live/|v/)|youtu\.be/)([0-9A-Za-z_-]{11})')),
+    ('vimeo', re.compile(r'vimeo\.com/(?:video/)?(\d+)(?:[/?#]|$)')),
+    ('dailymotion', re.compile(r'(?:dailymotion\.com/video/|dai\.ly/)([0-9a-zA-Z]+)')),
+    ('tiktok', re.compile(r'tiktok\.com/@[^/]+/video/(\d+)')),
+]
+
+
+def canonical_key(url):
+    """Return 'extractor:video_id' for URLs we can recognise offline, else None"""
+    for extractor, pattern in CANONICAL_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            return f'{extractor}:{match.group(1)}'
+    return None
+
+
+def info_key(info):
+    """Cache key for an extracted info dict"""
+    return f"{(info.get('extractor_key') or info.get('extractor') or 'generic').lower()}:{info.get('id')}"
+
+
+def summarize_info(info):
+    """The parts of an info dict the UI needs to choose a format, without the multi-MB rest"""
+    formats = []
+    for f in info.get('formats') or []:
+        formats.append({
+            'format_id': f.get('format_id'),
+            'ext': f.get('ext'),
+            'resolution': f.get('resolution'),
+            'fps': f.get('fps'),
+            'vcodec': f.get('vcodec'),
+            'acodec': f.get('acodec'),
+            'tbr': f.get('tbr'),
+            'protocol': f.get('protocol'),
+            'filesize': f.get('filesize') or f.get('filesize_approx'),
+        })
+    return {
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'extractor': info.get('extractor_key') or info.get('extractor'),
+        'webpage_url': info.get('webpage_url'),
+        'duration': info.get('duration'),
+        'uploader': info.get('uploader'),
+        'thumbnail': info.get('thumbnail'),
+        'filesize': info.get('filesize') or info.get('filesize_approx'),
+        'formats': formats,
+    }
+
+
+class InfoCache:
+    """Bounded LRU of extracted info dicts with a TTL, keyed by canonical video ID.
+
+    Entries expire after ``ttl`` seconds because the stream URLs inside an
+    info dict stop working after a while. With ``cache_dir`` set, entries are
+    also written to disk and survive a restart; either way the on-disk copy
+    is what /download hands to yt-dlp via --load-info-json.
+    """
+
+    def __init__(self, max_entries=100, ttl=1800, cache_dir=None, spool_dir=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        # Where info files go for --load-info-json when the cache is not persisted
+        self.spool_dir = cache_dir or spool_dir
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, info)
+        self._aliases = {}             # URL -> key, learnt from probes
+        self.hits = 0
+        self.misses = 0
+        for directory in (self.cache_dir, self.spool_dir):
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    def key_for_url(self, url):
+        return canonical_key(url) or self._aliases.get(url)
+
+    def get(self, key):
+        """Return a fresh info dict for key, or None"""
+        if not key:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+        info, expires_at = self._load(key, now)
+        with self._lock:
+            if info is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, info, expires_at)
+        return info
+
+    def get_url(self, url):
+        return self.get(self.key_for_url(url))
+
+    def put(self, info, url=None):
+        """Cache an info dict; returns its key"""
+        key = info_key(info)
+        with self._lock:
+            self._remember(key, info, time.time() + self.ttl)
+            for alias in (url, info.get('webpage_url'), info.get('original_url')):
+                if alias:
+                    self._aliases[alias] = key
+        if self.cache_dir:
+            self._write(self.cache_dir, key, info)
+        return key
+
+    def discard_url(self, url):
+        """Forget the entry for url, e.g. after its stream URLs were refused"""
+        key = self.key_for_url(url)
+        if not key:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+        for directory in {self.cache_dir, self.spool_dir}:
+            if directory:
+                try:
+                    os.remove(self._path(directory, key))
+                except OSError:
+                    pass
+
+    def info_file_for_url(self, url):
+        """Path of a fresh info JSON for url (for --load-info-json), or None on a cache miss"""
+        key = self.key_for_url(url)
+        info = self.get(key)
+        if info is None:
+            return None
+        path = self._path(self.spool_dir, key)
+        if not os.path.exists(path) or os.path.getmtime(path) + self.ttl <= time.time():
+            self._write(self.spool_dir, key, info)
+        return path
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+    def _remember(self, key, info, expires_at):
+        # Cache lock held
+        self._entries[key] = (expires_at, info)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _path(directory, key):
+        return os.path.join(directory, re.sub(r'[^\w.-]', '_', key) + '.info.json')
+
+    def _write(self, directory, key, info):
+        path = self._path(directory, key)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+        os.replace(tmp_path, path)
+
+    def _load(self, key, now):
+        """Read a persisted entry. Returns (info, expires_at), or (None, None) if missing or stale."""
+        if not self.cache_dir:
+            return None, None
+        path = self._path(self.cache_dir, key)
+        try:
+            expires_at = os.path.getmtime(path) + self.ttl
+            if expires_at <= now:
+                return None, None
+            with open(path, encoding='utf-8') as f:
+                return json.load(f), expires_at
+        except (OSError, ValueError):
+            return None, None
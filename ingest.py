@@ -0,0 +1,125 @@
+import base64
+import itertools
+import json
+from urllib.parse import urlparse, urlunparse
+
+# Longest line accepted in a bulk upload; anything longer cannot be a URL
+MAX_LINE_LENGTH = 8192
+
+
+def iter_lines(stream, max_length=MAX_LINE_LENGTH):
+    """Lines (bytes) of an upload, read incrementally. Lines over max_length are yielded as None."""
+    while True:
+        line = stream.readline(max_length + 1)
+        if not line:
+            return
+        if len(line) > max_length:
+            # Skip the rest of it without holding it in memory
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(max_length + 1)
+            yield None
+            continue
+        yield line
+
+
+def parse_line(line):
+    """The URL on one line of an NDJSON or plain-text upload.
+
+    Accepts a bare URL, a JSON string or a JSON object with a "url" field.
+    Returns '' for blank and comment lines and None for invalid ones.
+    """
+    if line is None:
+        return None
+    text = line.decode('utf-8', errors='replace').strip()
+    if not text or text.startswith('#'):
+        return ''
+    if text[0] in '{"':
+        try:
+            value = json.loads(text)
+        except ValueError:
+            return None
+        if isinstance(value, dict):
+            value = value.get('url') or value.get('webpage_url')
+        if not isinstance(value, str):
+            return None
+        text = value.strip()
+    return text if is_valid_url(text) else None
+
+
+def is_valid_url(url):
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return False
+    return parsed.scheme in ('http', 'https') and bool(parsed.hostname) and ' ' not in url
+
+
+def normalize_url(url):
+    """Dedupe key for URLs no extractor pattern recognises: lower-case scheme and host, no fragment"""
+    parsed = urlparse(url)
+    return urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), parsed.path or '/', parsed.params, parsed.query, ''))
+
+
+def iter_upload(stream):
+    """(line number, url) for every non-blank line of an upload; url is None for invalid lines"""
+    return upload_entries(iter_lines(stream))
+
+
+def upload_entries(lines, start=1):
+    for number, line in enumerate(lines, start):
+        url = parse_line(line)
+        if url != '':
+            yield number, url
+
+
+def read_upload(stream):
+    """(options, entries) of an upload whose first line may be {"options": {...}}.
+
+    options is None when there is no such line; entries is iter_upload()
+    over the rest, numbered from the first line of the body.
+    """
+    lines = iter_lines(stream)
+    first = next(lines, b'')
+    options = parse_options_line(first)
+    if options is not None:
+        return options, upload_entries(lines, 2)
+    return None, upload_entries(itertools.chain([first], lines))
+
+
+def parse_options_line(line):
+    """The options of an {"options": {...}} line, or None if it is not one"""
+    if not line or not line.lstrip().startswith(b'{'):
+        return None
+    try:
+        value = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(value, dict) or 'options' not in value or 'url' in value:
+        return None
+    if not isinstance(value['options'], dict):
+        raise ValueError('options must be a JSON object')
+    return value['options']
+
+
+def parse_options_header(value):
+    """Options from an X-Options header: base64 of a JSON object (standard or URL-safe alphabet)"""
+    try:
+        padded = value.translate(str.maketrans('-_', '+/')) + '=' * (-len(value) % 4)
+        options = json.loads(base64.b64decode(padded))
+    except ValueError:  # Includes binascii.Error
+        raise ValueError('X-Options must be base64-encoded JSON')
+    if not isinstance(options, dict):
+        raise ValueError('options must be a JSON object')
+    return options
+
+
+def chunked(items, size):
+    """Lists of up to size items, without reading further ahead"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,178 @@
+import json
+import sqlite3
+import threading
+import time
+
+# Job states that still need work after a restart
+UNFINISHED_STATUSES = ('queued', 'expanding', 'running', 'retrying', 'processing')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    url_index INTEGER NOT NULL DEFAULT 0,
+    options TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'queued',
+    progress REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    output_path TEXT,
+    error TEXT,
+    failure TEXT,
+    parent_id TEXT,
+    entries INTEGER,
+    url_key TEXT,
+    batch_id TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+"""
+
+# Columns added after the first release, created on databases that predate them
+ADDED_COLUMNS = {
+    'failure': 'TEXT',
+    'parent_id': 'TEXT',
+    'entries': 'INTEGER',
+    'url_key': 'TEXT',
+    'batch_id': 'TEXT',
+}
+
+# Columns that may be changed through update()
+UPDATABLE_COLUMNS = {
+    'status', 'progress', 'attempts', 'output_path', 'error', 'failure', 'entries', 'started_at', 'finished_at'
+}
+
+
+class JobStore:
+    """Durable job table backed by SQLite.
+
+    One connection is shared by all threads and guarded by a lock; WAL mode
+    keeps readers (the /jobs API) from blocking the download workers.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+            columns = {row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+            for column, definition in ADDED_COLUMNS.items():
+                if column not in columns:
+                    self._conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {definition}')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_parent ON jobs (parent_id)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_url_key ON jobs (url_key)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id)')
+            self._conn.commit()
+
+    def add(self, job):
+        self.add_many([job])
+
+    def add_many(self, jobs):
+        """Insert several jobs in one transaction (a playlist can expand to thousands)"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO jobs (id, url, url_index, options, status, progress, attempts, output_path, '
+                'parent_id, entries, url_key, batch_id, created_at, updated_at, finished_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(job.id, job.url, job.url_index, json.dumps(job.options), job.status, job.progress, job.attempts,
+                  job.output_path, job.parent_id, job.entries, job.url_key or job.url, job.batch_id, now, now,
+                  None if job.status in UNFINISHED_STATUSES else now) for job in jobs]
+            )
+            self._conn.commit()
+
+    def update(self, job_id, **fields):
+        fields = {key: value for key, value in fields.items() if key in UPDATABLE_COLUMNS}
+        if not fields:
+            return
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f'{key} = ?' for key in fields)
+        with self._lock:
+            self._conn.execute(
+                f'UPDATE jobs SET {assignments} WHERE id = ?',
+                list(fields.values()) + [job_id]
+            )
+            self._conn.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def list(self, status=None, limit=100, offset=0, parent_id=None, batch_id=None):
+        query = 'SELECT * FROM jobs'
+        conditions = []
+        params = []
+        if status:
+            conditions.append('status = ?')
+            params.append(status)
+        if parent_id:
+            conditions.append('parent_id = ?')
+            params.append(parent_id)
+        if batch_id:
+            conditions.append('batch_id = ?')
+            params.append(batch_id)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY created_at DESC, url_index DESC LIMIT ? OFFSET ?'
+        params.extend([limit, offset])
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def children(self, parent_id):
+        """Child jobs of an expanded playlist, in playlist order"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT * FROM jobs WHERE parent_id = ? ORDER BY created_at, rowid', (parent_id,)
+            ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def unfinished(self):
+        """Jobs that were queued, running or waiting to retry when the server last stopped"""
+        placeholders = ', '.join('?' for _ in UNFINISHED_STATUSES)
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT * FROM jobs WHERE status IN ({placeholders}) ORDER BY created_at, url_index',
+                UNFINISHED_STATUSES
+            ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def active_keys(self, keys, batch_id=None):
+        """Which of keys (canonical URL keys) belong to an unfinished job, or to any job of batch_id"""
+        if not keys:
+            return set()
+        placeholders = ', '.join('?' for _ in keys)
+        statuses = ', '.join('?' for _ in UNFINISHED_STATUSES)
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT DISTINCT url_key FROM jobs WHERE url_key IN ({placeholders}) '
+                f'AND (status IN ({statuses}) OR batch_id = ?)',
+                list(keys) + list(UNFINISHED_STATUSES) + [batch_id]
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def counts(self, batch_id=None):
+        with self._lock:
+            if batch_id:
+                rows = self._conn.execute(
+                    'SELECT status, COUNT(*) FROM jobs WHERE batch_id = ? GROUP BY status', (batch_id,)
+                ).fetchall()
+            else:
+                rows = self._conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    @staticmethod
+    def _row_to_dict(row):
+        job = dict(row)
+        try:
+            job['options'] = json.loads(job['options'])
+        except (TypeError, ValueError):
+            job['options'] = {}
+        return job
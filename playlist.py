@@ -0,0 +1,122 @@
+import re
+import threading
+from urllib.parse import parse_qs, urlparse
+
+# URL shapes that yt-dlp treats as a playlist or channel rather than one video
+PLAYLIST_PATTERNS = [
+    re.compile(r'youtube\.com/(?:playlist\?|@[^/?#]+/?(?:$|[?#]|(?:videos|shorts|streams|playlists|featured)\b)|'
+               r'(?:channel|c|user)/[^/?#]+/?(?:$|[?#]|(?:videos|shorts|streams|playlists|featured)\b))'),
+    re.compile(r'vimeo\.com/(?:channels|showcase|album|groups)/[^/?#]+/?(?:videos/?)?(?:$|[?#])'),
+    re.compile(r'soundcloud\.com/[^/?#]+/(?:sets/[^/?#]+|tracks|albums|reposts)/?(?:$|[?#])'),
+    re.compile(r'dailymotion\.com/playlist/'),
+    re.compile(r'tiktok\.com/@[^/?#]+/?(?:$|[?#])'),
+]
+
+# Child job states after which it counts as done for its parent
+FINISHED_STATUSES = ('completed', 'skipped', 'failed', 'cancelled')
+
+# Nested playlists (a channel's tabs) are expanded this deep
+MAX_DEPTH = 2
+
+
+def is_playlist_url(url):
+    """True for URLs that should be expanded into one child job per entry"""
+    for pattern in PLAYLIST_PATTERNS:
+        if pattern.search(url):
+            return True
+    # watch?v=...&list=... downloads the whole list, like yt-dlp does by default
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return False
+    return 'youtube.com' in (parsed.hostname or '') and 'list' in parse_qs(parsed.query)
+
+
+def flat_entries(info):
+    """Entries of a flat (--flat-playlist) playlist info dict as dicts with url, key and title.
+
+    Entries that are playlists themselves are returned with 'playlist': True.
+    """
+    entries = []
+    for entry in info.get('entries') or []:
+        if not entry:
+            continue
+        url = entry.get('url') or entry.get('webpage_url')
+        if not url:
+            continue
+        if not url.startswith(('http://', 'https://')) and entry.get('webpage_url'):
+            url = entry['webpage_url']
+        ie_key = entry.get('ie_key') or entry.get('extractor_key')
+        nested = entry.get('_type') == 'playlist' or (ie_key or '').endswith('Tab') or is_playlist_url(url)
+        entries.append({
+            'url': url,
+            # Same shape as infocache.info_key() so the download archive can be checked
+            'key': f"{ie_key.lower()}:{entry['id']}" if ie_key and entry.get('id') and not nested else None,
+            'title': entry.get('title'),
+            'playlist': nested,
+        })
+    return entries
+
+
+class PlaylistTracker:
+    """Aggregate state of expanded playlists: which child jobs each parent has and how far they got.
+
+    A parent's progress is the mean of its children's, with finished
+    children (whatever the outcome) counting as 100%.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._parents = {}  # parent id -> {'job', 'children': {child id: (status, progress)}}
+
+    def add(self, parent, children):
+        """Register a parent and its child jobs (or records from the job store)"""
+        with self._lock:
+            self._parents[parent.id] = {
+                'job': parent,
+                'children': {child_id: (status, progress) for child_id, status, progress in children},
+            }
+
+    def parent(self, parent_id):
+        with self._lock:
+            state = self._parents.get(parent_id)
+            return state['job'] if state else None
+
+    def children(self, parent_id):
+        with self._lock:
+            state = self._parents.get(parent_id)
+            return list(state['children']) if state else []
+
+    def update(self, parent_id, child_id, status, progress):
+        """Record a child's state; returns False if the parent is not tracked (any more)"""
+        with self._lock:
+            state = self._parents.get(parent_id)
+            if not state or child_id not in state['children']:
+                return False
+            state['children'][child_id] = (status, progress)
+            return True
+
+    def summary(self, parent_id):
+        with self._lock:
+            state = self._parents.get(parent_id)
+            return self._summary(state) if state else None
+
+    def remove(self, parent_id):
+        """Stop tracking a parent; returns False if it was not tracked"""
+        with self._lock:
+            return self._parents.pop(parent_id, None) is not None
+
+    @staticmethod
+    def _summary(state):
+        counts = {}
+        total = 0
+        for status, progress in state['children'].values():
+            counts[status] = counts.get(status, 0) + 1
+            total += 100 if status in FINISHED_STATUSES else (progress or 0)
+        entries = len(state['children'])
+        return {
+            'entries': entries,
+            'progress': total / entries if entries else 100,
+            'finished': sum(counts.get(status, 0) for status in FINISHED_STATUSES),
+            'counts': counts,
+        }
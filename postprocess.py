@@ -0,0 +1,218 @@
+import base64
+import glob
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import mutagen
+    from mutagen.flac import FLAC, Picture
+    from mutagen.oggvorbis import OggVorbis
+except ImportError:
+    mutagen = None
+
+# Audio targets offered by the UI: target -> (extension, encoder), as in yt-dlp's FFmpegExtractAudioPP
+AUDIO_CODECS = {
+    'mp3': ('mp3', 'libmp3lame'),
+    'aac': ('m4a', 'aac'),
+    'm4a': ('m4a', 'aac'),
+    'ogg': ('ogg', 'libvorbis'),
+    'flac': ('flac', 'flac'),
+    'wav': ('wav', 'pcm_s16le'),
+}
+
+# ffprobe codec name -> audio target that holds it without re-encoding
+LOSSLESS_TARGETS = {'mp3': 'mp3', 'aac': 'm4a', 'vorbis': 'ogg', 'flac': 'flac'}
+
+THUMBNAIL_EXTS = ('jpg', 'jpeg', 'png', 'webp')
+
+FFMPEG_TIMEOUT = 3600  # Seconds; transcoding a long video to audio takes a while
+
+
+def needs_postprocessing(options):
+    """Whether a finished download has ffmpeg work left for the post-processing stage"""
+    return bool(options.get('format') in AUDIO_CODECS or options.get('embedThumb') or options.get('embedSubs'))
+
+
+def run_ffmpeg(args, timeout=FFMPEG_TIMEOUT):
+    """Run ffmpeg with args, raising RuntimeError with its last error line on failure"""
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise RuntimeError('ffmpeg not found')
+    result = subprocess.run([ffmpeg, '-y', '-loglevel', 'error', *args],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+    if result.returncode != 0:
+        errors = result.stderr.decode('utf-8', errors='replace').strip().splitlines()
+        raise RuntimeError(errors[-1] if errors else f'ffmpeg exited with code {result.returncode}')
+
+
+def probe_streams(path):
+    """Codec type and name of every stream in path, or None without ffprobe"""
+    ffprobe = shutil.which('ffprobe')
+    if not ffprobe:
+        return None
+    result = subprocess.run(
+        [ffprobe, '-v', 'error', '-show_entries', 'stream=codec_type,codec_name', '-of', 'csv=p=0', path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60)
+    if result.returncode != 0:
+        return None
+    streams = []
+    for line in result.stdout.decode('utf-8', errors='replace').splitlines():
+        name, _, codec_type = line.strip().partition(',')
+        if name:
+            streams.append((codec_type, name))
+    return streams
+
+
+def _replace(temp_path, path, mtime):
+    os.replace(temp_path, path)
+    # Keep --mtime's upload date on the rewritten file
+    os.utime(path, (mtime, mtime))
+
+
+def extract_audio(path, target):
+    """Convert a downloaded file to an audio-only file in the target format.
+
+    The stream is copied when it already has the right codec. Returns the
+    new path; the original file is removed, like yt-dlp does without -k.
+    """
+    extension, encoder = AUDIO_CODECS[target]
+    streams = probe_streams(path) or []
+    codec = next((name for codec_type, name in streams if codec_type == 'audio'), None)
+    copy = codec is not None and LOSSLESS_TARGETS.get(codec) == extension
+    if copy and os.path.splitext(path)[1][1:].lower() == extension and len(streams) == 1:
+        return path  # Already an audio-only file in the target format
+
+    new_path = f'{os.path.splitext(path)[0]}.{extension}'
+    temp_path = f'{os.path.splitext(path)[0]}.temp.{extension}'
+    args = ['-i', path, '-vn', '-sn', '-dn', '-map', '0:a:0']
+    args.extend(['-c:a', 'copy'] if copy else ['-c:a', encoder])
+    if encoder == 'libmp3lame' and not copy:
+        args.extend(['-q:a', '5'])
+    args.append(temp_path)
+
+    mtime = os.stat(path).st_mtime
+    try:
+        run_ffmpeg(args)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    _replace(temp_path, new_path, mtime)
+    if new_path != path:
+        os.remove(path)
+    return new_path
+
+
+def find_thumbnail(media_path):
+    """Thumbnail yt-dlp wrote next to a media file (--write-thumbnail), or None"""
+    stem = os.path.splitext(media_path)[0]
+    for ext in THUMBNAIL_EXTS:
+        matches = glob.glob(glob.escape(stem) + '.' + ext)
+        if matches:
+            return matches[0]
+    return None
+
+
+def embed_thumbnail(media_path, thumbnail_path):
+    """Embed a thumbnail as cover art, mirroring yt-dlp's EmbedThumbnailPP (ffmpeg method).
+
+    Returns the files that were created along the way (a converted thumbnail).
+    Raises RuntimeError if the container is not supported or ffmpeg fails.
+    """
+    ext = os.path.splitext(media_path)[1][1:].lower()
+    created = []
+    thumbnail_ext = os.path.splitext(thumbnail_path)[1][1:].lower()
+    if ext not in ('mkv', 'mka') and thumbnail_ext not in ('jpg', 'jpeg', 'png'):
+        # webp and friends cannot be embedded in most containers
+        converted = f'{os.path.splitext(thumbnail_path)[0]}.png'
+        run_ffmpeg(['-i', thumbnail_path, '-update', '1', '-frames:v', '1', converted], timeout=60)
+        thumbnail_path, thumbnail_ext = converted, 'png'
+        created.append(converted)
+
+    temp_path = f'{os.path.splitext(media_path)[0]}.temp.{ext}'
+    mtime = os.stat(media_path).st_mtime
+    if ext == 'mp3':
+        args = ['-i', media_path, '-i', thumbnail_path, '-c', 'copy', '-map', '0:0', '-map', '1:0',
+                '-write_id3v1', '1', '-id3v2_version', '3',
+                '-metadata:s:v', 'title=Album cover', '-metadata:s:v', 'comment=Cover (front)']
+    elif ext in ('mkv', 'mka'):
+        mimetype = f'image/{thumbnail_ext.replace("jpg", "jpeg")}'
+        args = ['-i', media_path, '-map', '0', '-dn', '-ignore_unknown', '-c', 'copy',
+                '-attach', thumbnail_path, '-metadata:s:t', f'mimetype={mimetype}',
+                '-metadata:s:t', f'filename=cover.{thumbnail_ext}']
+    elif ext in ('m4a', 'mp4', 'm4v', 'mov'):
+        streams = probe_streams(media_path)
+        if streams is None:
+            raise RuntimeError('ffprobe not found, cannot embed the thumbnail')
+        args = ['-i', media_path, '-i', thumbnail_path, '-map', '0', '-dn', '-ignore_unknown', '-c', 'copy',
+                '-map', '1', f'-disposition:{len(streams)}', 'attached_pic']
+    elif ext in ('flac', 'ogg'):
+        _embed_with_mutagen(media_path, ext, thumbnail_path, thumbnail_ext)
+        return created
+    else:
+        raise RuntimeError(f'Thumbnails cannot be embedded in {ext} files')
+    args.append(temp_path)
+
+    try:
+        run_ffmpeg(args)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    _replace(temp_path, media_path, mtime)
+    return created
+
+
+def _embed_with_mutagen(media_path, ext, thumbnail_path, thumbnail_ext):
+    # ffmpeg cannot write cover art into FLAC/Vorbis comments; yt-dlp uses mutagen too
+    if mutagen is None:
+        raise RuntimeError('the mutagen package is needed to embed thumbnails in flac and ogg files')
+    picture = Picture()
+    picture.mime = f'image/{thumbnail_ext.replace("jpg", "jpeg")}'
+    picture.type = 3  # Front cover
+    with open(thumbnail_path, 'rb') as f:
+        picture.data = f.read()
+    if ext == 'flac':
+        audio = FLAC(media_path)
+        audio.add_picture(picture)
+    else:
+        audio = OggVorbis(media_path)
+        audio['METADATA_BLOCK_PICTURE'] = [base64.b64encode(picture.write()).decode('ascii')]
+    audio.save()
+
+
+class PostProcessQueue:
+    """Bounded pool for the CPU-bound post-processing stage (ffmpeg), separate from the download slots.
+
+    Sized to the CPU count by default so transcodes do not fight each other
+    for cores; jobs wait in the pool's own queue meanwhile.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max(1, max_workers or os.cpu_count() or 1)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='postprocess')
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+
+    def submit(self, fn, *args):
+        with self._lock:
+            self._queued += 1
+        return self._executor.submit(self._run, fn, *args)
+
+    def _run(self, fn, *args):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'max_workers': self.max_workers, 'queued': self._queued, 'running': self._running}
@@ -0,0 +1,66 @@
+import json
+from collections import namedtuple
+
+# Marker yt-dlp prefixes to every machine-readable progress line
+PROGRESS_PREFIX = b'[progress]'
+
+# Passed to yt-dlp as --progress-template. The payload is a JSON array rather
+# than an object so each line stays short and cheap to parse; numeric fields
+# use "|null" so a missing value prints as JSON null instead of yt-dlp's "NA".
+# The output filename is taken from the "Destination:" line instead.
+PROGRESS_TEMPLATE = 'download:[progress][' + ','.join([
+    '%(progress.status)j',
+    '%(progress.downloaded_bytes|null)s',
+    '%(progress.total_bytes|null)s',
+    '%(progress.total_bytes_estimate|null)s',
+    '%(progress.speed|null)s',
+    '%(progress.eta|null)s',
+    '%(progress.fragment_index|null)s',
+    '%(progress.fragment_count|null)s',
+]) + ']'
+
+# Arguments that switch the subprocess backend to structured progress output
+PROGRESS_ARGS = ['--newline', '--progress-template', PROGRESS_TEMPLATE]
+
+_FIELDS = ['status', 'downloaded_bytes', 'total_bytes', 'speed', 'eta', 'fragment_index', 'fragment_count', 'filename']
+
+
+class ProgressRecord(namedtuple('ProgressRecord', _FIELDS)):
+    """One progress update, from either the subprocess or the in-process backend"""
+
+    __slots__ = ()
+
+    @property
+    def percent(self):
+        """Percent complete, or None when the total size is unknown"""
+        if self.status == 'finished':
+            return 100.0
+        if self.downloaded_bytes is None or not self.total_bytes:
+            return None
+        return min(100.0, self.downloaded_bytes * 100 / self.total_bytes)
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            d.get('status'),
+            d.get('downloaded_bytes'),
+            d.get('total_bytes') or d.get('total_bytes_estimate'),
+            d.get('speed'),
+            d.get('eta'),
+            d.get('fragment_index'),
+            d.get('fragment_count'),
+            d.get('filename'),
+        )
+
+
+def parse_progress_line(line):
+    """Parse a raw stdout line (bytes). Returns a ProgressRecord, or None for ordinary output."""
+    if not line.startswith(PROGRESS_PREFIX):
+        return None
+    try:
+        status, downloaded, total, estimate, speed, eta, fragment_index, fragment_count = json.loads(
+            line[len(PROGRESS_PREFIX):].decode('utf-8', errors='replace')
+        )
+    except ValueError:
+        return None
+    return ProgressRecord(status, downloaded, total or estimate, speed, eta, fragment_index, fragment_count, None)
@@ -0,0 +1,154 @@
+import random
+import re
+import threading
+import time
+
+# Failure classes
+RETRYABLE = 'retryable'        # Network hiccups, timeouts, expired stream URLs: try again soon
+RATE_LIMITED = 'rate_limited'  # The site is throttling us: back off and pause the site's queue
+PERMANENT = 'permanent'        # Retrying cannot help (removed, private, geo-blocked, bad options)
+
+# Checked in order; the first match wins
+FAILURE_PATTERNS = [
+    (RATE_LIMITED, re.compile(
+        r'HTTP Error 429|Too Many Requests|rate[- ]limit|confirm you.re not a bot|'
+        r'This content isn.t available, try again later', re.I)),
+    (PERMANENT, re.compile(
+        r'Video unavailable|Private video|This video (?:is|has been) (?:not available|removed|private)|'
+        r'not available in your country|geo[- ]?restrict|blocked it in your country|'
+        r'members[- ]only|Join this channel|requires payment|account (?:associated with this video )?has been terminated|'
+        r'copyright claim|Unsupported URL|is not a valid URL|Requested format is not available|'
+        r'HTTP Error 40[14]|HTTP Error 410|Sign in to confirm your age|This live event will begin', re.I)),
+    (RETRYABLE, re.compile(
+        r'HTTP Error 403|HTTP Error 5\d\d|timed out|Connection (?:reset|refused|aborted)|'
+        r'Temporary failure in name resolution|Unable to download|giving up after|IncompleteRead|'
+        r'Remote end closed connection', re.I)),
+]
+
+# yt-dlp exits with 2 for invalid options; nothing changes on a retry
+PERMANENT_EXIT_CODES = (2,)
+
+
+def classify_failure(messages, return_code=1):
+    """Classify a failed attempt from its error output and exit status"""
+    for message in reversed(list(messages)):
+        for failure, pattern in FAILURE_PATTERNS:
+            if pattern.search(message):
+                return failure
+    if return_code in PERMANENT_EXIT_CODES:
+        return PERMANENT
+    return RETRYABLE
+
+
+def is_error_line(line):
+    """Output worth keeping for classify_failure"""
+    return line.startswith('ERROR') or 'HTTP Error' in line
+
+
+class RetryPolicy:
+    """How often and how long to wait before retrying each failure class"""
+
+    def __init__(self, max_retries=3, max_rate_limited=10, base_delay=2, max_delay=300, rate_limited_delay=30):
+        self.max_retries = max_retries
+        self.max_rate_limited = max_rate_limited
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limited_delay = rate_limited_delay
+
+    def delay(self, failure, retries):
+        """Seconds to wait before retry number retries + 1, or None to give up"""
+        if failure == PERMANENT:
+            return None
+        if failure == RATE_LIMITED:
+            # The circuit breaker holds the site back as well; this only spaces out the job itself
+            if retries >= self.max_rate_limited:
+                return None
+            base = self.rate_limited_delay
+        else:
+            if retries >= self.max_retries:
+                return None
+            base = self.base_delay
+        # Exponential backoff with jitter so retries from one batch do not line up
+        return min(base * (2 ** retries), self.max_delay) * random.uniform(0.75, 1.25)
+
+
+class CircuitBreaker:
+    """Per-site circuit breaker for rate limiting.
+
+    ``threshold`` rate-limited failures within ``window`` seconds open the
+    circuit: no new downloads start for that site for ``cooldown`` seconds
+    (doubling on every consecutive trip up to ``max_cooldown``). After that a
+    single trial download is let through; success closes the circuit, another
+    rate-limited failure opens it again. Any other failure ends the trial too:
+    a permanent one (the site answered) closes the circuit, a transient one
+    lets downloads start normally again.
+    """
+
+    def __init__(self, threshold=2, window=60, cooldown=60, max_cooldown=1800):
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self._sites = {}  # key -> {'failures': [times], 'open_until', 'trips', 'trial'}
+
+    def _site(self, key):
+        site = self._sites.get(key)
+        if site is None:
+            site = self._sites[key] = {'failures': [], 'open_until': 0, 'trips': 0, 'trial': False}
+        return site
+
+    def blocked_for(self, key, active=0):
+        """Seconds until a new download may start for key (0 if it may start now)"""
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                return 0
+            remaining = site['open_until'] - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if site['trial'] and active:
+                # Half-open: one trial download at a time until one succeeds
+                return self.cooldown / 4
+            return 0
+
+    def record_success(self, key):
+        with self._lock:
+            site = self._sites.get(key)
+            # A download that started before the circuit opened proves nothing
+            if site and site['open_until'] <= time.monotonic():
+                del self._sites[key]
+
+    def record_failure(self, key, failure):
+        """Count a failure. Returns the pause in seconds if this opened the circuit, else 0."""
+        now = time.monotonic()
+        if failure != RATE_LIMITED:
+            with self._lock:
+                site = self._sites.get(key)
+                if site and site['trial'] and site['open_until'] <= now:
+                    if failure == PERMANENT:
+                        del self._sites[key]  # The site served an answer, it is not holding us back
+                    else:
+                        site['trial'] = False
+            return 0
+        with self._lock:
+            site = self._site(key)
+            site['failures'] = [t for t in site['failures'] if now - t < self.window] + [now]
+            if site['open_until'] > now:
+                return 0  # Already open; a download that started before the trip
+            if len(site['failures']) < self.threshold and not site['trial']:
+                return 0
+            pause = min(self.cooldown * (2 ** site['trips']), self.max_cooldown)
+            site['trips'] += 1
+            site['open_until'] = now + pause
+            site['failures'] = []
+            site['trial'] = True
+            return pause
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {key: {'state': 'open' if site['open_until'] > now else 'half-open' if site['trial'] else 'closed',
+                          'open_for': max(0, site['open_until'] - now),
+                          'trips': site['trips']}
+                    for key, site in self._sites.items()}
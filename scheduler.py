@@ -0,0 +1,316 @@
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from urllib.parse import urlparse
+
+# Hosts that are served by the same extractor share one slot pool
+HOST_ALIASES = {
+    'youtu.be': 'youtube.com',
+    'm.youtube.com': 'youtube.com',
+    'music.youtube.com': 'youtube.com',
+    'youtube-nocookie.com': 'youtube.com',
+    'vm.tiktok.com': 'tiktok.com',
+    'x.com': 'twitter.com',
+    'mobile.twitter.com': 'twitter.com',
+    'player.vimeo.com': 'vimeo.com',
+}
+
+
+def host_key(url):
+    """Return the slot pool key (normalized host) for a URL"""
+    try:
+        host = (urlparse(url).hostname or '').lower()
+    except ValueError:
+        host = ''
+    if host.startswith('www.'):
+        host = host[4:]
+    return HOST_ALIASES.get(host, host) or 'unknown'
+
+
+def parse_host_limits(value):
+    """Parse 'youtube.com=3,vimeo.com=1' into a dict of per-host slot limits"""
+    limits = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        host, limit = item.split('=', 1)
+        try:
+            limits[host.strip().lower()] = max(1, int(limit))
+        except ValueError:
+            continue
+    return limits
+
+
+class Job:
+    """A single URL waiting for (or holding) a download slot"""
+
+    def __init__(self, url, url_index, options, job_id=None, attempts=0, parent_id=None, batch_id=None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.url = url
+        self.url_index = url_index
+        self.options = options
+        self.host = host_key(url)
+        self.status = 'queued'
+        self.progress = 0
+        self.attempts = attempts
+        self.parent_id = parent_id  # Playlist job this entry was expanded from
+        self.batch_id = batch_id    # Bulk upload (/download/bulk) the job came from
+        self.url_key = None      # Canonical key ('extractor:id', or the normalized URL) for dedupe
+        self.entries = None      # Number of child jobs, for a playlist job once it is expanded
+        self.retries = 0         # Retries scheduled after failed attempts
+        self.failure = None      # Failure class of the last failed attempt (see retry.py)
+        self.error_lines = deque(maxlen=20)  # Recent error output, for classifying failures
+        self.subtitles = None    # Future of the subtitle-only side pass, if one was started
+        self.output_path = None
+        self.error = None
+        self.progress_saved_at = 0  # Last time progress was written to the job store
+        self.download_status = None  # Status of the last progress record ('downloading', 'finished', ...)
+        self.restarting = False  # Why the process is being stopped to restart it: 'bandwidth' or 'acceleration'
+        self.process_started_at = 0
+        self.attempt_started_at = 0  # time.monotonic() when the current attempt started
+        self.timings = {}        # Seconds spent per stage: extraction, ttfb, download, postprocess
+        self.speed = None        # Last reported download speed (bytes/s)
+        self.downloaded_bytes = None  # Bytes of the current file seen so far, for the byte counter
+        self.attempt_bytes = 0   # Bytes downloaded in the current attempt, for acceleration tuning
+        self.acceleration = None  # acceleration.Plan of the running yt-dlp process, if any
+        self.fragment_retries = 0  # Fragment retries seen in the running yt-dlp process
+        self.estimated_size = None  # Expected download size in bytes, set when admitted (see storage.DiskBudget)
+        self.process = None      # Running yt-dlp process, if any
+        self.cancelled = False
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'url': self.url,
+            'url_index': self.url_index,
+            'host': self.host,
+            'status': self.status,
+            'progress': self.progress,
+            'attempts': self.attempts,
+            'output_path': self.output_path,
+            'error': self.error,
+            'failure': self.failure,
+            'parent_id': self.parent_id,
+            'batch_id': self.batch_id,
+            'entries': self.entries,
+            'timings': dict(self.timings),
+            'estimated_size': self.estimated_size,
+        }
+
+    def cancel(self):
+        """Flag the job as cancelled and stop its process if one is running"""
+        self.cancelled = True
+        process = self.process
+        if process and process.poll() is None:
+            process.terminate()
+
+
+class DownloadScheduler:
+    """Feeds queued jobs to a fixed pool of worker threads.
+
+    At most ``max_workers`` jobs run at once, and at most ``per_host_limit``
+    (or the host's entry in ``host_limits``) of them may target the same host.
+    Hosts are served round-robin so one large batch cannot starve the others.
+
+    Jobs submitted with a delay (retry backoff) wait in a timer heap rather
+    than in a worker, and an optional ``breaker`` (retry.CircuitBreaker) can
+    hold back every job for a host while that host is rate limiting us. An
+    optional ``admission`` (storage.DiskBudget) holds back a job until it
+    fits on disk, letting later jobs for the same host that do fit go first;
+    its prepare() runs on submit, outside the lock.
+    """
+
+    def __init__(self, run_job, max_workers=4, per_host_limit=2, host_limits=None, breaker=None, admission=None):
+        self.run_job = run_job
+        self.max_workers = max(1, max_workers)
+        self.per_host_limit = max(1, per_host_limit)
+        self.host_limits = host_limits or {}
+        self.breaker = breaker
+        self.admission = admission
+        self._pending = OrderedDict()  # host -> deque of jobs
+        self._active = {}              # host -> running job count
+        self._delayed = []             # heap of (due time, seq, job) waiting out a backoff
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._workers = []
+        self._running = {}             # job id -> running job
+
+    def host_limit(self, host):
+        return self.host_limits.get(host, self.per_host_limit)
+
+    def submit(self, job):
+        """Queue a job and return immediately"""
+        if self.admission:
+            self.admission.prepare(job)
+        with self._cond:
+            self._pending.setdefault(job.host, deque()).append(job)
+            self._ensure_workers()
+            self._cond.notify()
+        return job.id
+
+    def submit_later(self, job, delay):
+        """Queue a job after delay seconds without tying up a worker in the meantime"""
+        with self._cond:
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._seq), job))
+            self._ensure_workers()
+            self._cond.notify()
+        return job.id
+
+    def acquire_slot(self, host, timeout=0):
+        """Take a slot for host outside the worker pool (a side request such as a subtitle pass).
+
+        Waits up to timeout seconds for the host to have a free slot and no open
+        circuit. Returns True if a slot was taken; pair it with release_slot().
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                active = self._active.get(host, 0)
+                wait = 0 if active < self.host_limit(host) else None
+                if wait == 0 and self.breaker:
+                    wait = self.breaker.blocked_for(host, active)
+                if wait == 0:
+                    self._active[host] = active + 1
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining if wait is None else min(wait, remaining))
+
+    def release_slot(self, host):
+        with self._cond:
+            self._active[host] -= 1
+            if not self._active[host]:
+                del self._active[host]
+            self._cond.notify_all()
+
+    def _release_due(self):
+        """Move delayed jobs whose time has come to the pending queues. Returns seconds until the next one."""
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            job = heapq.heappop(self._delayed)[2]
+            self._pending.setdefault(job.host, deque()).append(job)
+        return self._delayed[0][0] - now if self._delayed else None
+
+    def _ensure_workers(self):
+        # Workers are started lazily so importing the app has no side effects
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._worker_loop, name=f'download-worker-{len(self._workers) + 1}')
+            worker.daemon = True
+            self._workers.append(worker)
+            worker.start()
+
+    def _next_job(self):
+        """Pop the first job whose host has a free slot, rotating hosts for fairness.
+
+        Returns (job, wait): wait is how long until a delayed or paused job may
+        become available when no job is (None if nothing is waiting on a timer).
+        """
+        wait = self._release_due()
+        for host in list(self._pending):
+            active = self._active.get(host, 0)
+            if active >= self.host_limit(host):
+                continue
+            blocked = self.breaker.blocked_for(host, active) if self.breaker else 0
+            if blocked > 0:
+                wait = blocked if wait is None else min(wait, blocked)
+                continue
+            jobs = self._pending[host]
+            index = 0
+            if self.admission:
+                # Last check: admitting a job sets its disk space aside
+                for index, job in enumerate(jobs):
+                    blocked = self.admission.admit(job)
+                    if not blocked:
+                        break
+                    wait = blocked if wait is None else min(wait, blocked)
+                else:
+                    continue
+            del self._pending[host]
+            job = jobs[index]
+            del jobs[index]
+            if jobs:
+                # Re-insert at the end so the next dispatch prefers another host
+                self._pending[host] = jobs
+            return job, None
+        return None, wait
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job, wait = self._next_job()
+                while job is None:
+                    self._cond.wait(wait)
+                    job, wait = self._next_job()
+                self._active[job.host] = self._active.get(job.host, 0) + 1
+                self._running[job.id] = job
+                job.status = 'running'
+
+            try:
+                self.run_job(job)
+            except Exception as e:
+                print(f"[URL {job.url_index + 1}] ✗ Worker error: {str(e)}")
+            finally:
+                with self._cond:
+                    self._active[job.host] -= 1
+                    if not self._active[job.host]:
+                        del self._active[job.host]
+                    self._running.pop(job.id, None)
+                    # A freed host slot may unblock a job any idle worker can take
+                    self._cond.notify_all()
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns the job, or None if unknown."""
+        with self._cond:
+            job = self._running.get(job_id)
+            for index, (_, _, delayed) in enumerate(self._delayed):
+                if job is None and delayed.id == job_id:
+                    job = delayed
+                    self._delayed.pop(index)
+                    heapq.heapify(self._delayed)
+                    break
+            if job is None:
+                for host, jobs in list(self._pending.items()):
+                    for queued in jobs:
+                        if queued.id == job_id:
+                            job = queued
+                            jobs.remove(queued)
+                            if not jobs:
+                                del self._pending[host]
+                            break
+                    if job:
+                        break
+        if job:
+            job.cancel()
+        return job
+
+    def get(self, job_id):
+        """Return the live job object for a queued or running job"""
+        with self._cond:
+            if job_id in self._running:
+                return self._running[job_id]
+            for _, _, job in self._delayed:
+                if job.id == job_id:
+                    return job
+            for jobs in self._pending.values():
+                for job in jobs:
+                    if job.id == job_id:
+                        return job
+        return None
+
+    def running_jobs(self):
+        with self._cond:
+            return list(self._running.values())
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_workers': self.max_workers,
+                'running': len(self._running),
+                'queued': sum(len(jobs) for jobs in self._pending.values()),
+                'delayed': len(self._delayed),
+                'active_hosts': dict(self._active),
+            }
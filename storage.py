@@ -0,0 +1,286 @@
+import errno
+import os
+import shutil
+import sys
+import threading
+import time
+
+# Files yt-dlp leaves behind for an unfinished download; never moved to the download path
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp')
+
+SIZE_MARGIN = 1.1  # Head room on estimated sizes: estimates are approximate and merging needs a little extra
+FREE_SPACE_INTERVAL = 1  # Seconds between free space checks of the filesystems jobs write to
+
+
+def estimate_size(formats, duration=None):
+    """Expected download size in bytes of the formats a job will fetch, or None if it cannot tell"""
+    if not formats:
+        return None
+    total = 0
+    for f in formats:
+        size = f.get('filesize') or f.get('filesize_approx')
+        if not size and f.get('tbr') and duration:
+            size = f['tbr'] * 1000 / 8 * duration  # tbr is in kbit/s
+        if not size:
+            return None
+        total += size
+    return int(total)
+
+
+def dir_size(path):
+    """Bytes of all files under path (0 if it does not exist)"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path) if path else None
+    except OSError:
+        return None
+
+
+def move_file(src, dst):
+    """Move src to dst so dst never exists half-written. Returns False, leaving
+    both alone, if dst already exists: like yt-dlp's --no-overwrites.
+
+    A rename when both are on one filesystem; otherwise a copy to a
+    temporary name next to dst, renamed into place once complete.
+    """
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    if os.path.lexists(dst):
+        return False
+    try:
+        os.replace(src, dst)
+        return True
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    temp_path = f'{dst}.{os.getpid()}.moving'
+    try:
+        shutil.copy2(src, temp_path)
+        if os.path.lexists(dst):
+            os.remove(temp_path)
+            return False
+        os.replace(temp_path, dst)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    os.remove(src)
+    return True
+
+
+def move_tree(src_dir, dst_dir):
+    """Move the finished files under src_dir to the same relative paths under dst_dir.
+
+    Returns ({source path: destination path}, [destination paths that already
+    existed]). A file already at the destination is kept and the staged one
+    dropped. Leftover partial files stay behind.
+    """
+    moved, kept = {}, []
+    for root, _, files in os.walk(src_dir):
+        for name in files:
+            if name.endswith(PARTIAL_SUFFIXES):
+                continue
+            src = os.path.join(root, name)
+            dst = os.path.join(dst_dir, os.path.relpath(src, src_dir))
+            if not move_file(src, dst):
+                os.remove(src)
+                kept.append(dst)
+            moved[src] = dst
+    return moved, kept
+
+
+def adopt_existing(filepath, staging_dir, final_dir, final_ext=None, checks_final_ext=True):
+    """Bring what the download path already has for filepath into staging before yt-dlp looks.
+
+    yt-dlp only checks its own output directory (the staging one) for a
+    finished file to skip or a .part file to resume. A finished file at the
+    final path is linked (or copied) in, so yt-dlp reports it as already
+    downloaded; move_tree() later keeps the original. Partial files of the
+    same name are moved in, so --continue resumes them.
+
+    final_ext is the extension post-processing gives the file (audio
+    extraction), so a finished file with it counts too. It is linked in
+    under that extension when yt-dlp checks for it (its final_ext param),
+    otherwise (yt-dlp.exe, which gets no -x) under filepath's own name;
+    extract_audio() then only has to copy the stream.
+    """
+    rel = os.path.relpath(filepath, staging_dir)
+    if rel.startswith(os.pardir):
+        return
+    target = os.path.join(final_dir, rel)
+    target_dir, stem = os.path.split(os.path.splitext(target)[0])
+    try:
+        names = os.listdir(target_dir)
+    except OSError:
+        return
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    for name in names:
+        # name.part, or name.f137.mp4.part for the streams of a merged format
+        if name.startswith(stem + '.') and name.endswith(PARTIAL_SUFFIXES):
+            src = os.path.join(target_dir, name)
+            move_file(src, os.path.join(os.path.dirname(filepath), name))
+    staged = filepath
+    if not os.path.isfile(target) and final_ext:
+        target = f'{os.path.splitext(target)[0]}.{final_ext}'
+        if checks_final_ext:
+            staged = f'{os.path.splitext(filepath)[0]}.{final_ext}'
+    if os.path.isfile(target) and not os.path.lexists(staged):
+        try:
+            os.link(target, staged)
+        except OSError:
+            shutil.copy2(target, staged)
+
+
+class DiskBudget:
+    """Admission control: start a download only when its estimated size fits on disk.
+
+    ``estimate(job)`` gives a job's expected size in bytes (None if
+    unknown) and ``locate(job)`` its (staging dir, final dir). A job fits
+    when, on each filesystem it writes to, the free space minus ``reserve``
+    and minus what admitted jobs will still write there covers its size.
+    Admitted jobs are counted until release(), which app.py calls when a
+    job reaches a final status, so retries keep their place. Used as the
+    DownloadScheduler's ``admission``.
+
+    A job that does not fit yet gets status ``waiting_disk``. A job bigger
+    than the free space minus ``reserve``, which no amount of waiting for
+    other downloads frees, is let through uncounted so its worker can fail
+    it with the reason refused() gives.
+
+    admit() runs under the scheduler's lock, so it only does arithmetic:
+    prepare(), called when a job is submitted, works out its size and
+    filesystems, and a background thread keeps the free space figures
+    current.
+    """
+
+    def __init__(self, estimate, locate, reserve=0, recheck=5):
+        self.estimate = estimate
+        self.locate = locate
+        self.reserve = reserve
+        self.recheck = recheck  # Seconds before a job that did not fit is looked at again
+        self._lock = threading.Lock()
+        self._prepared = {}  # job id -> (needed bytes, staging device, final device, staging dir, final dir)
+        self._admitted = {}  # job id -> (job, needed bytes, staging device, final device)
+        self._waiting = set()  # Jobs already reported as waiting for space
+        self._refused = {}  # job id -> why the job can never fit
+        self._free = {}  # device -> (path on it, free bytes)
+        self._refresher = None
+
+    @staticmethod
+    def _device(path):
+        """(device, path) of the nearest existing directory at or above path; queued jobs have no directory yet"""
+        while not os.path.exists(path) and os.path.dirname(path) != path:
+            path = os.path.dirname(path)
+        return os.stat(path).st_dev, path
+
+    def prepare(self, job):
+        """Work out a job's size and filesystems for admit(); call it outside the scheduler's lock"""
+        size = self.estimate(job)
+        staging_dir, final_dir = self.locate(job)
+        devices = []
+        for path in (staging_dir, final_dir):
+            device, existing = self._device(path)
+            with self._lock:
+                known = device in self._free
+            if not known:
+                free = shutil.disk_usage(existing).free
+                with self._lock:
+                    self._free.setdefault(device, (existing, free))
+            devices.append(device)
+        with self._lock:
+            self._prepared[job.id] = (size, devices[0], devices[1], staging_dir, final_dir)
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop, name='disk-budget', daemon=True)
+                self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(FREE_SPACE_INTERVAL)
+            with self._lock:
+                paths = {device: path for device, (path, _) in self._free.items()}
+            for device, path in paths.items():
+                try:
+                    free = shutil.disk_usage(path).free
+                except OSError:
+                    continue
+                with self._lock:
+                    self._free[device] = (path, free)
+
+    def _pending(self, device):
+        """Bytes admitted jobs will still write to a filesystem"""
+        pending = 0
+        for job, needed, staging, final in self._admitted.values():
+            if staging == device:
+                # The partial download is already on disk, so only count the rest
+                pending += needed * (1 - min(job.progress or 0, 100) / 100)
+            elif final == device:
+                pending += needed  # Arrives when the job is moved out of staging
+        return pending
+
+    def admit(self, job):
+        """0 if job may start now (it is then counted), else seconds until it should be tried again"""
+        with self._lock:
+            if job.id in self._admitted:
+                return 0  # A retry; its space is still set aside
+            prepared = self._prepared.get(job.id)
+        if prepared is None:
+            self.prepare(job)  # Only for jobs that reached the scheduler without submit()
+        with self._lock:
+            size, staging, final, staging_dir, final_dir = self._prepared[job.id]
+            needed = size * SIZE_MARGIN if size else 0
+            for device, path in {staging: staging_dir, final: final_dir}.items():
+                capacity = self._free[device][1] - self.reserve
+                if needed > capacity:
+                    self._refused[job.id] = (f"Not enough disk space on {path}: needs {needed / 2**20:.0f} MiB, "
+                                             f"{max(capacity, 0) / 2**20:.0f} MiB free")
+                    self._waiting.discard(job.id)
+                    return 0
+                available = capacity - self._pending(device)
+                if needed > available or available <= 0:
+                    job.status = 'waiting_disk'
+                    if job.id not in self._waiting:
+                        self._waiting.add(job.id)
+                        print(f"[URL {job.url_index + 1}] Waiting for disk space on {path}: "
+                              f"needs {needed / 2**20:.0f} MiB, {max(available, 0) / 2**20:.0f} MiB available")
+                    return self.recheck
+            self._waiting.discard(job.id)
+            job.estimated_size = size
+            self._admitted[job.id] = (job, needed, staging, final)
+            return 0
+
+    def refused(self, job_id):
+        """Why a job let through by admit() can never fit on disk, or None"""
+        with self._lock:
+            return self._refused.get(job_id)
+
+    def release(self, job_id):
+        with self._lock:
+            self._admitted.pop(job_id, None)
+            self._prepared.pop(job_id, None)
+            self._waiting.discard(job_id)
+            self._refused.pop(job_id, None)
+
+    def reserved(self):
+        """Bytes admitted jobs will still write, over all filesystems"""
+        with self._lock:
+            devices = {device for _, _, staging, final in self._admitted.values() for device in (staging, final)}
+            return sum(self._pending(device) for device in devices)
+
+
+if __name__ == '__main__':
+    # yt-dlp.exe runs this as its before_dl hook: storage.py adopt <staging dir> <final dir> [<final ext>] <file>
+    if sys.argv[1:2] == ['adopt'] and len(sys.argv) in (5, 6):
+        adopt_existing(sys.argv[-1], sys.argv[2], sys.argv[3], *sys.argv[4:-1], checks_final_ext=False)
+    else:
+        sys.exit('usage: storage.py adopt STAGING_DIR FINAL_DIR [FINAL_EXT] FILE')
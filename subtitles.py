@@ -0,0 +1,99 @@
+import glob
+import os
+import shutil
+import subprocess
+
+try:
+    from yt_dlp.utils import ISO639Utils
+except ImportError:
+    ISO639Utils = None
+
+# Extensions yt-dlp writes subtitles with
+SUBTITLE_EXTS = ('srt', 'vtt', 'ass', 'ssa', 'lrc', 'ttml', 'srv1', 'srv2', 'srv3', 'json3')
+
+# Containers ffmpeg can embed subtitle streams into (same list as yt-dlp's FFmpegEmbedSubtitlePP)
+EMBED_EXTS = ('mp4', 'mov', 'm4a', 'webm', 'mkv', 'mka')
+
+EMBED_TIMEOUT = 600  # Seconds; the embed only remuxes, but files can be large
+
+
+def wants_subtitles(options):
+    return bool(options.get('writeSub') or options.get('embedSubs') or options.get('persianSubs'))
+
+
+def subtitle_languages(options):
+    """Requested subtitle languages, without duplicates"""
+    langs = []
+    if options.get('subtitleLangs'):
+        langs.extend([lang.strip() for lang in options.get('subtitleLangs').split(',') if lang.strip()])
+    if options.get('persianSubs'):
+        # Also try auto-generated Persian
+        langs.extend(['fa', 'fa-auto'])
+    return list(dict.fromkeys(langs))
+
+
+def subtitle_args(options):
+    """yt-dlp arguments for the subtitle-only pass (run with --skip-download)"""
+    sub_format = options.get('subtitleFormat', 'srt')
+    args = ['--skip-download', '--write-subs']
+    if options.get('writeSub') or options.get('persianSubs'):
+        args.append('--write-auto-subs')
+    langs = subtitle_languages(options)
+    if langs:
+        args.extend(['--sub-langs', ','.join(langs)])
+    # Prefer the requested format, fall back to whatever exists and convert it
+    args.extend(['--sub-format', f'{sub_format}/best', '--convert-subs', sub_format])
+    return args
+
+
+def find_subtitle_files(media_path):
+    """Subtitle files written next to a media file, as {lang: path}"""
+    stem = os.path.splitext(media_path)[0]
+    found = {}
+    for path in glob.glob(glob.escape(stem) + '.*.*'):
+        lang, _, ext = os.path.basename(path)[len(os.path.basename(stem)) + 1:].rpartition('.')
+        if ext in SUBTITLE_EXTS and lang and '.' not in lang:
+            found[lang] = path
+    return found
+
+
+def embed_subtitles(media_path, subtitle_files):
+    """Mux subtitle files into media_path in place with ffmpeg (stream copy).
+
+    Returns the list of embedded subtitle files. Raises RuntimeError if ffmpeg
+    is missing or fails.
+    """
+    ext = os.path.splitext(media_path)[1][1:].lower()
+    if ext not in EMBED_EXTS:
+        raise RuntimeError(f"Subtitles can only be embedded in {', '.join(EMBED_EXTS)} files")
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise RuntimeError('ffmpeg not found, subtitles were kept as separate files')
+
+    # webm only takes WebVTT; everything else takes any text format
+    subtitles = [(lang, path) for lang, path in sorted(subtitle_files.items())
+                 if ext != 'webm' or path.endswith('.vtt')]
+    if not subtitles:
+        return []
+
+    cmd = [ffmpeg, '-y', '-loglevel', 'error', '-i', media_path]
+    for _, path in subtitles:
+        cmd.extend(['-i', path])
+    # Copy every stream except existing subtitles, which are replaced
+    cmd.extend(['-map', '0', '-dn', '-ignore_unknown', '-c', 'copy', '-map', '-0:s'])
+    if ext in ('mp4', 'mov', 'm4a'):
+        cmd.extend(['-c:s', 'mov_text'])
+    for i, (lang, _) in enumerate(subtitles):
+        lang_code = (ISO639Utils.short2long(lang) if ISO639Utils else None) or lang
+        cmd.extend(['-map', f'{i + 1}:0', f'-metadata:s:s:{i}', f'language={lang_code}'])
+    temp_path = f'{os.path.splitext(media_path)[0]}.temp.{ext}'
+    cmd.append(temp_path)
+
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=EMBED_TIMEOUT)
+    if result.returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        errors = result.stderr.decode('utf-8', errors='replace').strip().splitlines()
+        raise RuntimeError(errors[-1] if errors else f'ffmpeg exited with code {result.returncode}')
+    os.replace(temp_path, media_path)
+    return [path for _, path in subtitles]